@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   Container,
   Grid,
@@ -56,6 +56,7 @@ const Dashboard = () => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const [lastUpdate, setLastUpdate] = useState('');
+  const checkPending = useRef(false);
   const [backendConnected, setBackendConnected] = useState(false);
   const [reportMenuAnchorEl, setReportMenuAnchorEl] = useState(null);
   const [isReportMenuOpen, setIsReportMenuOpen] = useState(false);
@@ -90,6 +91,24 @@ const Dashboard = () => {
     }
   };
 
+  // Checks queue behind running update jobs, so their result fills in the updates list when it arrives
+  const refreshUpdates = async () => {
+    if (checkPending.current) {
+      return;
+    }
+    checkPending.current = true;
+    try {
+      const response = await apiService.checkUpdates();
+      if (response.data.updates) {
+        setUpdates(response.data.updates);
+      }
+    } catch (err) {
+      console.error('Error checking for updates:', err);
+    } finally {
+      checkPending.current = false;
+    }
+  };
+
   const fetchData = async () => {
     try {
       setLoading(true);
@@ -106,11 +125,11 @@ const Dashboard = () => {
         return;
       }
 
-      // Fetch all data in parallel
+      // Fetch all data in parallel; updates come from the last check until the new one finishes
       const [systemResponse, containersResponse, updatesResponse] = await Promise.all([
         apiService.getSystemInfo(),
         apiService.getContainers(),
-        apiService.checkUpdates()
+        apiService.getLatestUpdates()
       ]);
 
       setSystemInfo(systemResponse.data);
@@ -118,6 +137,7 @@ const Dashboard = () => {
       setUpdates(updatesResponse.data.updates || []);
       setLastUpdate(new Date().toLocaleTimeString());
       setError('');
+      refreshUpdates();
     } catch (err) {
       setBackendConnected(false);
       setError('Failed to fetch data from backend server. Make sure Flask is running on port 5000.');
@@ -11,6 +11,20 @@ const api = axios.create({
   },
 });
 
+// Poll a background job until it finishes and resolve with its result
+const waitForJob = async (jobId, interval = 1000) => {
+  for (;;) {
+    const { data: job } = await api.get(`/jobs/${jobId}`);
+    if (job.status === 'succeeded') {
+      return { data: job.result };
+    }
+    if (job.status === 'failed') {
+      return { data: { success: false, error: job.error } };
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+};
+
 // API service functions
 export const apiService = {
   // Health check
@@ -22,14 +36,28 @@ export const apiService = {
   stopContainer: (name) => api.post(`/container/${name}/stop`),
   
   // Updates
-  checkUpdates: () => api.get('/check-updates'),
-  runUpdate: () => api.post('/run-update'),
+  // Detection can outlast the request timeout, so it runs as a job (shared with other pollers)
+  checkUpdates: async () => {
+    const { data } = await api.post('/check-updates');
+    return waitForJob(data.job_id);
+  },
+  // The last check's result, answered at once even while jobs are queued
+  getLatestUpdates: () => api.get('/updates/latest'),
+  runUpdate: async () => {
+    const { data } = await api.post('/run-update');
+    return waitForJob(data.job_id);
+  },
+  getJob: (jobId) => api.get(`/jobs/${jobId}`),
   
   // System info
   getSystemInfo: () => api.get('/system-info'),
 
   // Reporting
   generateReport: (format) => api.get(`/generate-report?format=${format}`, { responseType: 'blob' }),
+  getReports: (params = {}) => api.get('/reports', { params }),
+  getReport: (id) => api.get(`/reports/${id}`),
+  getReportResults: (params = {}) => api.get('/reports/results', { params }),
+  getReportStats: (params = {}) => api.get('/reports/stats', { params }),
 };
 
 // Request interceptor
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Benchmark full update cycles against a fake runtime and registry
+
+Every scenario builds a fresh fake podman state (benchmarks/fake_podman.py)
+with N containers spread over a set of images, some of them outdated, and
+serves the matching manifests from an in-process registry. A full cycle
+then runs in a child process, through either the CLI path
+(AutoPatch.run_update_cycle) or the API path
+(AutoPatchManager.run_autopatch, which needs Flask installed). With --hosts
+every host gets its own copy of the fake runtime (and --sizes containers),
+all sharing the registry. With --engine socket AutoPatch talks to each host
+through the REST API backend instead, served on a unix socket by
+benchmarks/fake_engine_api.py from the same state. The benchmark reports
+wall time, fake podman invocations (API requests and connections with
+--engine socket), bytes "pulled" and the child's peak RSS:
+
+    python benchmarks/cycle_benchmark.py
+    python benchmarks/cycle_benchmark.py --sizes 100 --latency pull=1.5 --failure-rate run=0.02
+    python benchmarks/cycle_benchmark.py --sizes 100 --hosts 8
+    python benchmarks/cycle_benchmark.py --sizes 100 --images 20 --pull-limit 3/5 --pulls-per-minute 30
+    python benchmarks/cycle_benchmark.py --target api --json
+    python benchmarks/cycle_benchmark.py --sizes 100 --engine socket
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import yaml
+
+from fake_engine_api import FakeEngineApi
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(BENCH_DIR, os.pardir, 'src'))
+
+# Seconds each fake podman command takes, roughly a local engine's speed
+DEFAULT_LATENCY = {
+    'ps': 0.05,
+    'inspect': 0.03,
+    'image inspect': 0.03,
+    'pull': 0.3,
+    'run': 0.15,
+    'stop': 0.1,
+    'start': 0.05,
+    'rm': 0.03,
+    'rename': 0.02
+}
+
+
+def digest_of(text):
+    return 'sha256:' + hashlib.sha256(text.encode()).hexdigest()
+
+
+def image_layers(ref, version, image_size):
+    """[diff ID, bytes] per layer: a base shared by every image, a runtime layer per
+    repository and an application layer that changes with each version"""
+    return [
+        [digest_of('base'), image_size * 6 // 10],
+        [digest_of(f"runtime {ref}"), image_size * 3 // 10],
+        [digest_of(f"app {ref} {version}"), image_size - image_size * 9 // 10]
+    ]
+
+
+class FakeRegistry:
+    """Registry v2 manifest and config blob endpoints serving one digest per benchmark repository"""
+
+    def __init__(self):
+        self.manifests = {}
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _manifest(self):
+                # /v2/<repo>/manifests/<tag or digest>
+                repo, _, ref = self.path[len('/v2/'):].rpartition('/manifests/')
+                if ref.startswith('sha256:'):
+                    return next((manifest for name, manifest in registry.manifests.items()
+                                 if name.startswith(f"{repo}:") and manifest['digest'] == ref), None)
+                return registry.manifests.get(f"{repo}:{ref}")
+
+            def do_HEAD(self):
+                manifest = self._manifest()
+                if manifest is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Docker-Content-Digest', manifest['digest'])
+                self.send_header('ETag', f'"{manifest["digest"]}"')
+                self.end_headers()
+
+            def do_GET(self):
+                if '/blobs/' in self.path:
+                    # Image config blobs, which list each layer's diff ID
+                    digest = self.path.rpartition('/blobs/')[2]
+                    manifest = next((m for m in registry.manifests.values() if m['config_digest'] == digest), None)
+                    body = json.dumps({'rootfs': {'type': 'layers', 'diff_ids': [layer for layer, _ in manifest['layers']]}}
+                                      if manifest else {}).encode()
+                    content_type = 'application/vnd.oci.image.config.v1+json'
+                else:
+                    manifest = self._manifest()
+                    body = json.dumps({
+                        'schemaVersion': 2,
+                        'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+                        'config': {'digest': manifest['config_digest'], 'size': 1024},
+                        'layers': [{'digest': digest_of(f"blob {layer}"), 'size': size} for layer, size in manifest['layers']]
+                    }).encode() if manifest else None
+                    content_type = 'application/vnd.oci.image.manifest.v1+json'
+                if manifest is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Docker-Content-Digest', manifest['digest'])
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def build_host(hostdir, registry, count, images, outdated, image_size, args):
+    """Write one host's fake runtime state and settings; returns its podman executable
+    (or, with --engine socket, the FakeEngineApi serving the state)"""
+    os.makedirs(hostdir)
+    images = max(1, min(images, count))
+    refs = [f"{registry.host}/bench/app{index}:latest" for index in range(images)]
+    state = {'containers': {}, 'images': {}, 'tags': {}, 'remote': {}, 'pulled_bytes': 0, 'seq': 0}
+
+    # The first `outdated` share of the images has a newer digest in the registry than locally
+    outdated_refs = set(refs[:math.ceil(images * outdated)])
+    for ref in refs:
+        new_digest = digest_of(f"new {ref}")
+        local_digest = digest_of(f"old {ref}") if ref in outdated_refs else new_digest
+        new_layers = image_layers(ref, 'new', image_size)
+        registry.manifests[ref.split('/', 1)[1]] = {
+            'digest': new_digest, 'size': image_size, 'layers': new_layers, 'config_digest': digest_of(f"config {ref}")
+        }
+        state['remote'][ref] = {'digest': new_digest, 'size': image_size, 'layers': new_layers}
+        state['images'][f"img-{local_digest[7:19]}"] = {
+            'RepoDigests': [f"{ref.rsplit(':', 1)[0]}@{local_digest}"],
+            'Digest': local_digest,
+            'Size': image_size,
+            'Created': f"{time.time() - 86400:.6f}",
+            'layers': image_layers(ref, 'old' if ref in outdated_refs else 'new', image_size)
+        }
+        state['tags'][ref] = f"img-{local_digest[7:19]}"
+
+    for index in range(count):
+        ref = refs[index % images]
+        state['seq'] += 1
+        # Replicas of one image share a service name (app3-1, app3-2, ...)
+        state['containers'][f"app{index % images}-{index // images + 1}"] = {
+            'Id': f"{state['seq']:064x}",
+            'Image': ref,
+            'ImageID': state['tags'][ref],
+            'running': True
+        }
+
+    with open(os.path.join(hostdir, 'state.json'), 'w') as f:
+        json.dump(state, f)
+    with open(os.path.join(hostdir, 'settings.json'), 'w') as f:
+        json.dump({'latency': args.latency, 'failure_rate': args.failure_rate, 'pull_limit': args.pull_limit}, f)
+
+    if args.engine == 'socket':
+        return FakeEngineApi(hostdir)
+
+    # The copy keeps its state next to itself, so every host is independent
+    fake_podman = os.path.join(hostdir, 'podman')
+    shutil.copy(os.path.join(BENCH_DIR, 'fake_podman.py'), fake_podman)
+    os.chmod(fake_podman, 0o755)
+    return fake_podman
+
+
+def build_scenario(workdir, registry, count, images, outdated, image_size, args):
+    """Write every host's fake runtime and the AutoPatch config for one scenario
+
+    Returns the fake API engines serving the hosts (none with --engine cli).
+    """
+    hosts = [
+        build_host(os.path.join(workdir, f"host{index}"), registry, count, images, outdated, image_size, args)
+        for index in range(args.hosts)
+    ]
+    engines = [host for host in hosts if isinstance(host, FakeEngineApi)]
+    runtimes = [f"unix://{host.socket_path}" if isinstance(host, FakeEngineApi) else host for host in hosts]
+
+    logs = os.path.join(workdir, 'logs')
+    config = {
+        'autopatch': {
+            'schedule': '0 2 * * *',
+            'container_runtime': runtimes[0],
+            'hosts': [{'name': f"host{index}", 'runtime': runtime} for index, runtime in enumerate(runtimes)],
+            'fleet': {'max_parallel_hosts': args.max_parallel_hosts},
+            'update_detection': {'mode': args.mode},
+            'registries': {registry.host: {'insecure': True}},
+            'redeploy': {'strategy': args.strategy, 'readiness_delay': 0, 'max_parallel': args.max_parallel},
+            'throttling': {'pulls_per_minute': args.pulls_per_minute, 'backoff_base': 1},
+            'image_gc': {'keep_versions': args.keep_versions},
+            'inventory': {'resync_interval': 3600},
+            'logging': {
+                'log_level': 'WARNING',
+                'log_file': os.path.join(logs, 'autopatch.log'),
+                'report_dir': os.path.join(logs, 'reports'),
+                'state_dir': os.path.join(logs, 'state')
+            },
+            'containers': {'exclude': []}
+        }
+    }
+    with open(os.path.join(workdir, 'config.yaml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    return engines
+
+
+def run_child(workdir, target):
+    """Child process: run one full cycle and print its timing and memory"""
+    import resource
+    sys.path.insert(0, SRC_DIR)
+    os.chdir(workdir)
+
+    if target == 'api':
+        import api_server
+        started = time.perf_counter()
+        result = api_server.ap_manager.run_autopatch()
+        elapsed = time.perf_counter() - started
+        api_server.ap_manager.engine.stop_inventories()
+        details = result.get('results', [])
+    else:
+        from main import AutoPatch
+        autopatch = AutoPatch('config.yaml')
+        started = time.perf_counter()
+        report = autopatch.run_update_cycle() or {}
+        elapsed = time.perf_counter() - started
+        details = report.get('details', [])
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'wall_seconds': round(elapsed, 3),
+        'peak_rss_mb': round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'updated': len([r for r in details if r.get('status') == 'success']),
+        'failed': len([r for r in details if r.get('status') == 'failed'])
+    }))
+
+
+def run_scenario(registry, count, args):
+    workdir = tempfile.mkdtemp(prefix=f"autopatch-bench-{count}-")
+    engines = []
+    try:
+        engines = build_scenario(workdir, registry, count, args.images or max(1, count // 10), args.outdated, args.image_size, args)
+        env = dict(os.environ)
+        env.pop('FAKE_PODMAN_STATE', None)
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', workdir, '--target', args.target],
+            capture_output=True, text=True, env=env, cwd=workdir
+        )
+        if child.returncode != 0:
+            return {'containers': count * args.hosts, 'error': child.stderr.strip().splitlines()[-1] if child.stderr.strip() else 'failed'}
+
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        calls = Counter()
+        pulled_bytes = 0
+        for index in range(args.hosts):
+            hostdir = os.path.join(workdir, f"host{index}")
+            with open(os.path.join(hostdir, 'calls.log'), 'r') as f:
+                calls.update('image inspect' if line.startswith('image inspect') else line.split(' ', 1)[0]
+                             for line in f if line.strip())
+            with open(os.path.join(hostdir, 'state.json'), 'r') as f:
+                pulled_bytes += json.load(f)['pulled_bytes']
+
+        result.update({
+            'containers': count * args.hosts,
+            'subprocesses': sum(calls.values()),
+            'calls': dict(calls.most_common()),
+            'bytes_pulled': pulled_bytes
+        })
+        if engines:
+            result['connections'] = sum(engine.connections for engine in engines)
+        return result
+    finally:
+        for engine in engines:
+            engine.close()
+        if args.keep:
+            print(f"kept {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_pairs(text, defaults=None):
+    """'pull=0.5,run=0.1' -> {'pull': 0.5, 'run': 0.1} on top of defaults"""
+    values = dict(defaults or {})
+    for pair in filter(None, (text or '').split(',')):
+        key, _, value = pair.partition('=')
+        values[key.strip().replace('_', ' ')] = float(value)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AutoPatch update cycle benchmark on a fake runtime')
+    parser.add_argument('--sizes', default='10,100,1000', help='Container counts (per host) to benchmark')
+    parser.add_argument('--target', choices=['cli', 'api'], default='cli', help='run_update_cycle or run_autopatch')
+    parser.add_argument('--engine', choices=['cli', 'socket'], default='cli',
+                        help='Reach the fake hosts through the podman CLI or the REST API over a unix socket')
+    parser.add_argument('--mode', choices=['digest', 'pull'], default='digest', help='Update detection mode')
+    parser.add_argument('--strategy', choices=['swap', 'recreate'], default='swap', help='Redeploy strategy')
+    parser.add_argument('--max-parallel', type=int, default=4, help='redeploy.max_parallel')
+    parser.add_argument('--hosts', type=int, default=1, help='Fake hosts, each running --sizes containers')
+    parser.add_argument('--max-parallel-hosts', type=int, default=4, help='fleet.max_parallel_hosts')
+    parser.add_argument('--images', type=int, default=0, help='Distinct images (default: containers / 10)')
+    parser.add_argument('--outdated', type=float, default=0.5, help='Fraction of images with a newer registry digest')
+    parser.add_argument('--image-size', type=int, default=50 * 1024 * 1024, help='Bytes per image')
+    parser.add_argument('--latency', default='', help='Per-command latency overrides, e.g. pull=1.0,image_inspect=0.1')
+    parser.add_argument('--failure-rate', default='', help='Per-command failure probabilities, e.g. run=0.01')
+    parser.add_argument('--pull-limit', default='', help='Simulated registry pull limit per host, e.g. 5/10 (pulls/seconds)')
+    parser.add_argument('--pulls-per-minute', type=float, default=0, help='throttling.pulls_per_minute')
+    parser.add_argument('--keep-versions', type=int, default=1, help='image_gc.keep_versions')
+    parser.add_argument('--keep', action='store_true', help='Keep scenario directories for inspection')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--child', metavar='WORKDIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.target)
+        return 0
+
+    args.latency = parse_pairs(args.latency, DEFAULT_LATENCY)
+    args.failure_rate = parse_pairs(args.failure_rate)
+    args.pull_limit = [float(part) for part in args.pull_limit.split('/')] if args.pull_limit else None
+
+    registry = FakeRegistry()
+    try:
+        results = [run_scenario(registry, int(size), args) for size in args.sizes.split(',')]
+    finally:
+        registry.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    # Against the socket engine the calls are API requests, made over `conns` connections
+    calls = 'requests' if args.engine == 'socket' else 'subprocs'
+    conns = f" {'conns':>6}" if args.engine == 'socket' else ''
+    print(f"{'containers':>10} {'wall s':>8} {calls:>9} {'MB pulled':>10} {'peak MB':>8} {'updated':>8} {'failed':>7}{conns}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['containers']:>10}  error: {result['error']}")
+            continue
+        conns = f" {result['connections']:>6}" if 'connections' in result else ''
+        print(f"{result['containers']:>10} {result['wall_seconds']:>8} {result['subprocesses']:>9} "
+              f"{result['bytes_pulled'] / (1024 * 1024):>10.1f} {result['peak_rss_mb']:>8} "
+              f"{result['updated']:>8} {result['failed']:>7}{conns}")
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Fake Docker-compatible engine API on a unix socket, for ApiRuntime
+
+Serves the subset of the /v1.41 REST API that ApiRuntime uses (container
+list/inspect/create/start/stop/restart/rename/remove, image
+list/inspect/remove, streamed pulls, events, version and info) on top of
+the same state directory as benchmarks/fake_podman.py, so one scenario can
+be driven through either backend. Connections are HTTP/1.1 keep-alive and
+counted, which shows whether the runtime reuses them.
+
+    python benchmarks/fake_engine_api.py STATE_DIR [SOCKET]   serve STATE_DIR until interrupted
+    python benchmarks/fake_engine_api.py --check              exercise ApiRuntime against a tiny scenario
+"""
+
+import http.server
+import json
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import urllib.parse
+
+from fake_podman import CommandError, run_command
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(BENCH_DIR, os.pardir, 'src'))
+
+NOT_FOUND_MARKERS = ('no container', 'not known', 'manifest unknown')
+CONFLICT_MARKERS = ('already in use', 'in use by a container')
+
+
+class FakeEngineApi:
+    """Serves the fake runtime state in state_dir on socket_path from a background thread"""
+
+    def __init__(self, state_dir, socket_path=None):
+        self.state_dir = state_dir
+        self.socket_path = socket_path or os.path.join(state_dir, 'engine.sock')
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        engine = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with engine._lock:
+                    engine.connections += 1
+
+            def _send_json(self, status, data=None):
+                body = json.dumps(data).encode() if data is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data):
+                line = json.dumps(data).encode() + b'\n'
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b'\r\n')
+                self.wfile.flush()
+
+            def _stream(self, lines):
+                """Send newline-delimited JSON as a chunked response, one chunk per line"""
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for line in lines:
+                    self._send_chunk(line)
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _pull(self, ref):
+                yield {'status': f"Trying to pull {ref}..."}
+                try:
+                    image_id = run_command(['pull', ref], engine.state_dir)
+                except CommandError as e:
+                    # The engine reports pull failures inside the 200 stream
+                    yield {'error': str(e)}
+                    return
+                yield {'status': 'Download complete', 'id': image_id}
+
+            def _handle(self, method):
+                with engine._lock:
+                    engine.requests += 1
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                # Drop the API version prefix; path segments stay quoted until split
+                segments = [urllib.parse.unquote(part) for part in re.sub(r'^/v[\d.]+', '', url.path).split('/')[1:]]
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+
+                try:
+                    self._route(method, segments, query, body)
+                except CommandError as e:
+                    message = str(e)
+                    status = 404 if any(marker in message for marker in NOT_FOUND_MARKERS) else \
+                        409 if any(marker in message for marker in CONFLICT_MARKERS) else 500
+                    self._send_json(status, {'message': message})
+
+            def _route(self, method, segments, query, body):
+                state_dir = engine.state_dir
+                route = (method, segments[0] if segments else '', len(segments))
+
+                if route == ('GET', 'containers', 2) and segments[1] == 'json':
+                    self._send_json(200, json.loads(run_command(['ps', '--format', 'json'], state_dir)))
+                elif route == ('GET', 'containers', 3) and segments[2] == 'json':
+                    self._send_json(200, json.loads(run_command(['inspect', segments[1]], state_dir))[0])
+                elif route == ('POST', 'containers', 2) and segments[1] == 'create':
+                    container_id = run_command(['run', '-d', '--name', query['name'], body['Image']], state_dir)
+                    self._send_json(201, {'Id': container_id, 'Warnings': []})
+                elif route == ('POST', 'containers', 3) and segments[2] in ('start', 'stop', 'restart'):
+                    run_command([segments[2], segments[1]], state_dir)
+                    self._send_json(204)
+                elif route == ('POST', 'containers', 3) and segments[2] == 'rename':
+                    run_command(['rename', segments[1], query['name']], state_dir)
+                    self._send_json(204)
+                elif route == ('DELETE', 'containers', 2):
+                    run_command(['rm', segments[1]], state_dir)
+                    self._send_json(204)
+                elif route == ('GET', 'images', 2) and segments[1] == 'json':
+                    image_ids = run_command(['images', '-q', '--no-trunc'], state_dir).split()
+                    self._send_json(200, [{'Id': image_id} for image_id in image_ids])
+                elif route == ('GET', 'images', 3) and segments[2] == 'json':
+                    self._send_json(200, json.loads(
+                        run_command(['image', 'inspect', '--format', 'json', segments[1]], state_dir)
+                    )[0])
+                elif route == ('DELETE', 'images', 2):
+                    self._send_json(200, [{'Deleted': run_command(['rmi', segments[1]], state_dir)}])
+                elif route == ('POST', 'images', 2) and segments[1] == 'create':
+                    self._stream(self._pull(query['fromImage']))
+                elif route == ('GET', 'events', 1):
+                    # No live events; the inventory falls back to its periodic resync
+                    self._stream([])
+                elif route == ('GET', 'version', 1):
+                    self._send_json(200, {'Version': 'fake', 'ApiVersion': '1.41'})
+                elif route == ('GET', 'info', 1):
+                    self._send_json(200, {'OperatingSystem': 'fake'})
+                else:
+                    self._send_json(404, {'message': f"page not found: {method} {self.path}"})
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def check():
+    """Drive ApiRuntime through every call it makes against a one-container scenario"""
+    sys.path.insert(0, SRC_DIR)
+    from modules.container_runtime import ApiRuntime, ContainerRuntimeError
+
+    state_dir = tempfile.mkdtemp(prefix='fake-engine-')
+    ref = 'registry.local/app:latest'
+    state = {
+        'containers': {'web': {'Id': f"{1:064x}", 'Image': ref, 'ImageID': 'img-old', 'running': True}},
+        'images': {'img-old': {'RepoDigests': [f"registry.local/app@sha256:{'0' * 64}"], 'Size': 100, 'Created': '1',
+                               'layers': [['sha256:base', 60], ['sha256:app-old', 40]]}},
+        'tags': {ref: 'img-old'},
+        'remote': {ref: {'digest': f"sha256:{'1' * 64}", 'size': 100, 'layers': [['sha256:base', 60], ['sha256:app-new', 40]]}},
+        'pulled_bytes': 0,
+        'seq': 1
+    }
+    with open(os.path.join(state_dir, 'state.json'), 'w') as f:
+        json.dump(state, f)
+
+    engine = FakeEngineApi(state_dir)
+    runtime = ApiRuntime(engine.socket_path)
+    try:
+        assert [c['Names'] for c in runtime.list_containers()] == [['web']]
+        assert runtime.inspect_container('web')['Config']['Image'] == ref
+        assert [info['Id'] for info in runtime.inspect_containers(['web'])] == [f"{1:064x}"]
+
+        runtime.pull_image(ref)
+        try:
+            runtime.pull_image('registry.local/missing:latest')
+            raise AssertionError('pull of an unknown image succeeded')
+        except ContainerRuntimeError as e:
+            assert 'manifest unknown' in str(e)
+        assert runtime.inspect_image(ref)['RootFS']['Layers'] == ['sha256:base', 'sha256:app-new']
+        assert runtime.inspect_image('registry.local/missing:latest') is None
+
+        runtime.stop_container('web')
+        runtime.rename_container('web', 'web-old')
+        new_id = runtime.run_container('web', ref)
+        assert runtime.inspect_container(new_id)['State']['Running']
+        runtime.restart_container('web')
+        runtime.remove_container('web-old')
+        try:
+            runtime.start_container('web-old')
+            raise AssertionError('start of a removed container succeeded')
+        except ContainerRuntimeError as e:
+            assert 'no container' in str(e)
+
+        assert len(runtime.list_images()) == 2
+        runtime.remove_image('img-old')
+        assert [image['Id'] for image in runtime.list_images()] == [runtime.inspect_image(ref)['Id']]
+        assert list(runtime.events()) == []
+        assert runtime.get_info() == {'version': 'fake', 'os': 'fake'}
+
+        # Sequential calls, streamed pulls included, all went over one pooled connection
+        assert engine.connections == 1, f"{engine.connections} connections for {engine.requests} requests"
+        print(f"ok: {engine.requests} requests over {engine.connections} connection")
+    finally:
+        runtime.close()
+        engine.close()
+
+
+def main():
+    if sys.argv[1:] == ['--check']:
+        check()
+        return 0
+    if not 1 <= len(sys.argv[1:]) <= 2:
+        sys.stderr.write(__doc__)
+        return 2
+
+    engine = FakeEngineApi(*sys.argv[1:])
+    print(f"Serving {engine.state_dir} on unix://{engine.socket_path}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
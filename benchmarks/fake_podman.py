@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Stand-in `podman` executable for benchmarks
+
+Implements the subset of the podman CLI that AutoPatch uses against a JSON
+state file, so update cycles can be run at scale without a container
+engine. The state directory comes from $FAKE_PODMAN_STATE (default: the directory
+this script is in, so copies act as separate hosts) and holds:
+
+    state.json     containers, local images (with their layers), tags and what each pull fetches
+    settings.json  {"latency": {"pull": 0.5, ...}, "failure_rate": {"run": 0.01, ...},
+                    "pull_limit": [pulls, window seconds]}
+    calls.log      one line per invocation (the subprocess count)
+
+Latency is slept before the state lock is taken, so concurrent calls
+overlap the way they would against a real engine. run_command() is also
+used by fake_engine_api.py to serve the same state over the REST API.
+"""
+
+import fcntl
+import json
+import os
+import random
+import sys
+import time
+
+STATE_DIR = os.environ.get('FAKE_PODMAN_STATE') or os.path.dirname(os.path.abspath(__file__))
+
+
+class CommandError(Exception):
+    """A command the real engine would have refused"""
+
+
+def fail(message):
+    raise CommandError(message)
+
+
+def load_json(state_dir, name, default):
+    path = os.path.join(state_dir, name)
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def container_summary(name, container):
+    return {
+        'Id': container['Id'],
+        'Names': [name],
+        'Image': container['Image'],
+        'ImageID': container['ImageID'],
+        'Labels': container.get('Labels', {}),
+        'State': 'running',
+        'Status': 'Up',
+        'CreatedAt': container.get('CreatedAt', '')
+    }
+
+
+def container_inspect(name, container):
+    return {
+        'Id': container['Id'],
+        'Name': name,
+        'Image': container['ImageID'],
+        'Config': {'Image': container['Image'], 'Env': ['PATH=/usr/bin'], 'Labels': container.get('Labels', {})},
+        'HostConfig': {'PortBindings': {}, 'RestartPolicy': {'Name': 'always'}},
+        'Mounts': [],
+        'NetworkSettings': {'Networks': {'podman': {}}},
+        'State': {'Running': container['running'], 'Status': 'running' if container['running'] else 'exited'}
+    }
+
+
+def find_container(state, ref):
+    for name, container in state['containers'].items():
+        if name == ref or container['Id'].startswith(ref):
+            return name, container
+    fail(f"no container with name or ID {ref!r} found")
+
+
+def handle(args, state, settings):
+    """Run one command against state; returns (stdout, state changed)"""
+    command = args[0]
+    if command == 'ps':
+        return json.dumps([container_summary(n, c) for n, c in state['containers'].items() if c['running']]), False
+
+    if command == 'inspect':
+        refs = [arg for arg in args[1:] if not arg.startswith('--') and arg != 'container']
+        return json.dumps([container_inspect(*find_container(state, ref)) for ref in refs]), False
+
+    if command == 'image' and args[1] == 'inspect':
+        images = []
+        for ref in args[4:]:
+            image_id = state['tags'].get(ref, ref)
+            if image_id not in state['images']:
+                fail(f"{ref}: image not known")
+            image = dict(state['images'][image_id], Id=image_id)
+            image['RepoTags'] = [tag for tag, tagged_id in state['tags'].items() if tagged_id == image_id]
+            image['RootFS'] = {'Type': 'layers', 'Layers': [layer for layer, _ in image.pop('layers', [])]}
+            images.append(image)
+        return json.dumps(images), False
+
+    if command == 'images':
+        return '\n'.join(state['images']), False
+
+    if command == 'rmi':
+        image_id = state['tags'].get(args[1], args[1])
+        if image_id not in state['images']:
+            fail(f"{args[1]}: image not known")
+        users = [name for name, container in state['containers'].items() if container['ImageID'] == image_id]
+        if users:
+            fail(f"image used by {users[0]}: image is in use by a container")
+        del state['images'][image_id]
+        state['tags'] = {tag: tagged_id for tag, tagged_id in state['tags'].items() if tagged_id != image_id}
+        return image_id, True
+
+    if command == 'pull':
+        ref = args[1]
+        if settings.get('pull_limit'):
+            # Registry-style rate limit over a sliding window, shared by every pull of this host
+            limit, window = settings['pull_limit']
+            now = time.time()
+            state['pull_times'] = [t for t in state.get('pull_times', []) if t > now - window]
+            if len(state['pull_times']) >= limit:
+                fail(f"initializing source docker://{ref}: reading manifest: toomanyrequests: "
+                     f"You have reached your pull rate limit")
+            state['pull_times'].append(now)
+        remote = state['remote'].get(ref)
+        if remote is None:
+            fail(f"initializing source docker://{ref}: reading manifest: manifest unknown")
+        image_id = f"img-{remote['digest'][7:19]}"
+        if image_id not in state['images']:
+            # Only layers no local image has yet are downloaded
+            local_layers = {layer for image in state['images'].values() for layer, _ in image.get('layers', [])}
+            state['images'][image_id] = {
+                'RepoDigests': [f"{ref.rsplit(':', 1)[0]}@{remote['digest']}"],
+                'Digest': remote['digest'],
+                'Size': remote['size'],
+                'Created': f"{time.time():.6f}",
+                'layers': remote.get('layers', [])
+            }
+            state['pulled_bytes'] += sum(size for layer, size in remote.get('layers', []) if layer not in local_layers) \
+                if remote.get('layers') else remote['size']
+        state['tags'][ref] = image_id
+        return image_id, True
+
+    if command == 'run':
+        name = args[args.index('--name') + 1]
+        if name in state['containers']:
+            fail(f"the container name {name!r} is already in use")
+        image = args[-1]
+        state['seq'] += 1
+        state['containers'][name] = {
+            'Id': f"{state['seq']:064x}",
+            'Image': image,
+            'ImageID': state['tags'].get(image, image),
+            'running': True
+        }
+        return state['containers'][name]['Id'], True
+
+    if command in ('stop', 'start', 'restart', 'rm', 'rename'):
+        name, container = find_container(state, args[1])
+        if command == 'rm':
+            del state['containers'][name]
+        elif command == 'rename':
+            if args[2] in state['containers']:
+                fail(f"the container name {args[2]!r} is already in use")
+            state['containers'][args[2]] = state['containers'].pop(name)
+        else:
+            container['running'] = command != 'stop'
+        return name, True
+
+    if command == 'events':
+        # No live events; the inventory falls back to its periodic resync
+        return '', False
+
+    if command == 'info':
+        return json.dumps({'version': {'Version': 'fake'}, 'host': {'os': 'linux'}}), False
+
+    fail(f"unsupported command {command!r}")
+
+
+def run_command(args, state_dir=STATE_DIR):
+    """Run one podman command against the state in state_dir and return its stdout
+
+    Raises CommandError where podman would exit with an error.
+    """
+    if not args:
+        fail('missing command')
+    command = 'image inspect' if args[:2] == ['image', 'inspect'] else args[0]
+
+    settings = load_json(state_dir, 'settings.json', {})
+    time.sleep(settings.get('latency', {}).get(command, 0))
+    with open(os.path.join(state_dir, 'calls.log'), 'a') as log:
+        log.write(' '.join(args) + '\n')
+    if random.random() < settings.get('failure_rate', {}).get(command, 0):
+        fail(f"simulated {command} failure")
+
+    with open(os.path.join(state_dir, 'state.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_json(state_dir, 'state.json', None)
+        output, changed = handle(args, state, settings)
+        if changed:
+            tmp_path = os.path.join(state_dir, 'state.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, os.path.join(state_dir, 'state.json'))
+    return output
+
+
+def main():
+    args = sys.argv[1:]
+    # Remote engine options are ignored: each copy of this script is its own host
+    if args[:1] in (['--url'], ['-H']):
+        args = args[2:]
+    try:
+        output = run_command(args)
+    except CommandError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        sys.exit(125)
+    if output:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
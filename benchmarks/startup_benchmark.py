@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Import-time and memory benchmark for the AutoPatch core modules
+
+Each module is imported in a fresh interpreter, repeated --runs times, and
+the median import time and the peak RSS are compared against budgets. The
+core must also never load a report backend or web framework at import.
+Exits non-zero on any regression so it can run in CI:
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --max-import-ms 300 --max-rss-mb 40
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+# Imported by the CLI update path; api_server starts threads at import and is left out
+CORE_MODULES = [
+    'main',
+    'modules.update_detector',
+    'modules.deployment_manager',
+    'modules.update_planner',
+    'modules.report_generator',
+    'modules.scheduler'
+]
+
+# Dependencies that only on-demand reports or the API server may load
+HEAVY_MODULES = ['pandas', 'numpy', 'fpdf', 'flask']
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    rss //= 1024
+print(json.dumps({{
+    'import_ms': elapsed * 1000,
+    'rss_kb': rss,
+    'heavy': [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+
+def measure(module, runs):
+    """Import module in `runs` fresh interpreters and summarise the samples"""
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(SRC_DIR))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True, env=env, cwd=os.path.abspath(SRC_DIR)
+        )
+        if output.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{output.stderr}")
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    return {
+        'module': module,
+        'import_ms': round(statistics.median(sample['import_ms'] for sample in samples), 1),
+        'rss_mb': round(max(sample['rss_kb'] for sample in samples) / 1024, 1),
+        'heavy': sorted({name for sample in samples for name in sample['heavy']})
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AutoPatch import-time/RSS regression check')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module')
+    parser.add_argument('--max-import-ms', type=float, default=250, help='Median import time budget per module')
+    parser.add_argument('--max-rss-mb', type=float, default=50, help='Peak RSS budget per module')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = [measure(module, args.runs) for module in CORE_MODULES]
+    failures = []
+    for result in results:
+        if result['heavy']:
+            failures.append(f"{result['module']} loads {', '.join(result['heavy'])} at import")
+        if result['import_ms'] > args.max_import_ms:
+            failures.append(f"{result['module']} imports in {result['import_ms']}ms (budget {args.max_import_ms}ms)")
+        if result['rss_mb'] > args.max_rss_mb:
+            failures.append(f"{result['module']} peaks at {result['rss_mb']}MB RSS (budget {args.max_rss_mb}MB)")
+
+    if args.json:
+        print(json.dumps({'results': results, 'failures': failures}, indent=2))
+    else:
+        print(f"{'module':<30} {'import ms':>10} {'rss MB':>8}  heavy")
+        for result in results:
+            print(f"{result['module']:<30} {result['import_ms']:>10} {result['rss_mb']:>8}  {', '.join(result['heavy']) or '-'}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
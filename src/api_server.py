@@ -1,22 +1,26 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import json
 import os
 import logging
 from datetime import datetime
-import subprocess
 import platform
-import io
+import itertools
+import threading
+import time
 import yaml
-from modules.report_generator import ReportGenerator
+from concurrent.futures import Future
+from modules.report_generator import REPORT_FORMATS
+from modules.container_runtime import ContainerRuntimeError
+from modules.job_manager import JobManager, JobQueueFull
+from modules.log_pipeline import setup_logging
+from modules.update_engine import UpdateEngine
+from modules.update_planner import StalePlanError
+from modules.metrics import METRICS
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger('autopatch-api')
-
 # Load config
 config = {
     'autopatch': {
@@ -25,137 +29,182 @@ config = {
         }
     }
 }
+if os.path.exists('config.yaml'):
+    with open('config.yaml', 'r') as f:
+        config = yaml.safe_load(f) or config
+
+# Configure logging; records are written by a background thread so requests never wait on log I/O
+setup_logging(config)
+logger = logging.getLogger('autopatch-api')
 
 class AutoPatchManager:
     def __init__(self):
         self.logger = logger
+        # The update pipeline shared with the CLI, kept warm for the server's lifetime
+        self.engine = UpdateEngine(config)
+        self.runtime = self.engine.runtime
+        self.report_generator = self.engine.report_generator
+        
+        # Single-flight state: identical concurrent calls share one computation,
+        # and its result is reused for single_flight_window seconds afterwards
+        self.single_flight_window = config['autopatch'].get('api', {}).get('single_flight_window', 10)
+        self._in_flight = {}
+        self._recent_results = {}
+        self._flight_lock = threading.Lock()
+        self._snapshot = None
+    
+    def _single_flight(self, key, func):
+        """Run func once for all concurrent callers using the same key"""
+        with self._flight_lock:
+            recent = self._recent_results.get(key)
+            if recent and time.monotonic() - recent[0] < self.single_flight_window:
+                return recent[1]
+            
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        
+        if not leader:
+            self.logger.info(f"Joining in-flight {key}")
+            return future.result()
+        
+        try:
+            result = func()
+        except Exception as e:
+            with self._flight_lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        
+        with self._flight_lock:
+            del self._in_flight[key]
+            self._recent_results[key] = (time.monotonic(), result)
+        future.set_result(result)
+        return result
+    
+    def _forget_result(self, key):
+        """Drop a reusable result once it no longer reflects the containers"""
+        with self._flight_lock:
+            self._recent_results.pop(key, None)
+    
+    def get_containers_by_host(self, include_excluded=False):
+        """Updatable (or all) running containers of every host, from the live inventories"""
+        return self.engine.containers_by_host(include_excluded)
+    
+    def get_host(self, name=None):
+        """A fleet host by name (the first host when no name is given)"""
+        host = self.engine.host(name)
+        if host is None:
+            raise ContainerRuntimeError(f"Unknown host {name}")
+        return host
     
     def get_running_containers(self):
         """Get list of running containers using Podman"""
         try:
-            result = subprocess.run(
-                ['podman', 'ps', '--format', 'json'],
-                capture_output=True, text=True, check=True
-            )
-            containers = json.loads(result.stdout)
-            
             container_list = []
-            for container in containers:
-                container_list.append({
-                    'id': container['Id'][:12],
-                    'name': container['Names'][0] if container['Names'] else 'Unknown',
-                    'image': container['Image'],
-                    'status': container['Status'],
-                    'created': container['CreatedAt'],
-                    'ports': container.get('Ports', []),
-                    'state': container.get('State', 'unknown')
-                })
+            for host_name, containers in self.get_containers_by_host(include_excluded=True).items():
+                if isinstance(containers, Exception):
+                    continue
+                for container in containers:
+                    container_list.append({
+                        'host': host_name,
+                        'id': container['Id'][:12],
+                        'name': container['Names'][0] if container['Names'] else 'Unknown',
+                        'image': container['Image'],
+                        'status': container['Status'],
+                        'created': container['CreatedAt'],
+                        'ports': container.get('Ports', []),
+                        'state': container.get('State', 'unknown'),
+                        'excluded': self.engine.is_excluded(container)
+                    })
             
             return container_list
         except Exception as e:
             logger.error(f"Error getting containers: {e}")
             return []
     
-    def check_updates(self):
-        """Check for container updates"""
-        try:
-            containers = self.get_running_containers()
-            updates_available = []
-            
-            for container in containers:
-                image_name = container['image']
-                
-                try:
-                    # Pull latest image to check for updates
-                    pull_result = subprocess.run(
-                        ['podman', 'pull', image_name],
-                        capture_output=True, text=True
-                    )
-                    
-                    if pull_result.returncode == 0:
-                        updates_available.append({
-                            'container_name': container['name'],
-                            'current_image': container['image'],
-                            'new_image': image_name,
-                            'has_update': True
-                        })
-                except Exception as e:
-                    logger.warning(f"Failed to check updates for {container['name']}: {e}")
-                    continue
-            
-            return updates_available
-        except Exception as e:
-            logger.error(f"Error checking updates: {e}")
-            return []
+    def plan_updates(self, progress=None):
+        """Detect updates into a cached update plan, sharing the work with identical concurrent checks"""
+        return self._single_flight(
+            'plan', lambda: self._capture_snapshot(self.engine.plan_updates(progress))
+        )
+    
+    def _capture_snapshot(self, plan):
+        """Remember a detection result so reports can be rendered without detecting again"""
+        snapshot = {
+            'id': plan['id'],
+            'captured_at': datetime.fromtimestamp(plan['created_at']).isoformat(),
+            'containers': self.get_running_containers(),
+            'updates': self.plan_to_updates(plan)
+        }
+        with self._flight_lock:
+            self._snapshot = snapshot
+        return plan
+    
+    def latest_snapshot(self):
+        """The latest detection snapshot without detecting, or None before the first check"""
+        with self._flight_lock:
+            return self._snapshot
     
-    def run_autopatch(self):
-        """Run the AutoPatch update process"""
+    def report_snapshot(self, fresh=False):
+        """The latest detection snapshot; detection only runs when fresh is asked for or none exists"""
+        with self._flight_lock:
+            snapshot = self._snapshot
+        if fresh or snapshot is None:
+            if fresh:
+                self._forget_result('plan')
+            self.plan_updates()
+            with self._flight_lock:
+                snapshot = self._snapshot
+        return snapshot
+    
+    def plan_to_updates(self, plan):
+        """Describe a plan's containers in the /api/check-updates format"""
+        return [{
+            'host': entry['host'],
+            'container_name': entry['container_name'],
+            'current_image': entry['image'],
+            'new_image': entry['image'],
+            'new_digest': entry['new_digest'],
+            'download_bytes': entry['download_bytes'],
+            'has_update': True
+        } for entry in plan['containers']]
+    
+    def check_updates(self, progress=None):
+        """Check for container updates; returns the /api/check-updates response body"""
+        plan = self.plan_updates(progress)
+        updates = self.plan_to_updates(plan)
+        return {
+            'updates_available': len(updates),
+            'updates': updates,
+            'plan_id': plan['id']
+        }
+    
+    def run_autopatch(self, progress=None, plan_id=None):
+        """Run the AutoPatch update process, applying the given plan or a fresh one"""
         try:
-            updates = self.check_updates()
-            results = []
+            plan = self.engine.get_plan(plan_id) if plan_id else self.plan_updates(progress)
+            if plan is None:
+                return {'success': False, 'error': f'Unknown update plan {plan_id}'}
             
-            for update in updates:
-                try:
-                    container_name = update['container_name']
-                    
-                    # Stop container
-                    self.logger.info(f"Stopping container: {container_name}")
-                    stop_result = subprocess.run(
-                        ['podman', 'stop', container_name], 
-                        capture_output=True, text=True
-                    )
-                    
-                    if stop_result.returncode != 0:
-                        self.logger.warning(f"Failed to stop container {container_name}: {stop_result.stderr}")
-                        continue
-                    
-                    # Remove container
-                    self.logger.info(f"Removing container: {container_name}")
-                    rm_result = subprocess.run(
-                        ['podman', 'rm', container_name], 
-                        capture_output=True, text=True
-                    )
-                    
-                    if rm_result.returncode != 0:
-                        self.logger.warning(f"Failed to remove container {container_name}: {rm_result.stderr}")
-                        continue
-                    
-                    # Run new container
-                    self.logger.info(f"Starting new container: {container_name}")
-                    run_result = subprocess.run(
-                        ['podman', 'run', '-d', '--name', container_name, update['new_image']], 
-                        capture_output=True, text=True
-                    )
-                    
-                    if run_result.returncode == 0:
-                        results.append({
-                            'container_name': container_name,
-                            'status': 'success',
-                            'old_image': update['current_image'],
-                            'new_image': update['new_image']
-                        })
-                        self.logger.info(f"Successfully updated {container_name}")
-                    else:
-                        results.append({
-                            'container_name': container_name,
-                            'status': 'failed',
-                            'error': run_result.stderr
-                        })
-                        self.logger.error(f"Failed to start new container {container_name}: {run_result.stderr}")
-                        
-                except Exception as e:
-                    results.append({
-                        'container_name': update['container_name'],
-                        'status': 'failed',
-                        'error': str(e)
-                    })
-                    self.logger.error(f"Error updating {update['container_name']}: {e}")
+            try:
+                report = self.engine.run_cycle(progress, plan)
+            except StalePlanError as e:
+                return {'success': False, 'stale': True, 'plan_id': plan['id'], 'error': f'Stale plan: {e}'}
+            finally:
+                # Containers changed, the next check must look again
+                self._forget_result('plan')
             
             return {
                 'success': True,
-                'updated_containers': len([r for r in results if r['status'] == 'success']),
-                'failed_containers': len([r for r in results if r['status'] == 'failed']),
-                'results': results
+                'plan_id': plan['id'],
+                'updated_containers': report['summary']['updated'],
+                'failed_containers': report['summary']['failed'],
+                'results': report['details'],
+                'image_gc': report['image_gc'],
+                'hosts': report['hosts'],
+                'timings': report['timings']
             }
         except Exception as e:
             logger.error(f"Error running autopatch: {e}")
@@ -165,11 +214,10 @@ class AutoPatchManager:
         """Get system information"""
         try:
             # Podman info
-            podman_info = subprocess.run(
-                ['podman', 'info', '--format', 'json'], 
-                capture_output=True, text=True
-            )
-            podman_data = json.loads(podman_info.stdout) if podman_info.returncode == 0 else {}
+            try:
+                podman_data = self.runtime.get_info()
+            except ContainerRuntimeError:
+                podman_data = {}
             
             # Get container count
             containers = self.get_running_containers()
@@ -180,9 +228,9 @@ class AutoPatchManager:
                     'python_version': platform.python_version(),
                 },
                 'podman': {
-                    'version': podman_data.get('version', {}).get('Version', 'Unknown'),
+                    'version': podman_data.get('version', 'Unknown'),
                     'containers_running': len(containers),
-                    'os': podman_data.get('host', {}).get('os', {}).get('distribution', 'Unknown')
+                    'os': podman_data.get('os', 'Unknown')
                 }
             }
         except Exception as e:
@@ -191,7 +239,28 @@ class AutoPatchManager:
 
 # Initialize AutoPatch manager and Report Generator
 ap_manager = AutoPatchManager()
-report_generator = ReportGenerator(config)
+ap_manager.engine.start_inventories()
+report_generator = ap_manager.report_generator
+job_manager = JobManager(max_queued=config['autopatch'].get('jobs', {}).get('max_queued', 4))
+
+def submit_job(kind, func, reuse=False):
+    """Queue a background job and answer with where to follow it
+
+    With reuse, a job of the same kind that is still queued or running is
+    answered instead of queueing another one.
+    """
+    job = job_manager.find_unfinished(kind) if reuse else None
+    if job is None:
+        try:
+            job = job_manager.submit(kind, func)
+        except JobQueueFull as e:
+            return jsonify({'error': str(e)}), 429
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events'
+    }), 202
 
 # Root endpoint
 @app.route('/')
@@ -201,11 +270,24 @@ def home():
         'version': '1.0.0',
         'endpoints': {
             '/api/health': 'Health check',
-            '/api/containers': 'Get running containers',
-            '/api/check-updates': 'Check for container updates',
-            '/api/run-update': 'Run AutoPatch update process',
+            '/metrics': 'Prometheus metrics (phase and runtime call timings)',
+            '/api/containers': 'Get running containers on every host',
+            '/api/check-updates': 'Check for container updates (POST runs it as a job)',
+            '/api/updates/latest': 'Result of the latest update check, without checking again',
+            '/api/run-update': 'Run AutoPatch update process as a job',
+            '/api/jobs/<id>': 'Get job status and progress',
+            '/api/jobs/<id>/events': 'Stream job progress (Server-Sent Events)',
+            '/api/plans': 'Create an update plan (POST)',
+            '/api/plans/<id>': 'Get an update plan',
+            '/api/plans/<id>/apply': 'Apply an update plan as a job (POST)',
             '/api/system-info': 'Get system information',
-            '/api/generate-report': 'Generate a report of containers and updates'
+            '/api/generate-report': 'Report of the latest update check (format, fresh=1 to check again)',
+            '/api/reports': 'Paginated update cycle history',
+            '/api/reports/<id>': 'Get one stored update cycle report',
+            '/api/reports/results': 'Paginated per-container update results (filter by host, container, status)',
+            '/api/reports/stats': 'Failure rate and mean update duration per container (host=<name> for one host)',
+            '/api/container/<name>/restart': 'Restart container (host=<name> for a fleet host)',
+            '/api/container/<name>/stop': 'Stop container (host=<name> for a fleet host)'
         }
     })
 
@@ -214,25 +296,41 @@ def home():
 def generate_report():
     try:
         report_format = request.args.get('format', 'json')
-        containers = ap_manager.get_running_containers()
-        updates = ap_manager.check_updates()
+        if report_format not in REPORT_FORMATS:
+            return jsonify({'error': f'Unsupported report format: {report_format}'}), 400
+        
+        # Render the latest detection snapshot; only ?fresh=1 runs detection again
+        fresh = request.args.get('fresh', '').lower() in ('1', 'true', 'yes')
+        snapshot = ap_manager.report_snapshot(fresh)
         data = {
-            'containers': containers,
-            'updates': updates
+            'snapshot': {'id': snapshot['id'], 'captured_at': snapshot['captured_at']},
+            'containers': snapshot['containers'],
+            'updates': snapshot['updates']
         }
-        report_data, content_type = report_generator.generate_on_demand_report(data, report_format)
+        chunks, content_type = report_generator.cached_on_demand_report(snapshot['id'], data, report_format)
+        # Render the first chunk here so setup errors still produce a 500 response
+        first = next(chunks, b'')
 
-        return send_file(
-            io.BytesIO(report_data),
+        # Send the report as it is rendered instead of buffering the whole file
+        return Response(
+            stream_with_context(itertools.chain([first], chunks)),
             mimetype=content_type,
-            as_attachment=True,
-            download_name=f'autopatch-report.{report_format}'
+            headers={
+                'Content-Disposition': f'attachment; filename=autopatch-report.{report_format}',
+                'X-Snapshot-Id': snapshot['id'],
+                'X-Snapshot-Captured-At': snapshot['captured_at']
+            }
         )
     except Exception as e:
         import traceback
         logger.error(f"Error in /api/generate-report: {e}")
         logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of phase/runtime timings and update counters"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
@@ -250,27 +348,151 @@ def get_containers():
         logger.error(f"Error in /api/containers: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/check-updates', methods=['GET'])
+@app.route('/api/check-updates', methods=['GET', 'POST'])
 def check_updates():
     try:
-        updates = ap_manager.check_updates()
-        return jsonify({
-            'updates_available': len(updates),
-            'updates': updates
-        })
+        if request.method == 'POST':
+            # Dashboards poll this, so concurrent pollers share one pending check
+            return submit_job('check-updates', lambda job: ap_manager.check_updates(job.report), reuse=True)
+        return jsonify(ap_manager.check_updates())
     except Exception as e:
         logger.error(f"Error in /api/check-updates: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/updates/latest', methods=['GET'])
+def latest_updates():
+    # Answers at once, even while a check or update job is queued
+    snapshot = ap_manager.latest_snapshot()
+    if snapshot is None:
+        return jsonify({'snapshot': None, 'updates_available': 0, 'updates': []})
+    return jsonify({
+        'snapshot': {'id': snapshot['id'], 'captured_at': snapshot['captured_at']},
+        'updates_available': len(snapshot['updates']),
+        'updates': snapshot['updates']
+    })
+
 @app.route('/api/run-update', methods=['POST'])
 def run_update():
     try:
-        result = ap_manager.run_autopatch()
-        return jsonify(result)
+        plan_id = (request.get_json(silent=True) or {}).get('plan_id')
+        return submit_job('run-update', lambda job: ap_manager.run_autopatch(job.report, plan_id))
     except Exception as e:
         logger.error(f"Error in /api/run-update: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/plans', methods=['POST'])
+def create_plan():
+    try:
+        return jsonify(ap_manager.plan_updates()), 201
+    except Exception as e:
+        logger.error(f"Error in /api/plans: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/plans/<plan_id>', methods=['GET'])
+def get_plan(plan_id):
+    plan = ap_manager.engine.get_plan(plan_id)
+    if plan is None:
+        return jsonify({'error': f'Plan {plan_id} not found'}), 404
+    return jsonify(plan)
+
+@app.route('/api/plans/<plan_id>/apply', methods=['POST'])
+def apply_plan(plan_id):
+    if ap_manager.engine.get_plan(plan_id) is None:
+        return jsonify({'error': f'Plan {plan_id} not found'}), 404
+    return submit_job('apply-plan', lambda job: ap_manager.run_autopatch(job.report, plan_id))
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': [job.to_dict(include_progress=False) for job in job_manager.list()]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+
+    # Resume after the last event the browser saw when it reconnects
+    last_seen = request.headers.get('Last-Event-ID', request.args.get('since', ''))
+    since = int(last_seen) + 1 if str(last_seen).isdigit() else 0
+
+    def stream():
+        sent = since
+        while True:
+            events = job.wait_for_events(sent)
+            for event in events:
+                yield f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+            sent += len(events)
+            if job.finished and sent >= len(job.progress):
+                yield f"event: end\ndata: {json.dumps(job.to_dict(include_progress=False))}\n\n"
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+def report_store_or_error():
+    """The report history store, or an error response when it is unavailable"""
+    if report_generator.store is None:
+        return None, (jsonify({'error': 'Report history store is not available'}), 503)
+    return report_generator.store, None
+
+def page_args():
+    """limit/offset query parameters, clamped to sane values"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    return limit, offset
+
+@app.route('/api/reports', methods=['GET'])
+def list_reports():
+    store, error = report_store_or_error()
+    if error:
+        return error
+    limit, offset = page_args()
+    return jsonify(store.list_cycles(limit, offset, request.args.get('since'), request.args.get('until')))
+
+@app.route('/api/reports/<int:cycle_id>', methods=['GET'])
+def get_report(cycle_id):
+    store, error = report_store_or_error()
+    if error:
+        return error
+    report = store.get_cycle(cycle_id)
+    if report is None:
+        return jsonify({'error': f'Report {cycle_id} not found'}), 404
+    return jsonify(report)
+
+@app.route('/api/reports/results', methods=['GET'])
+def list_report_results():
+    store, error = report_store_or_error()
+    if error:
+        return error
+    limit, offset = page_args()
+    return jsonify(store.list_results(
+        limit, offset,
+        container=request.args.get('container'),
+        status=request.args.get('status'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        host=request.args.get('host')
+    ))
+
+@app.route('/api/reports/stats', methods=['GET'])
+def report_stats():
+    store, error = report_store_or_error()
+    if error:
+        return error
+    since, until, host = request.args.get('since'), request.args.get('until'), request.args.get('host')
+    return jsonify({
+        'summary': store.summary(since, until, host),
+        'containers': store.container_stats(since, until, host)
+    })
+
 @app.route('/api/system-info', methods=['GET'])
 def system_info():
     try:
@@ -283,14 +505,10 @@ def system_info():
 @app.route('/api/container/<name>/restart', methods=['POST'])
 def restart_container(name):
     try:
-        result = subprocess.run(
-            ['podman', 'restart', name], 
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            return jsonify({'success': True, 'message': f'Container {name} restarted successfully'})
-        else:
-            return jsonify({'success': False, 'error': result.stderr}), 500
+        ap_manager.get_host(request.args.get('host')).runtime.restart_container(name)
+        return jsonify({'success': True, 'message': f'Container {name} restarted successfully'})
+    except ContainerRuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
     except Exception as e:
         logger.error(f"Error restarting container {name}: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -298,14 +516,10 @@ def restart_container(name):
 @app.route('/api/container/<name>/stop', methods=['POST'])
 def stop_container(name):
     try:
-        result = subprocess.run(
-            ['podman', 'stop', name], 
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            return jsonify({'success': True, 'message': f'Container {name} stopped successfully'})
-        else:
-            return jsonify({'success': False, 'error': result.stderr}), 500
+        ap_manager.get_host(request.args.get('host')).runtime.stop_container(name)
+        return jsonify({'success': True, 'message': f'Container {name} stopped successfully'})
+    except ContainerRuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
     except Exception as e:
         logger.error(f"Error stopping container {name}: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -318,12 +532,24 @@ def not_found(error):
         'available_endpoints': {
             'GET /': 'API information',
             'GET /api/health': 'Health check',
+            'GET /metrics': 'Prometheus metrics',
             'GET /api/containers': 'Get running containers',
             'GET /api/check-updates': 'Check for container updates',
-            'POST /api/run-update': 'Run AutoPatch update process',
+            'POST /api/check-updates': 'Check for container updates as a job',
+            'GET /api/updates/latest': 'Result of the latest update check',
+            'POST /api/run-update': 'Run AutoPatch update process as a job',
+            'GET /api/jobs/<id>': 'Get job status and progress',
+            'GET /api/jobs/<id>/events': 'Stream job progress',
+            'POST /api/plans': 'Create an update plan',
+            'GET /api/plans/<id>': 'Get an update plan',
+            'POST /api/plans/<id>/apply': 'Apply an update plan as a job',
+            'GET /api/reports': 'Update cycle history (limit, offset, since, until)',
+            'GET /api/reports/<id>': 'Get a stored update cycle report',
+            'GET /api/reports/results': 'Per-container results (host, container, status, since, until)',
+            'GET /api/reports/stats': 'Failure rate and mean duration per container (host, since, until)',
             'GET /api/system-info': 'Get system information',
-            'POST /api/container/<name>/restart': 'Restart container',
-            'POST /api/container/<name>/stop': 'Stop container'
+            'POST /api/container/<name>/restart': 'Restart container (host=<name>)',
+            'POST /api/container/<name>/stop': 'Stop container (host=<name>)'
         }
     }), 404
 
@@ -333,9 +559,14 @@ if __name__ == '__main__':
     print("🔗 Available endpoints:")
     print("   GET  /              - API information")
     print("   GET  /api/health    - Health check")
+    print("   GET  /metrics       - Prometheus metrics")
     print("   GET  /api/containers - Get running containers")
     print("   GET  /api/check-updates - Check for updates")
-    print("   POST /api/run-update - Run AutoPatch")
+    print("   GET  /api/updates/latest - Latest update check result")
+    print("   POST /api/run-update - Run AutoPatch (returns a job id)")
+    print("   GET  /api/jobs/<id> - Job status and progress")
+    print("   GET  /api/jobs/<id>/events - Job progress stream")
+    print("   GET  /api/reports   - Update history (also /results, /stats)")
     print("   GET  /api/system-info - System information")
     print("   POST /api/container/<name>/restart - Restart container")
     print("   POST /api/container/<name>/stop - Stop container")
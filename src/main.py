@@ -1,21 +1,41 @@
 #!/usr/bin/env python3
 
+import argparse
+import json
 import logging
+import shutil
+import subprocess
+import sys
+import threading
 import yaml
 import os
-from datetime import datetime
-from modules.update_detector import UpdateDetector
-from modules.deployment_manager import DeploymentManager
-from modules.report_generator import ReportGenerator
+from modules.log_pipeline import setup_logging
+from modules.update_engine import UpdateEngine
+from modules.update_planner import StalePlanError
+from modules.scheduler import Scheduler
+
+def lower_priority(niceness=19):
+    """Run the calling thread (and the threads and pulls it spawns) at idle CPU and I/O priority"""
+    logger = logging.getLogger('autopatch')
+    # Linux priorities are per thread, so a daemon can prefetch without slowing its own cycles
+    task_id = threading.get_native_id() if sys.platform.startswith('linux') else os.getpid()
+    if hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, task_id, max(os.getpriority(os.PRIO_PROCESS, task_id), niceness))
+        except OSError as e:
+            logger.warning(f"Could not lower CPU priority: {e}")
+    if shutil.which('ionice'):
+        # Idle I/O class; inherited by the runtime CLI processes started later
+        subprocess.run(['ionice', '-c', '3', '-p', str(task_id)], capture_output=True)
 
 class AutoPatch:
     def __init__(self, config_path='config.yaml'):
         self.config = self.load_config(config_path)
         self.setup_logging()
         
-        self.update_detector = UpdateDetector(self.config['autopatch']['container_runtime'])
-        self.deployment_manager = DeploymentManager(self.config['autopatch']['container_runtime'])
-        self.report_generator = ReportGenerator(self.config)
+        # The update pipeline shared with the API server
+        self.engine = UpdateEngine(self.config)
+        self.report_generator = self.engine.report_generator
         
         self.logger = logging.getLogger('autopatch')
     
@@ -25,78 +45,132 @@ class AutoPatch:
             return yaml.safe_load(f)
     
     def setup_logging(self):
-        """Setup logging configuration"""
-        log_config = self.config['autopatch']['logging']
-        os.makedirs(os.path.dirname(log_config['log_file']), exist_ok=True)
+        """Setup logging configuration (written by a background thread, see log_pipeline)"""
+        setup_logging(self.config)
+    
+    def plan_updates(self):
+        """Detect updates and save them as a plan without changing anything"""
+        return self.engine.plan_updates()
+    
+    def prefetch_updates(self):
+        """Detect updates and download their images ahead of the maintenance window"""
+        prefetch_config = self.config['autopatch'].get('prefetch', {})
+        summary = {}
+        errors = []
+        
+        def prefetch():
+            try:
+                lower_priority(prefetch_config.get('nice', 19))
+                summary.update(self.engine.prefetch(self.engine.plan_updates()))
+            except Exception as e:
+                # Handed back to the caller instead of ending up in threading.excepthook
+                self.logger.error(f"Error prefetching updates: {e}")
+                errors.append(e)
         
-        logging.basicConfig(
-            level=log_config['log_level'],
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_config['log_file']),
-                logging.StreamHandler()
-            ]
+        # A throwaway thread keeps the lowered priority from sticking to the caller
+        thread = threading.Thread(target=prefetch, name='prefetch')
+        thread.start()
+        thread.join()
+        if errors:
+            raise errors[0]
+        if not summary:
+            raise RuntimeError('Prefetch did not complete')
+        self.logger.info(
+            f"Prefetch finished: {len(summary['pulled'])} images pulled "
+            f"({summary['downloaded_bytes']} bytes), {len(summary['failed'])} failed"
         )
+        return summary
+    
+    def apply_plan(self, plan):
+        """Redeploy the containers of a plan without re-running detection"""
+        try:
+            return self.engine.run_cycle(plan=plan)
+        except StalePlanError:
+            return None
+        except Exception as e:
+            self.logger.error(f"Error applying plan {plan['id']}: {e}")
+            return None
     
     def run_update_cycle(self):
         """Execute complete update cycle"""
         self.logger.info("Starting AutoPatch update cycle")
         
-        update_results = []
-        
         try:
-            # Get outdated containers
-            outdated_containers = self.update_detector.get_outdated_containers()
-            self.logger.info(f"Found {len(outdated_containers)} containers with updates")
-            
-            # Process each outdated container
-            for item in outdated_containers:
-                result = {
-                    'container_name': item['container_name'],
-                    'old_image': item['container']['Image'],
-                    'new_image': item['new_image'],
-                    'timestamp': datetime.now().isoformat(),
-                    'status': 'pending'
-                }
-                
-                try:
-                    # Get container configuration
-                    container_config = self.deployment_manager.get_container_config(item['container'])
-                    if not container_config:
-                        result['status'] = 'failed'
-                        result['error'] = 'Could not get container configuration'
-                        update_results.append(result)
-                        continue
-                    
-                    # Redeploy container
-                    success = self.deployment_manager.redeploy_container(container_config, item['new_image'])
-                    
-                    if success:
-                        result['status'] = 'success'
-                    else:
-                        result['status'] = 'failed'
-                        result['error'] = 'Redeployment failed'
-                    
-                except Exception as e:
-                    result['status'] = 'failed'
-                    result['error'] = str(e)
-                
-                update_results.append(result)
-            
-            # Generate report
-            report = self.report_generator.generate_report(update_results)
+            report = self.engine.run_cycle()
             self.logger.info("AutoPatch update cycle completed")
-            
             return report
             
+        except StalePlanError:
+            return None
         except Exception as e:
             self.logger.error(f"Error during update cycle: {e}")
             return None
 
+    def run_daemon(self):
+        """Run update (and prefetch) cycles on their cron schedules until stopped
+        
+        The process, runtime connections and registry caches stay alive
+        between cycles. SIGUSR1 or a trigger file requests a cycle now.
+        """
+        autopatch_config = self.config['autopatch']
+        daemon_config = autopatch_config.get('daemon', {})
+        
+        scheduler = Scheduler(
+            jitter_seconds=daemon_config.get('jitter_seconds', 0),
+            trigger_file=daemon_config.get('trigger_file'),
+            poll_interval=daemon_config.get('poll_interval', 5)
+        )
+        scheduler.add_task('update', autopatch_config.get('schedule'), self.run_update_cycle)
+        scheduler.add_task('prefetch', autopatch_config.get('prefetch', {}).get('schedule'), self.prefetch_updates)
+        scheduler.install_signal_handlers({'SIGUSR1': 'update', 'SIGUSR2': 'prefetch'})
+        
+        self.logger.info(f"AutoPatch daemon started (pid {os.getpid()})")
+        scheduler.run()
+        self.engine.save_cache()
+
 def main():
     """Main function"""
-    autopatch = AutoPatch()
-    autopatch.run_update_cycle()
+    parser = argparse.ArgumentParser(description='AutoPatch container updater')
+    parser.add_argument('--config', default='config.yaml', help='Path to config.yaml')
+    parser.add_argument('--plan', action='store_true', help='Only detect updates and save an update plan')
+    parser.add_argument('--apply', metavar='PLAN_ID', help='Apply a previously saved update plan')
+    parser.add_argument('--prefetch', action='store_true',
+                        help='Download updated images at low priority without redeploying anything')
+    parser.add_argument('--import-reports', metavar='DIR', nargs='?', const='',
+                        help='Import JSON reports (default: report_dir) into the report history store')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and start cycles from the configured cron schedules')
+    args = parser.parse_args()
+    
+    autopatch = AutoPatch(args.config)
+    if args.import_reports is not None:
+        store = autopatch.report_generator.store
+        if store is None:
+            if autopatch.config['autopatch'].get('reports', {}).get('store', True):
+                autopatch.logger.error("Cannot import reports: the report history store failed to open")
+            else:
+                autopatch.logger.error("Cannot import reports: the report history store is disabled (reports.store)")
+            return 1
+        report_dir = args.import_reports or autopatch.config['autopatch']['logging']['report_dir']
+        print(f"Imported {store.import_json_reports(report_dir)} reports")
+    elif args.daemon:
+        autopatch.run_daemon()
+    elif args.prefetch:
+        summary = autopatch.prefetch_updates()
+        print(json.dumps(summary, indent=2))
+        return 1 if summary['failed'] else 0
+    elif args.plan:
+        plan = autopatch.plan_updates()
+        print(json.dumps(plan, indent=2))
+    elif args.apply:
+        plan = autopatch.engine.get_plan(args.apply)
+        if plan is None:
+            autopatch.logger.error(f"Unknown update plan {args.apply}")
+            return 1
+        return 0 if autopatch.apply_plan(plan) else 1
+    else:
+        autopatch.run_update_cycle()
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
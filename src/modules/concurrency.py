@@ -0,0 +1,56 @@
+import contextvars
+import random
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def bounded_map(func, items, key=None, max_workers=8, key_limit=None, on_result=None):
+    """Run func over items on a thread pool and return the results in input order
+
+    At most max_workers calls run at once, and at most key_limit(key(item))
+    calls run at once for items sharing the same key. Work is only handed to
+    the pool when its key has spare capacity, so a slow key never occupies
+    more than its own share of workers and cannot stall the other keys.
+    on_result(item, result) is called from the calling thread as each item finishes.
+    Calls run in a copy of the caller's context, so its log_context() fields carry over.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    key = key or (lambda item: None)
+    key_limit = key_limit or (lambda k: max_workers)
+
+    queues = OrderedDict()
+    for index, item in enumerate(items):
+        queues.setdefault(key(item), deque()).append(index)
+    limits = {k: max(1, key_limit(k)) for k in queues}
+    in_flight = {k: 0 for k in queues}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        while queues or running:
+            # Round-robin over keys so every key gets a fair start
+            for k in list(queues):
+                while queues.get(k) and in_flight[k] < limits[k] and len(running) < max_workers:
+                    index = queues[k].popleft()
+                    running[executor.submit(contextvars.copy_context().run, func, items[index])] = (index, k)
+                    in_flight[k] += 1
+                if k in queues and not queues[k]:
+                    del queues[k]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, k = running.pop(future)
+                in_flight[k] -= 1
+                results[index] = future.result()
+                if on_result:
+                    on_result(items[index], results[index])
+
+    return results
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from modules.container_runtime import ContainerRuntimeError
+
+STOPPED_ACTIONS = {'die', 'died', 'stop', 'remove', 'destroy'}
+CHANGED_ACTIONS = {'start', 'restart', 'unpause', 'rename', 'update'}
+
+
+class ContainerInventory:
+    """Live in-memory view of the running containers
+
+    Seeded with one full listing, then kept current from the runtime's event
+    stream: stopped/removed containers are dropped immediately and starts
+    trigger a (coalesced) relisting. A periodic full resync covers any events
+    missed while the stream was reconnecting.
+    """
+
+    def __init__(self, runtime, resync_interval=300):
+        self.runtime = runtime
+        self.resync_interval = resync_interval
+        self.logger = logging.getLogger('autopatch')
+
+        self._containers = {}
+        self._lock = threading.Lock()
+        self._refresh_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self.last_sync = None
+
+    def start(self):
+        """Seed the inventory and start the event watcher and resync threads"""
+        self.refresh()
+        for target, name in ((self._watch_events, 'inventory-events'), (self._resync_loop, 'inventory-resync')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        self._refresh_requested.set()
+
+    def refresh(self):
+        """Replace the inventory with a full listing from the runtime"""
+        try:
+            containers = self.runtime.list_containers()
+        except Exception as e:
+            self.logger.error(f"Error refreshing container inventory: {e}")
+            return False
+
+        with self._lock:
+            self._containers = {container['Id']: container for container in containers}
+            self.last_sync = time.time()
+        return True
+
+    def containers(self):
+        """Return the running containers in listing order"""
+        with self._lock:
+            return list(self._containers.values())
+
+    def handle_event(self, event):
+        """Apply a normalised runtime event to the inventory"""
+        action = event.get('action', '')
+        if action in STOPPED_ACTIONS:
+            with self._lock:
+                for container_id in list(self._containers):
+                    if event['id'] and container_id.startswith(event['id']) or \
+                            event['name'] and event['name'] in self._containers[container_id].get('Names', []):
+                        del self._containers[container_id]
+        elif action in CHANGED_ACTIONS:
+            # The event lacks ps-level detail; relist once for a burst of starts
+            self._refresh_requested.set()
+
+    def _watch_events(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                for event in self.runtime.events():
+                    backoff = 1
+                    self.handle_event(event)
+                    if self._stopped.is_set():
+                        return
+            except (ContainerRuntimeError, OSError, ValueError) as e:
+                self.logger.warning(f"Container event stream interrupted: {e}")
+
+            # Events may have been missed while disconnected
+            self._refresh_requested.set()
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def _resync_loop(self):
+        while not self._stopped.is_set():
+            requested = self._refresh_requested.wait(self.resync_interval)
+            if self._stopped.is_set():
+                return
+            if requested:
+                self._refresh_requested.clear()
+                # Let a burst of start events settle into a single listing
+                self._stopped.wait(0.2)
+            self.refresh()
@@ -0,0 +1,416 @@
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import urllib.parse
+from datetime import datetime, timezone
+from modules.metrics import METRICS
+
+
+# IDs per CLI invocation when inspecting in bulk, well below argv limits
+CLI_BATCH_SIZE = 200
+
+
+class ContainerRuntimeError(Exception):
+    """Raised when the container runtime rejects or fails an operation"""
+
+
+class CliRuntime:
+    """Container runtime backend that shells out to the podman (or docker) CLI
+
+    With a url (e.g. ssh://core@edge-1/run/podman/podman.sock) the CLI
+    manages that remote engine instead of the local one. docker's output is
+    normalised to the shape podman prints.
+    """
+
+    def __init__(self, binary='podman', url=None):
+        self.binary = binary
+        self.docker = os.path.basename(binary).startswith('docker')
+        self.command = [binary]
+        if url:
+            self.command += ['-H', url] if self.docker else ['--url', url]
+        # docker inspect prints a JSON array by default; older releases take no `--format json`
+        self._json_format = [] if self.docker else ['--format', 'json']
+        self.logger = logging.getLogger('autopatch')
+
+    def _run(self, args):
+        """Run a CLI command and return its stdout, raising ContainerRuntimeError on failure"""
+        result = subprocess.run(self.command + args, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ContainerRuntimeError(result.stderr.strip() or f"{self.binary} {args[0]} failed")
+        return result.stdout
+
+    def list_containers(self):
+        if not self.docker:
+            return json.loads(self._run(['ps', '--format', 'json']) or '[]')
+
+        # docker prints one object per line and leaves out the image ID, which one bulk inspect adds
+        output = self._run(['ps', '--no-trunc', '--format', '{{json .}}'])
+        containers = [normalize_docker_container(json.loads(line)) for line in output.splitlines() if line.strip()]
+        if containers:
+            image_ids = {info['Id']: info.get('Image') for info in self.inspect_containers([c['Id'] for c in containers])}
+            for container in containers:
+                container['ImageID'] = image_ids.get(container['Id'])
+        return containers
+
+    def inspect_container(self, container_id):
+        return json.loads(self._run(['inspect', container_id]))[0]
+
+    def inspect_containers(self, container_ids):
+        """Inspect many containers with one CLI call per batch of IDs"""
+        results = []
+        for start in range(0, len(container_ids), CLI_BATCH_SIZE):
+            results += json.loads(self._run(['inspect', '--type', 'container'] + container_ids[start:start + CLI_BATCH_SIZE]))
+        return results
+
+    def inspect_image(self, image):
+        try:
+            images = json.loads(self._run(['image', 'inspect'] + self._json_format + [image]))
+        except ContainerRuntimeError:
+            return None
+        return images[0] if images else None
+
+    def inspect_images(self, images):
+        """Inspect many images with one CLI call per batch"""
+        results = []
+        for start in range(0, len(images), CLI_BATCH_SIZE):
+            results += json.loads(self._run(['image', 'inspect'] + self._json_format + images[start:start + CLI_BATCH_SIZE]))
+        return results
+
+    def list_images(self):
+        """Inspect every image in local storage (layers included)"""
+        image_ids = list(dict.fromkeys(self._run(['images', '-q', '--no-trunc']).split()))
+        return self.inspect_images(image_ids) if image_ids else []
+
+    def remove_image(self, image):
+        """Remove an image; fails while any container still uses it"""
+        self._run(['rmi', image])
+
+    def pull_image(self, image):
+        self._run(['pull', image])
+
+    def stop_container(self, name):
+        self._run(['stop', name])
+
+    def remove_container(self, name):
+        self._run(['rm', name])
+
+    def restart_container(self, name):
+        self._run(['restart', name])
+
+    def start_container(self, name):
+        self._run(['start', name])
+
+    def rename_container(self, name, new_name):
+        self._run(['rename', name, new_name])
+
+    def run_container(self, name, image, spec=None):
+        options = spec.to_cli_args() if spec else []
+        command = spec.to_cli_command() if spec else []
+        return self._run(['run', '-d', '--name', name] + options + [image] + command).strip()
+
+    def events(self):
+        """Yield normalised container lifecycle events until the stream ends"""
+        args = self.command + ['events', '--filter', 'type=container']
+        args += ['--format', '{{json .}}'] if self.docker else ['--format', 'json']
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            for line in process.stdout:
+                if line.strip():
+                    yield normalize_event(json.loads(line))
+        finally:
+            process.kill()
+            process.wait()
+
+    def get_info(self):
+        if self.docker:
+            info = json.loads(self._run(['info', '--format', '{{json .}}']))
+            return {'version': info.get('ServerVersion', 'Unknown'), 'os': info.get('OperatingSystem', 'Unknown')}
+        info = json.loads(self._run(['info', '--format', 'json']))
+        return {
+            'version': info.get('version', {}).get('Version', 'Unknown'),
+            'os': info.get('host', {}).get('os', {}).get('distribution', 'Unknown')
+        }
+
+
+class UnixSocketConnection(http.client.HTTPConnection):
+    """HTTPConnection that talks to a local unix socket instead of TCP"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ApiRuntime:
+    """Container runtime backend for the Docker-compatible REST API served by podman and docker
+
+    Requests go over keep-alive connections to the local unix socket that are
+    pooled between calls, and streaming endpoints (pull progress) are consumed
+    line by line instead of being buffered.
+    """
+
+    def __init__(self, socket_path, pool_size=4, timeout=60, api_version='v1.41'):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.prefix = f"/{api_version}" if api_version else ''
+        self.logger = logging.getLogger('autopatch')
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return UnixSocketConnection(self.socket_path, timeout=self.timeout), False
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _send(self, method, path, params=None, body=None):
+        """Send a request on a pooled connection, retrying once if a reused connection went stale"""
+        url = self.prefix + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, url, body=payload, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+
+    def _raise_for_status(self, response, data):
+        if response.status >= 400:
+            message = data.get('message') if isinstance(data, dict) else None
+            raise ContainerRuntimeError(message or f"{response.status} {response.reason}")
+
+    def _request(self, method, path, params=None, body=None):
+        """Perform a request and return its decoded JSON body (None when empty)"""
+        conn, response = self._send(method, path, params, body)
+        try:
+            raw = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+        data = json.loads(raw) if raw.strip() else None
+        self._raise_for_status(response, data)
+        return data
+
+    def _stream(self, method, path, params=None, timeout=False):
+        """Yield newline-delimited JSON objects from a streaming endpoint as they arrive
+
+        timeout overrides the socket timeout while streaming (None waits forever).
+        """
+        conn, response = self._send(method, path, params)
+        if response.status >= 400:
+            raw = response.read()
+            conn.close()
+            self._raise_for_status(response, json.loads(raw) if raw.strip() else None)
+
+        if timeout is not False:
+            conn.sock.settimeout(timeout)
+        try:
+            for line in iter(response.readline, b''):
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            if response.isclosed() and not response.will_close:
+                conn.sock.settimeout(self.timeout)
+                self._release(conn)
+            else:
+                conn.close()
+
+    def list_containers(self):
+        containers = self._request('GET', '/containers/json')
+        for container in containers:
+            # Match the shape of `podman ps --format json`
+            container['Names'] = [name.lstrip('/') for name in container.get('Names') or []]
+            if 'CreatedAt' not in container and container.get('Created'):
+                container['CreatedAt'] = datetime.fromtimestamp(container['Created'], timezone.utc).isoformat()
+        return containers
+
+    def inspect_container(self, container_id):
+        return self._request('GET', f"/containers/{urllib.parse.quote(container_id, safe='')}/json")
+
+    def inspect_containers(self, container_ids):
+        """Inspect many containers back to back over one pooled connection (the API has no bulk call)"""
+        return [self.inspect_container(container_id) for container_id in container_ids]
+
+    def inspect_images(self, images):
+        return [info for info in (self.inspect_image(image) for image in images) if info]
+
+    def inspect_image(self, image):
+        try:
+            return self._request('GET', f"/images/{urllib.parse.quote(image, safe='')}/json")
+        except ContainerRuntimeError:
+            return None
+
+    def list_images(self):
+        """Inspect every image in local storage (the listing lacks layers)"""
+        return self.inspect_images([image['Id'] for image in self._request('GET', '/images/json')])
+
+    def remove_image(self, image):
+        """Remove an image; fails while any container still uses it"""
+        self._request('DELETE', f"/images/{urllib.parse.quote(image, safe='')}")
+
+    def pull_image(self, image):
+        error = None
+        for progress in self._stream('POST', '/images/create', {'fromImage': image}):
+            # Read to the end of the stream so the connection can go back to the pool
+            error = error or progress.get('error')
+        if error:
+            raise ContainerRuntimeError(error)
+
+    def stop_container(self, name):
+        self._request('POST', f"/containers/{urllib.parse.quote(name, safe='')}/stop")
+
+    def remove_container(self, name):
+        self._request('DELETE', f"/containers/{urllib.parse.quote(name, safe='')}")
+
+    def restart_container(self, name):
+        self._request('POST', f"/containers/{urllib.parse.quote(name, safe='')}/restart")
+
+    def start_container(self, name):
+        self._request('POST', f"/containers/{urllib.parse.quote(name, safe='')}/start")
+
+    def rename_container(self, name, new_name):
+        self._request('POST', f"/containers/{urllib.parse.quote(name, safe='')}/rename", {'name': new_name})
+
+    def run_container(self, name, image, spec=None):
+        body = spec.to_api_body(image) if spec else {'Image': image}
+        created = self._request('POST', '/containers/create', {'name': name}, body)
+        self._request('POST', f"/containers/{created['Id']}/start")
+        return created['Id']
+
+    def events(self):
+        """Yield normalised container lifecycle events until the stream ends"""
+        params = {'filters': json.dumps({'type': ['container']})}
+        for event in self._stream('GET', '/events', params, timeout=None):
+            yield normalize_event(event)
+
+    def get_info(self):
+        version = self._request('GET', '/version')
+        info = self._request('GET', '/info')
+        return {
+            'version': version.get('Version', 'Unknown'),
+            'os': info.get('OperatingSystem', 'Unknown')
+        }
+
+    def close(self):
+        """Close all idle pooled connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def normalize_event(event):
+    """Reduce podman and docker event records to {'action', 'id', 'name'}"""
+    actor = event.get('Actor') or {}
+    return {
+        'action': (event.get('Action') or event.get('status') or event.get('Status') or '').lower(),
+        'id': actor.get('ID') or event.get('id') or event.get('ID') or '',
+        'name': (actor.get('Attributes') or {}).get('name') or event.get('Name') or ''
+    }
+
+
+def normalize_docker_container(container):
+    """Reshape a `docker ps --format '{{json .}}'` line like `podman ps --format json` entries"""
+    labels = {}
+    for label in (container.get('Labels') or '').split(','):
+        if '=' in label:
+            key, value = label.split('=', 1)
+            labels[key] = value
+        elif labels and label:
+            # A comma inside the previous label's value
+            key = next(reversed(labels))
+            labels[key] += f",{label}"
+    return {
+        'Id': container.get('ID', ''),
+        'Names': [name for name in (container.get('Names') or '').split(',') if name],
+        'Image': container.get('Image', ''),
+        'Labels': labels,
+        'State': container.get('State', 'unknown'),
+        'Status': container.get('Status', ''),
+        'CreatedAt': container.get('CreatedAt', ''),
+        'Ports': [port for port in (container.get('Ports') or '').split(', ') if port]
+    }
+
+
+def default_socket_path(runtime):
+    """Default API socket for podman (rootful or rootless) or docker"""
+    if runtime.startswith('docker'):
+        return '/var/run/docker.sock'
+    if os.geteuid() != 0 and os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'podman', 'podman.sock')
+    return '/run/podman/podman.sock'
+
+
+class InstrumentedRuntime:
+    """Wraps a runtime backend and times every call as a runtime span"""
+
+    # Long-lived streams and teardown are not meaningful durations
+    UNTIMED = {'events', 'close'}
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def __getattr__(self, name):
+        attr = getattr(self.runtime, name)
+        if name.startswith('_') or name in self.UNTIMED or not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            with METRICS.span(name, kind='runtime'):
+                return attr(*args, **kwargs)
+        return timed
+
+
+def create_runtime(runtime='podman', config=None, url=None):
+    """Build a runtime backend from the `runtime` argument accepted by the AutoPatch components
+
+    'podman' / 'docker' (or a path to either binary) use the CLI, against the
+    remote engine at url when one is given (ssh:// or tcp://), 'podman-api' /
+    'docker-api' or a 'unix://' URL use the REST API over a unix socket, and an
+    already constructed backend is returned unchanged so components can share it.
+    New backends are wrapped so their calls show up in the timing metrics.
+    """
+    if not isinstance(runtime, str):
+        return runtime
+
+    runtime_config = (config or {}).get('autopatch', {}).get('runtime_api', {})
+    if runtime.startswith('unix://'):
+        socket_path = runtime[len('unix://'):]
+    elif runtime.endswith('-api'):
+        socket_path = runtime_config.get('socket') or default_socket_path(runtime)
+    else:
+        return InstrumentedRuntime(CliRuntime(runtime, url))
+
+    return InstrumentedRuntime(ApiRuntime(
+        socket_path,
+        pool_size=runtime_config.get('pool_size', 4),
+        timeout=runtime_config.get('timeout', 60)
+    ))
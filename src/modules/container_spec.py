@@ -0,0 +1,288 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Networks every runtime attaches by default; recreating with them explicitly is redundant
+DEFAULT_NETWORKS = {'', 'default', 'bridge', 'podman', 'slirp4netns', 'pasta'}
+
+# Image metadata labels describe the old image and must not be copied onto the new container
+IMAGE_LABEL_PREFIXES = ('org.opencontainers.image.', 'org.label-schema.')
+
+
+@dataclass
+class PortBinding:
+    container_port: str
+    host_port: str = ''
+    host_ip: str = ''
+
+    def to_cli(self):
+        host = f"{self.host_ip}:" if self.host_ip else ''
+        return f"{host}{self.host_port}:{self.container_port}" if self.host_port else self.container_port
+
+
+@dataclass
+class Mount:
+    destination: str
+    source: str
+    type: str = 'bind'
+    read_only: bool = False
+
+    def to_cli(self):
+        return f"{self.source}:{self.destination}{':ro' if self.read_only else ''}"
+
+
+@dataclass
+class ContainerSpec:
+    """Everything needed to recreate a container from a newer image"""
+
+    id: str
+    name: str
+    image: str
+    env: List[str] = field(default_factory=list)
+    labels: Dict[str, str] = field(default_factory=dict)
+    ports: List[PortBinding] = field(default_factory=list)
+    volumes: List[Mount] = field(default_factory=list)
+    networks: List[str] = field(default_factory=list)
+    network_mode: str = ''
+    restart_policy: str = 'no'
+    restart_retries: int = 0
+    hostname: Optional[str] = None
+    # Overrides of the image's defaults (None keeps whatever the new image sets);
+    # with an entrypoint override, command is the container's full Cmd
+    command: Optional[List[str]] = None
+    entrypoint: Optional[List[str]] = None
+    user: Optional[str] = None
+    working_dir: Optional[str] = None
+    # Privileges, devices and resource limits
+    privileged: bool = False
+    cap_add: List[str] = field(default_factory=list)
+    cap_drop: List[str] = field(default_factory=list)
+    devices: List[str] = field(default_factory=list)
+    memory: int = 0
+    nano_cpus: int = 0
+    cpu_shares: int = 0
+    cpuset_cpus: str = ''
+    # Name resolution and in-memory filesystems
+    extra_hosts: List[str] = field(default_factory=list)
+    dns: List[str] = field(default_factory=list)
+    dns_search: List[str] = field(default_factory=list)
+    tmpfs: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def publishes_host_ports(self):
+        """Whether a second instance would clash with this one on the host"""
+        return self.network_mode == 'host' or any(port.host_port for port in self.ports)
+
+    @property
+    def has_writable_volumes(self):
+        """Whether a second instance would write to the same bind-mounted or volume data"""
+        return any(not volume.read_only for volume in self.volumes)
+
+    @classmethod
+    def from_inspect(cls, info, image_info=None):
+        """Build a spec from `inspect` output, dropping settings inherited from the old image"""
+        config = info.get('Config') or {}
+        host_config = info.get('HostConfig') or {}
+        image_config = (image_info or {}).get('Config') or {}
+
+        image_env = set(image_config.get('Env') or [])
+        image_labels = image_config.get('Labels') or {}
+        labels = {
+            key: value for key, value in (config.get('Labels') or {}).items()
+            if image_labels.get(key) != value and not key.startswith(IMAGE_LABEL_PREFIXES)
+        }
+
+        ports = []
+        for container_port, bindings in (host_config.get('PortBindings') or {}).items():
+            for binding in bindings or [{}]:
+                ports.append(PortBinding(
+                    container_port=container_port,
+                    host_port=binding.get('HostPort') or '',
+                    host_ip=binding.get('HostIp') or ''
+                ))
+
+        volumes = []
+        for mount in info.get('Mounts') or []:
+            if mount.get('Type') not in ('bind', 'volume'):
+                continue
+            source = mount.get('Name') if mount.get('Type') == 'volume' else mount.get('Source')
+            volumes.append(Mount(
+                destination=mount['Destination'],
+                source=source or mount.get('Source', ''),
+                type=mount['Type'],
+                read_only=not mount.get('RW', True)
+            ))
+
+        network_mode = host_config.get('NetworkMode') or ''
+        networks = [
+            name for name in ((info.get('NetworkSettings') or {}).get('Networks') or {})
+            if name not in DEFAULT_NETWORKS
+        ]
+        restart = host_config.get('RestartPolicy') or {}
+        # Runtimes default the hostname to the short container ID
+        hostname = config.get('Hostname')
+        if hostname and info.get('Id', '').startswith(hostname):
+            hostname = None
+
+        def override(key):
+            """The container's value for key when it differs from the image's default"""
+            value = config.get(key)
+            return value if value and value != image_config.get(key) else None
+
+        entrypoint = override('Entrypoint')
+        # Overriding the entrypoint clears the image's CMD, so the full command must be carried along
+        command = (config.get('Cmd') or None) if entrypoint else override('Cmd')
+        nano_cpus = host_config.get('NanoCpus') or 0
+        if not nano_cpus and (host_config.get('CpuQuota') or 0) > 0 and host_config.get('CpuPeriod'):
+            # podman reports --cpus as a CFS quota
+            nano_cpus = host_config['CpuQuota'] * 1000000000 // host_config['CpuPeriod']
+        devices = [
+            ':'.join(filter(None, (device.get('PathOnHost'), device.get('PathInContainer'), device.get('CgroupPermissions'))))
+            for device in host_config.get('Devices') or []
+        ]
+
+        return cls(
+            id=info.get('Id', ''),
+            name=info['Name'].lstrip('/'),
+            image=config.get('Image', ''),
+            env=[var for var in config.get('Env') or [] if var not in image_env],
+            labels=labels,
+            ports=ports,
+            volumes=volumes,
+            networks=networks,
+            network_mode='' if network_mode in DEFAULT_NETWORKS or network_mode in networks else network_mode,
+            restart_policy=restart.get('Name') or 'no',
+            restart_retries=restart.get('MaximumRetryCount') or 0,
+            hostname=hostname,
+            command=command,
+            entrypoint=entrypoint,
+            user=override('User'),
+            working_dir=override('WorkingDir'),
+            privileged=bool(host_config.get('Privileged')),
+            cap_add=host_config.get('CapAdd') or [],
+            cap_drop=host_config.get('CapDrop') or [],
+            devices=devices,
+            memory=host_config.get('Memory') or 0,
+            nano_cpus=nano_cpus,
+            cpu_shares=host_config.get('CpuShares') or 0,
+            cpuset_cpus=host_config.get('CpusetCpus') or '',
+            extra_hosts=host_config.get('ExtraHosts') or [],
+            dns=host_config.get('Dns') or [],
+            dns_search=host_config.get('DnsSearch') or [],
+            tmpfs=host_config.get('Tmpfs') or {}
+        )
+
+    def to_cli_args(self):
+        """`run` options reproducing this container"""
+        args = []
+        if self.hostname:
+            args += ['--hostname', self.hostname]
+        for var in self.env:
+            args += ['-e', var]
+        for key, value in self.labels.items():
+            args += ['--label', f"{key}={value}"]
+        for port in self.ports:
+            args += ['-p', port.to_cli()]
+        for volume in self.volumes:
+            args += ['-v', volume.to_cli()]
+        if self.network_mode:
+            args += ['--network', self.network_mode]
+        for network in self.networks:
+            args += ['--network', network]
+        if self.restart_policy != 'no':
+            policy = self.restart_policy
+            if policy == 'on-failure' and self.restart_retries:
+                policy = f"{policy}:{self.restart_retries}"
+            args += ['--restart', policy]
+        if self.user:
+            args += ['--user', self.user]
+        if self.working_dir:
+            args += ['--workdir', self.working_dir]
+        if self.entrypoint:
+            # --entrypoint takes one word; the rest of an exec-form entrypoint leads the command
+            args += ['--entrypoint', self.entrypoint[0]]
+        if self.privileged:
+            args.append('--privileged')
+        for capability in self.cap_add:
+            args += ['--cap-add', capability]
+        for capability in self.cap_drop:
+            args += ['--cap-drop', capability]
+        for device in self.devices:
+            args += ['--device', device]
+        if self.memory:
+            args += ['--memory', str(self.memory)]
+        if self.nano_cpus:
+            args += ['--cpus', f"{self.nano_cpus / 1000000000:g}"]
+        if self.cpu_shares:
+            args += ['--cpu-shares', str(self.cpu_shares)]
+        if self.cpuset_cpus:
+            args += ['--cpuset-cpus', self.cpuset_cpus]
+        for host in self.extra_hosts:
+            args += ['--add-host', host]
+        for server in self.dns:
+            args += ['--dns', server]
+        for domain in self.dns_search:
+            args += ['--dns-search', domain]
+        for path, options in self.tmpfs.items():
+            args += ['--tmpfs', f"{path}:{options}" if options else path]
+        return args
+
+    def to_cli_command(self):
+        """Arguments that follow the image in `run`: the command override, if any"""
+        command = list(self.entrypoint[1:]) if self.entrypoint else []
+        if self.entrypoint or self.command:
+            command += self.command or []
+        return command
+
+    @staticmethod
+    def _api_device(device):
+        """'host[:container[:permissions]]' as a /containers/create device mapping"""
+        parts = device.split(':')
+        return {
+            'PathOnHost': parts[0],
+            'PathInContainer': parts[1] if len(parts) > 1 else parts[0],
+            'CgroupPermissions': parts[2] if len(parts) > 2 else 'rwm'
+        }
+
+    def to_api_body(self, image):
+        """Docker-compatible /containers/create body reproducing this container"""
+        port_bindings = {}
+        for port in self.ports:
+            port_bindings.setdefault(port.container_port, []).append({'HostIp': port.host_ip, 'HostPort': port.host_port})
+
+        body = {
+            'Image': image,
+            'Env': self.env,
+            'Labels': self.labels,
+            'ExposedPorts': {port.container_port: {} for port in self.ports},
+            'HostConfig': {
+                'PortBindings': port_bindings,
+                'Binds': [volume.to_cli() for volume in self.volumes],
+                'RestartPolicy': {'Name': '' if self.restart_policy == 'no' else self.restart_policy,
+                                  'MaximumRetryCount': self.restart_retries}
+            }
+        }
+        if self.hostname:
+            body['Hostname'] = self.hostname
+        for key, value in (('Cmd', self.command), ('Entrypoint', self.entrypoint),
+                           ('User', self.user), ('WorkingDir', self.working_dir)):
+            if value:
+                body[key] = value
+        host_config = body['HostConfig']
+        host_config.update({
+            'Privileged': self.privileged,
+            'CapAdd': self.cap_add,
+            'CapDrop': self.cap_drop,
+            'Devices': [self._api_device(device) for device in self.devices],
+            'Memory': self.memory,
+            'NanoCpus': self.nano_cpus,
+            'CpuShares': self.cpu_shares,
+            'CpusetCpus': self.cpuset_cpus,
+            'ExtraHosts': self.extra_hosts,
+            'Dns': self.dns,
+            'DnsSearch': self.dns_search,
+            'Tmpfs': self.tmpfs
+        })
+        if self.network_mode or self.networks:
+            body['HostConfig']['NetworkMode'] = self.network_mode or self.networks[0]
+            body['NetworkingConfig'] = {'EndpointsConfig': {network: {} for network in self.networks}}
+        return body
@@ -1,61 +1,311 @@
-import subprocess
-import json
 import logging
+import re
+import time
+from modules.container_runtime import ContainerRuntimeError, create_runtime
+from modules.concurrency import bounded_map
+from modules.container_spec import ContainerSpec
+from modules.image_gc import ImageGarbageCollector
+from modules.metrics import METRICS
+
+SERVICE_LABELS = ('com.docker.compose.service', 'io.podman.compose.service')
 
 class DeploymentManager:
-    def __init__(self, runtime='podman'):
-        self.runtime = runtime
+    def __init__(self, runtime='podman', config=None):
+        self.runtime = create_runtime(runtime, config)
         self.logger = logging.getLogger('autopatch')
+        
+        redeploy_config = (config or {}).get('autopatch', {}).get('redeploy', {})
+        self.max_parallel = redeploy_config.get('max_parallel', 4)
+        self.max_unavailable_percent = redeploy_config.get('max_unavailable_percent', 50)
+        self.depends_on = redeploy_config.get('depends_on') or {}
+        self.strategy = redeploy_config.get('strategy', 'swap')
+        self.readiness_timeout = redeploy_config.get('readiness_timeout', 60)
+        self.readiness_delay = redeploy_config.get('readiness_delay', 2)
+        self.image_gc = ImageGarbageCollector(self.runtime, config)
     
-    def get_container_config(self, container):
-        """Extract container configuration"""
+    @METRICS.span('inspect')
+    def get_container_configs(self, containers):
+        """Inspect all candidate containers (and their images) in one runtime round-trip each
+
+        Returns a dict of container ID -> ContainerSpec; containers that could
+        not be inspected are missing from it.
+        """
+        if not containers:
+            return {}
+        container_ids = [container['Id'] for container in containers]
         try:
-            container_id = container['Id']
-            result = subprocess.run(
-                ['podman', 'inspect', container_id],
-                capture_output=True, text=True, check=True
-            )
-            container_info = json.loads(result.stdout)[0]
-            
-            return {
-                'name': container_info['Name'].lstrip('/'),
-                'image': container_info['Config']['Image'],
-                'env': container_info['Config']['Env'] or [],
-                'ports': [],
-                'volumes': [],
-                'restart_policy': 'no'
-            }
-            
+            infos = self.runtime.inspect_containers(container_ids)
+        except ContainerRuntimeError as e:
+            # A container vanished since listing; inspect the rest one by one
+            self.logger.warning(f"Bulk inspect failed ({e}), inspecting containers individually")
+            infos = []
+            for container_id in container_ids:
+                try:
+                    infos.append(self.runtime.inspect_container(container_id))
+                except ContainerRuntimeError as e:
+                    self.logger.error(f"Error getting container config for {container_id[:12]}: {e}")
         except Exception as e:
-            self.logger.error(f"Error getting container config: {e}")
-            return None
+            self.logger.error(f"Error getting container configs: {e}")
+            return {}
+        
+        try:
+            image_ids = sorted({info['Image'] for info in infos if info.get('Image')})
+            images = {image['Id']: image for image in self.runtime.inspect_images(image_ids)} if image_ids else {}
+        except Exception as e:
+            self.logger.warning(f"Could not inspect images, keeping inherited env and labels: {e}")
+            images = {}
+        
+        configs = {}
+        for info in infos:
+            try:
+                configs[info['Id']] = ContainerSpec.from_inspect(info, images.get(info.get('Image')))
+            except Exception as e:
+                self.logger.error(f"Error parsing container config for {info.get('Name', info.get('Id'))}: {e}")
+        return configs
     
-    def redeploy_container(self, container_config, new_image):
-        """Redeploy container with new image"""
+    def prune_superseded_images(self, results):
+        """Garbage-collect the image versions replaced by the successful redeploys in results"""
+        return self.image_gc.collect(sorted({r['new_image'] for r in results if r and r.get('status') == 'success'}))
+    
+    def get_container_config(self, container):
+        """Extract container configuration"""
+        return self.get_container_configs([container]).get(container['Id'])
+    
+    @METRICS.span('redeploy')
+    def redeploy_container(self, container_config, new_image, stats=None):
+        """Redeploy container with new image
+
+        stats, when given, receives the strategy used and the measured downtime.
+        """
+        stats = stats if stats is not None else {}
+        stats['strategy'] = self.strategy
+        if self.strategy == 'swap':
+            return self._swap_container(container_config, new_image, stats)
+        return self._recreate_container(container_config, new_image, stats)
+    
+    def _recreate_container(self, container_config, new_image, stats):
+        """Stop and remove the old container, then create the new one"""
         try:
-            container_name = container_config['name']
+            container_name = container_config.name
+            down_since = time.monotonic()
             
             self.logger.info(f"Stopping container: {container_name}")
             # Stop container
-            subprocess.run(['podman', 'stop', container_name], check=True)
+            self.runtime.stop_container(container_name)
             
             self.logger.info(f"Removing container: {container_name}")
             # Remove container
-            subprocess.run(['podman', 'rm', container_name], check=True)
+            self.runtime.remove_container(container_name)
             
             self.logger.info(f"Creating new container: {container_name}")
             # Create new container
-            run_cmd = ['podman', 'run', '-d', '--name', container_name, new_image]
-            
-            result = subprocess.run(run_cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                self.logger.info(f"Successfully redeployed {container_name}")
-                return True
-            else:
-                self.logger.error(f"Failed to redeploy {container_name}: {result.stderr}")
+            try:
+                self.runtime.run_container(container_name, new_image, container_config)
+            except ContainerRuntimeError as e:
+                self.logger.error(f"Failed to redeploy {container_name}: {e}")
                 return False
+            
+            stats['downtime_seconds'] = round(time.monotonic() - down_since, 3)
+            self.logger.info(f"Successfully redeployed {container_name}")
+            return True
                 
         except Exception as e:
             self.logger.error(f"Error redeploying {container_name}: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    def _swap_container(self, container_config, new_image, stats):
+        """Start the new container next to the old one and only retire the old one once it is ready
+
+        The old container is renamed out of the way and kept until the new one
+        passes its readiness probe; on any failure it gets its name back (and is
+        restarted if it had to be stopped), so the service is restored at once.
+        Containers publishing host ports, and containers with writable volumes
+        (two instances must never share a data directory), cannot overlap, so
+        their old instance is stopped (but kept) just before the new one starts.
+        """
+        container_name = container_config.name
+        old_name = f"{container_name}-autopatch-old"
+        if container_config.publishes_host_ports:
+            stop_first_reason = 'host ports in use'
+        elif container_config.has_writable_volumes:
+            stop_first_reason = 'writable volumes in use'
+        else:
+            stop_first_reason = None
+        down_since = None
+        
+        try:
+            self._rename_aside(container_name, old_name)
+        except Exception as e:
+            self.logger.error(f"Error redeploying {container_name}: {e}")
+            return False
+        
+        try:
+            if stop_first_reason:
+                down_since = time.monotonic()
+                self.logger.info(f"Stopping container: {old_name} ({stop_first_reason})")
+                self.runtime.stop_container(old_name)
+            
+            self.logger.info(f"Creating new container: {container_name}")
+            self.runtime.run_container(container_name, new_image, container_config)
+            
+            if not self.wait_until_ready(container_name):
+                raise ContainerRuntimeError(f"{container_name} did not become ready within {self.readiness_timeout}s")
+            
+            if not stop_first_reason:
+                down_since = time.monotonic()
+                self.logger.info(f"Stopping container: {old_name}")
+                self.runtime.stop_container(old_name)
+            stats['downtime_seconds'] = round(time.monotonic() - down_since, 3) if stop_first_reason else 0.0
+            
+            self.logger.info(f"Removing container: {old_name}")
+            try:
+                self.runtime.remove_container(old_name)
+            except ContainerRuntimeError as e:
+                self.logger.warning(f"Could not remove old container {old_name}: {e}")
+            
+            self.logger.info(f"Successfully redeployed {container_name}")
+            return True
+        
+        except Exception as e:
+            self.logger.error(f"Failed to redeploy {container_name}, restoring old container: {e}")
+            self._restore_container(container_name, old_name, was_stopped=down_since is not None)
+            if down_since is not None:
+                stats['downtime_seconds'] = round(time.monotonic() - down_since, 3)
+            return False
+    
+    def _rename_aside(self, container_name, old_name):
+        """Rename a container to old_name, first clearing a copy an interrupted swap left under that name"""
+        self.logger.info(f"Renaming container {container_name} to {old_name}")
+        try:
+            self.runtime.rename_container(container_name, old_name)
+            return
+        except ContainerRuntimeError as e:
+            try:
+                self.runtime.inspect_container(old_name)
+            except ContainerRuntimeError:
+                # Nothing in the way, the rename failed for another reason
+                raise e
+        
+        # container_name is running, so the leftover is the instance a crashed swap already replaced
+        self.logger.warning(f"Removing {old_name}, left behind by an interrupted update")
+        try:
+            self.runtime.stop_container(old_name)
+        except ContainerRuntimeError:
+            pass
+        self.runtime.remove_container(old_name)
+        self.runtime.rename_container(container_name, old_name)
+    
+    def _restore_container(self, container_name, old_name, was_stopped):
+        """Throw away a failed replacement and put the old container back under its name"""
+        for action in (self.runtime.stop_container, self.runtime.remove_container):
+            try:
+                action(container_name)
+            except ContainerRuntimeError:
+                pass
+        try:
+            self.runtime.rename_container(old_name, container_name)
+            if was_stopped:
+                self.runtime.start_container(container_name)
+        except Exception as e:
+            self.logger.error(f"Could not restore {container_name} from {old_name}: {e}")
+    
+    @METRICS.span('readiness')
+    def wait_until_ready(self, container_name):
+        """Wait until a container is healthy, or has stayed running for readiness_delay seconds without a healthcheck"""
+        deadline = time.monotonic() + self.readiness_timeout
+        running_since = None
+        
+        while time.monotonic() < deadline:
+            state = (self.runtime.inspect_container(container_name) or {}).get('State') or {}
+            health = (state.get('Health') or state.get('Healthcheck') or {}).get('Status')
+            
+            if not state.get('Running'):
+                if state.get('Status') in ('exited', 'dead'):
+                    return False
+                running_since = None
+            elif health == 'unhealthy':
+                return False
+            elif health == 'healthy':
+                return True
+            elif not health:
+                running_since = running_since or time.monotonic()
+                if time.monotonic() - running_since >= self.readiness_delay:
+                    return True
+            
+            time.sleep(0.5)
+        
+        return False
+    
+    def service_name(self, item):
+        """Service an outdated container belongs to: its compose label, else its name minus a replica suffix"""
+        labels = (item.get('container') or {}).get('Labels') or {}
+        for label in SERVICE_LABELS:
+            if labels.get(label):
+                return labels[label]
+        return re.sub(r'[-_]\d+$', '', item['container_name'])
+
+    def plan_redeploy_order(self, items):
+        """Group items into dependency levels; every service in a level waits for the previous levels"""
+        services = {}
+        for item in items:
+            services.setdefault(self.service_name(item), []).append(item)
+
+        levels, placed = [], set()
+        remaining = list(services)
+        while remaining:
+            ready = [s for s in remaining
+                     if all(dep in placed or dep not in services for dep in self.depends_on.get(s) or [])]
+            if not ready:
+                self.logger.warning(f"Circular redeploy dependencies between {remaining}, ignoring their order")
+                ready = remaining
+            levels.append([item for service in ready for item in services[service]])
+            placed.update(ready)
+            remaining = [s for s in remaining if s not in placed]
+        return levels
+
+    @METRICS.span('schedule')
+    def schedule_redeploys(self, items, redeploy, progress=None):
+        """Run redeploy(item) for every outdated container and return the results in input order
+
+        Dependency levels (redeploy.depends_on) run one after another. Within a
+        level up to max_parallel containers are redeployed at once, but only
+        max_unavailable_percent of a service's replicas at a time, so a
+        service is never taken down completely. Dependents of a service with
+        failed redeploys are skipped.
+        """
+        results = {}
+        failed_services = set()
+
+        for level in self.plan_redeploy_order(items):
+            sizes = {}
+            for item in level:
+                sizes[self.service_name(item)] = sizes.get(self.service_name(item), 0) + 1
+
+            runnable = []
+            for item in level:
+                service = self.service_name(item)
+                blocked = [dep for dep in self.depends_on.get(service) or [] if dep in failed_services]
+                if blocked:
+                    self.logger.warning(f"Skipping {item['container_name']}: dependency {blocked[0]} failed to update")
+                    if progress:
+                        progress(item['container_name'], 'skipped', f"dependency {blocked[0]} failed")
+                    results[id(item)] = {
+                        'container_name': item['container_name'],
+                        'status': 'failed',
+                        'error': f"Dependency {blocked[0]} failed to update"
+                    }
+                else:
+                    runnable.append(item)
+
+            level_results = bounded_map(
+                redeploy, runnable,
+                key=self.service_name,
+                max_workers=self.max_parallel,
+                key_limit=lambda service: max(1, sizes[service] * self.max_unavailable_percent // 100)
+            )
+            for item, result in zip(runnable, level_results):
+                results[id(item)] = result
+                if result and result.get('status') == 'failed':
+                    failed_services.add(self.service_name(item))
+
+        return [results[id(item)] for item in items]
@@ -0,0 +1,203 @@
+import copy
+import logging
+import time
+import uuid
+from modules.concurrency import bounded_map
+from modules.container_runtime import create_runtime
+from modules.deployment_manager import DeploymentManager
+from modules.log_pipeline import log_context
+from modules.pull_scheduler import PullScheduler
+from modules.registry_client import RegistryClient, parse_image_reference
+from modules.update_detector import UpdateDetector
+from modules.update_planner import StalePlanError, UpdatePlanner
+
+LOCAL_HOST = 'local'
+
+
+class FleetHost:
+    """One container host with its own runtime, detector, deployer and planner"""
+
+    def __init__(self, name, runtime, config, registry_client, pull_scheduler):
+        self.name = name
+        self.runtime = runtime
+        self.update_detector = UpdateDetector(runtime, config, registry_client, pull_scheduler)
+        self.deployment_manager = DeploymentManager(runtime, config)
+        self.planner = UpdatePlanner(self.update_detector, self.deployment_manager, config)
+
+
+class Fleet:
+    """The container hosts AutoPatch manages, patched concurrently
+
+    Hosts come from the `hosts` list in config.yaml (local or remote CLI
+    endpoints, API sockets); without it the fleet is just the local
+    container_runtime. All hosts share one registry client and pull
+    scheduler, and image tags are resolved against the registry once for the
+    whole fleet before the hosts are checked. A fleet plan bundles one plan
+    per host.
+    """
+
+    def __init__(self, config):
+        autopatch_config = config['autopatch']
+        fleet_config = autopatch_config.get('fleet', {})
+        self.max_parallel_hosts = fleet_config.get('max_parallel_hosts', 4)
+        self.logger = logging.getLogger('autopatch')
+
+        self.registry_client = RegistryClient(config)
+        # Registry rate limits and the bandwidth budget are shared by every host's pulls
+        self.pull_scheduler = PullScheduler(config, self.registry_client)
+        host_entries = autopatch_config.get('hosts') or [{'name': LOCAL_HOST}]
+        self.hosts = []
+        for entry in host_entries:
+            # One runtime backend (and connection pool) per host, shared by detection and deployment
+            host_runtime = create_runtime(
+                entry.get('runtime') or autopatch_config.get('container_runtime', 'podman'), config, entry.get('url')
+            )
+            self.hosts.append(FleetHost(
+                entry['name'], host_runtime, self._host_config(config, entry), self.registry_client, self.pull_scheduler
+            ))
+
+    @staticmethod
+    def _host_config(config, entry):
+        """config with a host's own redeploy/concurrency overrides applied"""
+        if not any(key in entry for key in ('max_parallel', 'redeploy', 'concurrency')):
+            return config
+        host_config = copy.deepcopy(config)
+        autopatch_config = host_config['autopatch']
+        for section in ('redeploy', 'concurrency'):
+            autopatch_config.setdefault(section, {}).update(entry.get(section) or {})
+        if 'max_parallel' in entry:
+            # Shorthand for the host's redeploy cap
+            autopatch_config['redeploy']['max_parallel'] = entry['max_parallel']
+        return host_config
+
+    @property
+    def multi_host(self):
+        return len(self.hosts) > 1
+
+    def host(self, name):
+        return next((host for host in self.hosts if host.name == name), None)
+
+    def host_progress(self, host, progress):
+        """Progress callback that names containers host/name once there are several hosts"""
+        if not progress or not self.multi_host:
+            return progress
+        return lambda container=None, *args, **kwargs: progress(
+            f"{host.name}/{container}" if container else container, *args, **kwargs
+        )
+
+    def run_per_host(self, func, hosts=None):
+        """Run func(host) for each host concurrently; returns {host name: result or exception}"""
+        hosts = list(hosts if hosts is not None else self.hosts)
+
+        def call(host):
+            try:
+                with log_context(host=host.name):
+                    return func(host)
+            except Exception as e:
+                self.logger.error(f"Host {host.name} failed: {e}")
+                return e
+
+        results = bounded_map(call, hosts, max_workers=self.max_parallel_hosts)
+        return {host.name: result for host, result in zip(hosts, results)}
+
+    def list_containers(self):
+        """Running containers per host, listed concurrently"""
+        return self.run_per_host(lambda host: host.update_detector.get_running_containers())
+
+    def resolve_images(self, containers_by_host):
+        """Look up every distinct image tag in the fleet once, ahead of the hosts' checks
+
+        Run inside registry_client.shared_lookups(), the hosts' own lookups
+        are answered from this pass even with the manifest cache disabled.
+        """
+        if self.hosts[0].update_detector.mode == 'pull':
+            return
+        images = {}
+        for containers in containers_by_host.values():
+            for container in containers:
+                images.setdefault(parse_image_reference(container['Image']), container['Image'])
+
+        detector = self.hosts[0].update_detector
+        bounded_map(
+            self.registry_client.get_remote_digest, images.values(),
+            key=lambda image: parse_image_reference(image)[0],
+            max_workers=detector.max_workers,
+            key_limit=lambda registry: detector.registry_limits.get(registry, detector.per_registry)
+        )
+        self.logger.info(f"Resolved {len(images)} images for {len(containers_by_host)} hosts")
+
+    def create_plan(self, containers_by_host=None, progress=None):
+        """Plan updates on every host and bundle them into one fleet plan"""
+        containers_by_host = containers_by_host or self.list_containers()
+        listed = {name: containers for name, containers in containers_by_host.items()
+                  if not isinstance(containers, Exception)}
+        with self.registry_client.shared_lookups():
+            self.resolve_images(listed)
+            host_plans = self.run_per_host(
+                # Host plans are only saved as part of the fleet plan
+                lambda host: host.planner.create_plan(listed[host.name], self.host_progress(host, progress), store=False),
+                [host for host in self.hosts if host.name in listed]
+            )
+
+        plans = {name: plan for name, plan in host_plans.items() if not isinstance(plan, Exception)}
+        errors = {name: str(result) for name, result in list(containers_by_host.items()) + list(host_plans.items())
+                  if isinstance(result, Exception)}
+        created_at = time.time()
+        plan = {
+            'id': uuid.uuid4().hex[:12],
+            'created_at': created_at,
+            'expires_at': min([host_plan['expires_at'] for host_plan in plans.values()] or [created_at]),
+            'hosts': plans,
+            'errors': errors,
+            'containers': [dict(entry, host=name) for name, host_plan in plans.items() for entry in host_plan['containers']],
+            'order': {name: host_plan['order'] for name, host_plan in plans.items()},
+            'download_bytes': sum(host_plan['download_bytes'] for host_plan in plans.values())
+        }
+        self.hosts[0].planner.store_plan(plan)
+        return plan
+
+    def get_plan(self, plan_id):
+        """A fleet plan by id, or None"""
+        plan = self.hosts[0].planner.get_plan(plan_id)
+        return plan if plan and 'hosts' in plan else None
+
+    def prepare_apply(self, plan, containers_by_host=None, progress=None):
+        """Validate and download every host's part of a fleet plan
+
+        Returns {host name: items for the redeploy scheduler}. Raises
+        StalePlanError (naming the hosts) if any part is out of date.
+        """
+        hosts = [host for host in self.hosts if plan['hosts'].get(host.name, {}).get('containers')]
+        unknown = set(plan['hosts']) - {host.name for host in self.hosts}
+        if unknown:
+            raise StalePlanError([f"host {name} is no longer configured" for name in sorted(unknown)])
+
+        containers_by_host = containers_by_host or self.run_per_host(
+            lambda host: host.update_detector.get_running_containers(), hosts
+        )
+
+        def prepare(host):
+            try:
+                return host.planner.prepare_apply(
+                    plan['hosts'][host.name], containers_by_host[host.name], self.host_progress(host, progress)
+                )
+            except StalePlanError as e:
+                # Collected below into one error for the whole fleet
+                return e
+
+        # Hosts re-checking the same tags share one registry lookup each
+        with self.registry_client.shared_lookups():
+            prepared = self.run_per_host(prepare, hosts)
+
+        problems = []
+        for name, result in prepared.items():
+            if isinstance(result, StalePlanError):
+                problems += [f"{name}: {problem}" for problem in result.problems]
+            elif isinstance(result, Exception):
+                problems.append(f"{name}: {result}")
+        if problems:
+            raise StalePlanError(problems)
+        return prepared
+
+    def save_cache(self):
+        self.registry_client.save_cache()
@@ -0,0 +1,77 @@
+import logging
+from modules.container_runtime import ContainerRuntimeError
+from modules.metrics import METRICS
+from modules.registry_client import parse_image_reference
+
+
+class ImageGarbageCollector:
+    """Removes the local image versions that redeploys superseded
+
+    After a cycle the previous versions of every updated repository are
+    pruned, newest kept first up to image_gc.keep_versions so a rollback does
+    not need a pull. Images still used by a container are never removed: the
+    running ones are skipped and the runtime refuses the stopped ones.
+    """
+
+    def __init__(self, runtime, config=None):
+        gc_config = (config or {}).get('autopatch', {}).get('image_gc', {})
+        self.enabled = gc_config.get('enabled', True)
+        self.keep_versions = max(0, gc_config.get('keep_versions', 1))
+        self.runtime = runtime
+        self.logger = logging.getLogger('autopatch')
+
+    @staticmethod
+    def _untagged(image):
+        """True once no tag points at the image any more (the tag moved to a newer pull)"""
+        return not [tag for tag in image.get('RepoTags') or [] if not tag.startswith('<none>')]
+
+    @staticmethod
+    def _image_id(image_id):
+        """Image ID without the sha256: prefix some runtimes add"""
+        return (image_id or '').split(':')[-1]
+
+    @METRICS.span('gc')
+    def collect(self, updated_images):
+        """Prune superseded versions of the given (successfully updated) image references
+
+        Returns {'removed': [image ids], 'reclaimed_bytes': n, 'kept': n}.
+        reclaimed_bytes adds up the sizes the runtime reports for the removed
+        images; layers they shared with kept images are not told apart.
+        """
+        summary = {'removed': [], 'reclaimed_bytes': 0, 'kept': 0}
+        if not self.enabled or not updated_images:
+            return summary
+
+        try:
+            images = self.runtime.list_images()
+            running = {self._image_id(container.get('ImageID')) for container in self.runtime.list_containers()}
+        except Exception as e:
+            self.logger.error(f"Skipping image garbage collection, could not list images: {e}")
+            return summary
+
+        repositories = sorted({parse_image_reference(image)[:2] for image in updated_images})
+        for repository in repositories:
+            # Earlier pulls of the repository that lost their tag to a newer one; other tags are left alone
+            superseded = sorted(
+                (image for image in images
+                 if self._untagged(image) and self._image_id(image['Id']) not in running
+                 and repository in {parse_image_reference(d)[:2] for d in image.get('RepoDigests') or []}),
+                key=lambda image: str(image.get('Created', '')), reverse=True
+            )
+            summary['kept'] += len(superseded[:self.keep_versions])
+
+            for image in superseded[self.keep_versions:]:
+                try:
+                    self.runtime.remove_image(image['Id'])
+                except ContainerRuntimeError as e:
+                    self.logger.info(f"Keeping image {image['Id'][:19]} of {'/'.join(repository)}: {e}")
+                    summary['kept'] += 1
+                    continue
+                summary['removed'].append(image['Id'])
+                summary['reclaimed_bytes'] += image.get('Size') or 0
+
+        if summary['removed']:
+            self.logger.info(
+                f"Removed {len(summary['removed'])} superseded images, reclaimed {summary['reclaimed_bytes']} bytes"
+            )
+        return summary
@@ -0,0 +1,133 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+
+class Job:
+    """A background operation with its progress log and final result"""
+
+    def __init__(self, kind, func):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.func = func
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.progress = []
+        self.changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def report(self, container=None, stage=None, message=None, **extra):
+        """Append a progress event and wake any listeners"""
+        with self.changed:
+            event = {'seq': len(self.progress), 'time': time.time(), 'container': container, 'stage': stage}
+            if message:
+                event['message'] = message
+            event.update(extra)
+            self.progress.append(event)
+            self.changed.notify_all()
+
+    def wait_for_events(self, since, timeout=15):
+        """Return progress events after index `since`, blocking up to timeout for new ones"""
+        with self.changed:
+            if len(self.progress) <= since and not self.finished:
+                self.changed.wait(timeout)
+            return self.progress[since:]
+
+    def to_dict(self, include_progress=True):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result': self.result,
+            'error': self.error
+        }
+        if include_progress:
+            data['progress'] = list(self.progress)
+        return data
+
+
+class JobManager:
+    """Runs check/update jobs one at a time from a bounded queue
+
+    A single worker means two submitted runs never touch the same containers
+    concurrently; when the queue is full new submissions are refused.
+    """
+
+    def __init__(self, max_queued=4, history=100):
+        self.history = history
+        self.logger = logging.getLogger('autopatch')
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, kind, func):
+        """Queue func(job) to run in the background and return its Job"""
+        job = Job(kind, func)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} pending)")
+
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                oldest = next(iter(self._jobs.values()))
+                if not oldest.finished:
+                    break
+                self._jobs.popitem(last=False)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='job-worker', daemon=True)
+                self._worker.start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def find_unfinished(self, kind):
+        """The most recent queued or running job of kind, or None"""
+        with self._lock:
+            return next((job for job in reversed(self._jobs.values()) if job.kind == kind and not job.finished), None)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            job.report(stage='started')
+            try:
+                result, status = job.func(job), 'succeeded'
+            except Exception as e:
+                self.logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+                result, status = None, 'failed'
+                job.error = str(e)
+
+            # Publish the outcome and its final event together so listeners never miss it
+            with job.changed:
+                job.result = result
+                job.status = status
+                job.finished_at = time.time()
+                job.report(stage=status)
+            self._queue.task_done()
@@ -0,0 +1,212 @@
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Fields attached to every record logged while a log_context() block is active
+CONTEXT_FIELDS = ('cycle_id', 'host', 'container', 'phase', 'duration')
+ROTATE_INTERVALS = {'hourly': 3600, 'daily': 86400}
+
+_context = contextvars.ContextVar('autopatch_log_context', default={})
+_listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    """Tag records logged inside the block (and in the worker threads it starts) with fields"""
+    token = _context.set(dict(_context.get(), **fields))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def log_fields():
+    """The context fields currently in effect"""
+    return _context.get()
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log_context() fields onto each record in the logging thread"""
+
+    def filter(self, record):
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any context fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = round(value, 3) if name == 'duration' else value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops them rather than wait when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        # Only the message arguments are merged here; formatting is left to the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            return
+        if self._unreported:
+            # Say so in the log itself once there is room again
+            dropped, self._unreported = self._unreported, 0
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': 'autopatch', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Dropped {dropped} log records while the log queue was full"
+                }))
+            except queue.Full:
+                self._unreported += dropped
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """Log file rolled over by size and/or on a time boundary, old segments gzip-compressed
+
+    Segments are numbered like RotatingFileHandler's (autopatch.log.1.gz is
+    the newest) and backup_count of them are kept.
+    """
+
+    def __init__(self, filename, max_bytes=0, when=None, backup_count=7, compress=True):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.when = when if when in ROTATE_INTERVALS or when == 'midnight' else None
+        if compress:
+            self.namer = lambda name: f"{name}.gz"
+            self.rotator = self._compress
+        started = os.path.getmtime(filename) if os.path.exists(filename) else time.time()
+        self.rollover_at = self._next_rollover(started)
+
+    def _next_rollover(self, after):
+        if self.when is None:
+            return None
+        if self.when == 'midnight':
+            return (datetime.fromtimestamp(after).replace(hour=0, minute=0, second=0, microsecond=0)
+                    + timedelta(days=1)).timestamp()
+        interval = ROTATE_INTERVALS[self.when]
+        return (after // interval + 1) * interval
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        self.rollover_at = self._next_rollover(time.time())
+        # A period with nothing logged leaves no empty segment behind
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            super().doRollover()
+
+
+def _file_handler(log_config):
+    rotation = log_config.get('rotation', {})
+    handler = RotatingLogFileHandler(
+        log_config['log_file'],
+        max_bytes=rotation.get('max_bytes', 0),
+        when=rotation.get('when'),
+        backup_count=rotation.get('backup_count', 7),
+        compress=rotation.get('compress', True)
+    )
+    if log_config.get('format', 'json') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return handler
+
+
+def setup_logging(config):
+    """Route the process's logging through a queue to a background writer thread
+
+    Loggers only enqueue records (dropping them if queue_size are already
+    waiting), so update cycles never wait on console or disk I/O. The listener
+    thread writes the log file (JSON lines by default, rotated and compressed
+    as configured) and a plain-text console stream. Calling it again replaces
+    the previous pipeline.
+    """
+    global _listener
+    log_config = config['autopatch'].get('logging', {})
+
+    handlers = []
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handlers.append(console)
+    if log_config.get('log_file'):
+        os.makedirs(os.path.dirname(log_config['log_file']) or '.', exist_ok=True)
+        handlers.append(_file_handler(log_config))
+
+    stop_logging()
+    log_queue = queue.Queue(maxsize=log_config.get('queue_size', 10000))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(log_config.get('log_level', 'INFO'))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush the queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+# Records still queued at exit are written out
+atexit.register(stop_logging)
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ManifestCache:
+    """Tag->digest cache with an in-process LRU in front of a JSON file in the state directory"""
+
+    def __init__(self, config=None):
+        autopatch_config = (config or {}).get('autopatch', {})
+        cache_config = autopatch_config.get('cache', {})
+        state_dir = autopatch_config.get('logging', {}).get('state_dir', os.path.join('logs', 'state'))
+
+        self.ttl = cache_config.get('ttl_seconds', 300)
+        self.max_entries = cache_config.get('lru_size', 512)
+        self.path = os.path.join(state_dir, 'manifest_cache.json')
+        self.logger = logging.getLogger('autopatch')
+
+        self._lru = OrderedDict()
+        self._disk = None
+        self._disk_mtime = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load_disk(self):
+        """(Re)load the on-disk entries when the file changed since the last read"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+
+        if self._disk is not None and mtime == self._disk_mtime:
+            return
+        self._disk_mtime = mtime
+        if mtime is None:
+            self._disk = self._disk or {}
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                loaded = json.load(f)
+            # Keep our own unsaved entries over whatever another process wrote
+            if self._dirty and self._disk:
+                loaded.update(self._disk)
+            self._disk = loaded
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable manifest cache {self.path}: {e}")
+            self._disk = self._disk or {}
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached entry for key (fresh or not), or None"""
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                return entry
+
+            self._load_disk()
+            entry = self._disk.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+            return entry
+
+    def is_fresh(self, entry):
+        """Whether an entry is still inside its TTL"""
+        return entry is not None and time.time() - entry.get('checked_at', 0) < self.ttl
+
+    def put(self, key, digest, etag=None):
+        """Store a freshly resolved digest"""
+        entry = {'digest': digest, 'etag': etag, 'checked_at': time.time()}
+        with self._lock:
+            self._load_disk()
+            self._disk[key] = entry
+            self._remember(key, entry)
+            self._dirty = True
+        return entry
+
+    def touch(self, key):
+        """Extend an entry's lifetime after the registry confirmed it unchanged (304)"""
+        with self._lock:
+            self._load_disk()
+            entry = self._lru.get(key) or self._disk.get(key)
+            if entry is None:
+                return None
+            entry = dict(entry, checked_at=time.time())
+            self._disk[key] = entry
+            self._remember(key, entry)
+            self._dirty = True
+        return entry
+
+    def save(self):
+        """Write pending entries to disk, dropping ones long past their TTL"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                cutoff = time.time() - max(self.ttl * 10, 86400)
+                entries = {k: v for k, v in self._disk.items() if v.get('checked_at', 0) >= cutoff}
+
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.path)
+
+                self._disk = entries
+                self._disk_mtime = os.path.getmtime(self.path)
+                self._dirty = False
+            except Exception as e:
+                self.logger.error(f"Error saving manifest cache: {e}")
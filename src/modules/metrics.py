@@ -0,0 +1,198 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from modules.log_pipeline import log_context
+
+# CycleTimings collecting the spans of the current context (a cycle and the workers it starts)
+_recorders = contextvars.ContextVar('autopatch_cycle_timings', default=())
+
+# Phases run once per host and cycle, whose completion is logged at INFO; the per-image and
+# per-container ones (registry, check, pull, redeploy, readiness) are logged at DEBUG
+CYCLE_PHASES = {'cycle', 'list', 'inspect', 'plan', 'prepare', 'prefetch', 'schedule', 'report', 'gc'}
+
+# Seconds; spans range from millisecond runtime calls to multi-minute cycles
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(float(bound))),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class CycleTimings:
+    """Per-span totals collected while one cycle runs, for its report"""
+
+    def __init__(self):
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, failed=False):
+        with self._lock:
+            span = self._spans.setdefault(name, {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            span['count'] += 1
+            span['errors'] += int(failed)
+            span['total_seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def summary(self):
+        with self._lock:
+            return {
+                name: dict(span, total_seconds=round(span['total_seconds'], 3), max_seconds=round(span['max_seconds'], 3))
+                for name, span in sorted(self._spans.items())
+            }
+
+
+class Metrics:
+    """Process-wide timing spans, counters and their Prometheus text rendering"""
+
+    def __init__(self):
+        self.phase_seconds = Histogram(
+            'autopatch_phase_duration_seconds', 'Duration of update cycle phases', ['phase'])
+        self.phase_errors = Counter(
+            'autopatch_phase_errors_total', 'Update cycle phases that raised an error', ['phase'])
+        self.runtime_seconds = Histogram(
+            'autopatch_runtime_call_duration_seconds', 'Duration of container runtime calls', ['op'])
+        self.runtime_errors = Counter(
+            'autopatch_runtime_call_errors_total', 'Container runtime calls that failed', ['op'])
+        self.cycles = Counter('autopatch_cycles_total', 'Completed update cycles', ['status'])
+        self.container_updates = Counter(
+            'autopatch_container_updates_total', 'Container redeploys by outcome', ['status', 'strategy'])
+        self.pull_wait_seconds = Histogram(
+            'autopatch_pull_wait_seconds', 'Time image pulls waited for the pull throttles', ['registry'])
+        self.pull_retries = Counter(
+            'autopatch_pull_retries_total', 'Image pulls retried after a failure', ['registry', 'reason'])
+        self.logger = logging.getLogger('autopatch')
+
+    @contextmanager
+    def recording(self, timings=None):
+        """Collect the spans finished inside the block into a CycleTimings
+
+        Only spans from this context count: the block itself and the worker
+        threads it starts through bounded_map, not concurrent jobs or
+        background threads.
+        """
+        timings = timings or CycleTimings()
+        recorders = _recorders.get()
+        if timings in recorders:
+            yield timings
+            return
+        token = _recorders.set(recorders + (timings,))
+        try:
+            yield timings
+        finally:
+            _recorders.reset(token)
+
+    def _finish(self, kind, name, seconds, failed):
+        if kind == 'runtime':
+            self.runtime_seconds.observe(seconds, op=name)
+            if failed:
+                self.runtime_errors.inc(op=name)
+        else:
+            self.phase_seconds.observe(seconds, phase=name)
+            if failed:
+                self.phase_errors.inc(phase=name)
+            level = logging.INFO if name in CYCLE_PHASES else logging.DEBUG
+            self.logger.log(level, f"Phase {name} {'failed' if failed else 'finished'} after {seconds:.3f}s",
+                            extra={'phase': name, 'duration': seconds})
+
+        for timings in _recorders.get():
+            timings.add(f"{kind}.{name}" if kind == 'runtime' else name, seconds, failed)
+
+    @contextmanager
+    def span(self, name, kind='phase'):
+        """Time the block as a cycle phase, or as a runtime call with kind='runtime'
+
+        Records logged inside a phase carry its name in their `phase` field.
+        """
+        started = time.monotonic()
+        failed = False
+        try:
+            with log_context(phase=name) if kind == 'phase' else nullcontext():
+                yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._finish(kind, name, time.monotonic() - started, failed)
+
+    def record_cycle(self, update_results, status='completed'):
+        """Count a finished cycle and its per-container outcomes"""
+        self.cycles.inc(status=status)
+        for result in update_results:
+            self.container_updates.inc(status=result.get('status', 'unknown'), strategy=result.get('strategy', ''))
+
+    def render(self):
+        lines = []
+        for metric in (self.phase_seconds, self.phase_errors, self.runtime_seconds, self.runtime_errors,
+                       self.cycles, self.container_updates, self.pull_wait_seconds, self.pull_retries):
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by every component in the process
+METRICS = Metrics()
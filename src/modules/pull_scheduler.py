@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from modules.concurrency import backoff_delay
+from modules.container_runtime import ContainerRuntimeError
+from modules.metrics import METRICS
+from modules.registry_client import parse_image_reference
+
+# Lower numbers are pulled first
+PRIORITY_APPLY = 0
+PRIORITY_CHECK = 1
+PRIORITY_PREFETCH = 2
+
+# Matched against lowercased pull errors; status codes only count next to "status"/"code",
+# so digests, sizes and ports that happen to contain 429 or 503 are not mistaken for them
+RATE_LIMIT_PATTERN = re.compile(r'toomanyrequests|too many requests|rate limit|\b(?:status|code)\W*429\b')
+TRANSIENT_PATTERN = re.compile(r'timeout|timed out|connection reset|connection refused|unexpected eof|'
+                               r'temporarily unavailable|bad gateway|service unavailable|'
+                               r'\b(?:status|code)\W*50[234]\b')
+
+
+class PullRateLimited(ContainerRuntimeError):
+    """A pull that would have to wait longer than throttling.max_wait for its registry"""
+
+
+class TokenBucket:
+    """Refills at rate tokens per second up to capacity; reservations may run into debt"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until amount tokens are available (a bucket in debt first pays it off)"""
+        self._refill(now)
+        if self.tokens >= min(amount, self.capacity) and self.tokens >= 0:
+            return 0
+        if not self.rate:
+            return float('inf')
+        return (min(amount, self.capacity) - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= amount
+
+    def drain(self, now):
+        """Empty the bucket, e.g. after the registry refused a request"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0)
+
+
+class PullScheduler:
+    """Paces image pulls so a large cycle degrades to slower pulls instead of failing ones
+
+    Pulls wait for a free slot (throttling.max_concurrent_pulls), their
+    registry's token bucket and the global bandwidth budget, and waiting pulls
+    are admitted by priority (redeploys, then checks, then prefetch). Rate-limit
+    headers seen by the registry client tighten a registry's bucket to what it
+    has left, and rate-limited or transient pull failures are retried with
+    jittered exponential backoff.
+    """
+
+    def __init__(self, config=None, registry_client=None):
+        throttling_config = (config or {}).get('autopatch', {}).get('throttling', {})
+        self.max_concurrent = max(1, throttling_config.get('max_concurrent_pulls', 4))
+        self.pulls_per_minute = throttling_config.get('pulls_per_minute', 0)
+        self.registry_pulls_per_minute = throttling_config.get('registry_pulls_per_minute') or {}
+        self.burst = max(1, throttling_config.get('burst', 5))
+        # Megabits per second -> bytes per second, with one second's worth as burst
+        self.bandwidth = throttling_config.get('bandwidth_mbps', 0) * 125000
+        self.max_retries = throttling_config.get('max_retries', 4)
+        self.backoff_base = throttling_config.get('backoff_base', 5)
+        self.backoff_max = throttling_config.get('backoff_max', 300)
+        self.max_wait = throttling_config.get('max_wait', 900)
+        self.registry_client = registry_client
+        self.logger = logging.getLogger('autopatch')
+
+        self._budget = TokenBucket(self.bandwidth, self.bandwidth) if self.bandwidth else None
+        self._buckets = {}
+        self._limits_seen = {}
+        self._blocked_until = {}
+        self._waiting = []
+        self._active = 0
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _bucket(self, registry):
+        bucket = self._buckets.get(registry)
+        if bucket is None:
+            per_minute = self.registry_pulls_per_minute.get(registry, self.pulls_per_minute)
+            # Unpaced registries get an always-full bucket until they report a limit
+            bucket = self._buckets[registry] = TokenBucket(per_minute / 60, self.burst) if per_minute else None
+        return bucket
+
+    def _apply_rate_limit(self, registry, now):
+        """Fold the latest rate-limit headers from the registry into its bucket"""
+        limits = self.registry_client.rate_limits.get(registry) if self.registry_client else None
+        if not limits or self._limits_seen.get(registry) == limits['seen']:
+            return
+        self._limits_seen[registry] = limits['seen']
+
+        if limits.get('retry_after'):
+            self._blocked_until[registry] = max(self._blocked_until.get(registry, 0), limits['retry_after'])
+        if limits.get('remaining') is None or not limits.get('limit') or not limits.get('window'):
+            return
+        bucket = self._bucket(registry)
+        rate = limits['limit'] / limits['window']
+        if bucket is None or rate < bucket.rate:
+            bucket = self._buckets[registry] = TokenBucket(rate, self.burst)
+        bucket.take(0, now)
+        # Pulls made since the headers were sent have already been taken from this bucket
+        bucket.tokens = min(bucket.tokens, limits['remaining'])
+
+    def _delay(self, registry, size, now):
+        """Seconds until a pull from registry of size bytes may start"""
+        self._apply_rate_limit(registry, now)
+        delay = max(0, self._blocked_until.get(registry, 0) - now)
+        bucket = self._bucket(registry)
+        if bucket:
+            delay = max(delay, bucket.delay(1, now))
+        if self._budget and size:
+            delay = max(delay, self._budget.delay(size, now))
+        return delay
+
+    def _acquire(self, registry, priority, size):
+        """Block until this pull is the highest-priority one allowed to start"""
+        started = time.monotonic()
+        ticket = (priority, next(self._sequence), registry, size)
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    timeout = None
+                    if self._active < self.max_concurrent:
+                        for waiting in sorted(self._waiting):
+                            delay = self._delay(waiting[2], waiting[3], now)
+                            if delay <= 0:
+                                break
+                            if waiting is ticket and delay > self.max_wait:
+                                raise PullRateLimited(
+                                    f"{registry} is rate limited for another {int(delay)}s, pull deferred"
+                                )
+                            timeout = delay if timeout is None else min(timeout, delay)
+                        else:
+                            waiting = None
+                        if waiting is ticket:
+                            break
+                    self._cond.wait(timeout)
+
+                self._active += 1
+                bucket = self._bucket(registry)
+                if bucket:
+                    bucket.take(1, now)
+                if self._budget and size:
+                    self._budget.take(size, now)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        METRICS.pull_wait_seconds.observe(time.monotonic() - started, registry=registry)
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _back_off(self, registry, error, attempt):
+        """Delay before retrying a failed pull, or None if it should not be retried"""
+        message = str(error).lower()
+        rate_limited = bool(RATE_LIMIT_PATTERN.search(message))
+        if attempt >= self.max_retries or not (rate_limited or TRANSIENT_PATTERN.search(message)):
+            return None
+
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+        METRICS.pull_retries.inc(registry=registry, reason='rate_limited' if rate_limited else 'transient')
+        if rate_limited:
+            # Hold back every pull from this registry, not just the one that was refused
+            with self._cond:
+                now = time.monotonic()
+                self._blocked_until[registry] = max(self._blocked_until.get(registry, 0), now + delay)
+                bucket = self._bucket(registry)
+                if bucket:
+                    bucket.drain(now)
+        return delay
+
+    def pull(self, image, pull_func, priority=PRIORITY_CHECK, size=None):
+        """Run pull_func() for image once the throttles allow it, retrying rate-limited and transient failures"""
+        registry = parse_image_reference(image)[0]
+        attempt = 0
+        while True:
+            self._acquire(registry, priority, size)
+            try:
+                return pull_func()
+            except ContainerRuntimeError as e:
+                delay = self._back_off(registry, e, attempt)
+                if delay is None:
+                    raise
+                self.logger.warning(f"Pull of {image} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+            finally:
+                self._release()
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,362 @@
+import base64
+import contextvars
+import email.utils
+import hashlib
+import json
+import logging
+import platform
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from modules.concurrency import backoff_delay
+from modules.manifest_cache import ManifestCache
+from modules.metrics import METRICS
+
+# Digests resolved inside the current shared_lookups() block, shared with the worker threads it starts
+_shared_digests = contextvars.ContextVar('autopatch_shared_digests', default=None)
+
+DOCKER_HUB = 'docker.io'
+DOCKER_HUB_API = 'registry-1.docker.io'
+
+INDEX_MEDIA_TYPES = (
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+)
+
+# platform.machine() -> OCI architecture names
+ARCHITECTURES = {'x86_64': 'amd64', 'amd64': 'amd64', 'aarch64': 'arm64', 'arm64': 'arm64', 'armv7l': 'arm'}
+
+MANIFEST_ACCEPT = ', '.join([
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+])
+
+
+def parse_image_reference(image):
+    """Split an image reference into (registry, repository, tag-or-digest)"""
+    name, reference = image, 'latest'
+    if '@' in name:
+        name, reference = name.split('@', 1)
+    else:
+        last = name.rsplit('/', 1)[-1]
+        if ':' in last:
+            name, reference = name.rsplit(':', 1)
+
+    parts = name.split('/', 1)
+    if len(parts) == 2 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+        registry, repository = parts
+    else:
+        registry, repository = DOCKER_HUB, name
+
+    if registry in ('index.docker.io', DOCKER_HUB_API):
+        registry = DOCKER_HUB
+    if registry == DOCKER_HUB and '/' not in repository:
+        repository = f"library/{repository}"
+
+    return registry, repository, reference
+
+
+def parse_rate_limit_header(value):
+    """'100;w=21600' (or a bare '100') -> (100, 21600 or None); (None, None) if absent"""
+    if not value:
+        return None, None
+    count, _, params = value.partition(';')
+    window = None
+    for param in params.split(';'):
+        key, _, param_value = param.strip().partition('=')
+        if key == 'w' and param_value.isdigit():
+            window = int(param_value)
+    try:
+        return int(count.strip().split(',')[0]), window
+    except ValueError:
+        return None, None
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta seconds or an HTTP date), or None"""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value.strip())
+    try:
+        return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RegistryClient:
+    """Minimal Docker Registry HTTP API v2 client used to resolve tag digests"""
+
+    def __init__(self, config=None):
+        autopatch_config = (config or {}).get('autopatch', {})
+        detection_config = autopatch_config.get('update_detection', {})
+        self.registries = autopatch_config.get('registries') or {}
+        self.timeout = detection_config.get('timeout', 10)
+        self.cache = ManifestCache(config) if autopatch_config.get('cache', {}).get('enabled', True) else None
+        throttling_config = autopatch_config.get('throttling', {})
+        self.max_retries = throttling_config.get('max_retries', 4)
+        self.backoff_base = throttling_config.get('backoff_base', 5)
+        self.backoff_max = throttling_config.get('backoff_max', 300)
+        self.max_wait = throttling_config.get('max_wait', 900)
+        self.logger = logging.getLogger('autopatch')
+        # Latest rate-limit headers per registry, read by the pull scheduler
+        self.rate_limits = {}
+        self._tokens = {}
+        self._manifests = {}
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def _registry_settings(self, registry):
+        """Return the config block for a registry (dockerhub is an alias for docker.io)"""
+        if registry == DOCKER_HUB and 'dockerhub' in self.registries:
+            return self.registries['dockerhub'] or {}
+        return self.registries.get(registry) or {}
+
+    def _base_url(self, registry):
+        settings = self._registry_settings(registry)
+        if settings.get('url'):
+            return settings['url'].rstrip('/')
+        host = DOCKER_HUB_API if registry == DOCKER_HUB else registry
+        scheme = 'http' if settings.get('insecure') else 'https'
+        return f"{scheme}://{host}"
+
+    def _fetch_token(self, registry, challenge):
+        """Request a bearer token for the scope named in a WWW-Authenticate challenge"""
+        params = {}
+        for item in challenge[len('Bearer '):].split(','):
+            if '=' in item:
+                key, value = item.split('=', 1)
+                params[key.strip()] = value.strip().strip('"')
+
+        realm = params.pop('realm', None)
+        if not realm:
+            return None
+
+        token_request = urllib.request.Request(f"{realm}?{urllib.parse.urlencode(params)}")
+        settings = self._registry_settings(registry)
+        if settings.get('username') and settings.get('password'):
+            credentials = f"{settings['username']}:{settings['password']}".encode('utf-8')
+            token_request.add_header('Authorization', f"Basic {base64.b64encode(credentials).decode('ascii')}")
+
+        with urllib.request.urlopen(token_request, timeout=self.timeout) as response:
+            body = json.loads(response.read().decode('utf-8'))
+        return body.get('token') or body.get('access_token')
+
+    def _note_rate_limit(self, registry, headers, status=None):
+        """Remember the rate-limit state a registry response reported"""
+        limit, window = parse_rate_limit_header(headers.get('RateLimit-Limit') or headers.get('X-RateLimit-Limit'))
+        remaining, remaining_window = parse_rate_limit_header(
+            headers.get('RateLimit-Remaining') or headers.get('X-RateLimit-Remaining'))
+        window = window or remaining_window or parse_retry_after(headers.get('RateLimit-Reset'))
+        retry_after = parse_retry_after(headers.get('Retry-After')) if status in (429, 503) else None
+        if remaining is None and retry_after is None and status != 429:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            previous = (self.rate_limits.get(registry) or {}).get('remaining')
+            self.rate_limits[registry] = {
+                'limit': limit,
+                'remaining': 0 if status == 429 and remaining is None else remaining,
+                'window': window,
+                'retry_after': now + retry_after if retry_after is not None else None,
+                'seen': now
+            }
+        if remaining is not None and limit and remaining < limit * 0.1 <= (previous if previous is not None else limit):
+            self.logger.warning(f"Registry {registry} rate limit nearly used up: {remaining} of {limit} left")
+
+    def _open(self, registry, url, headers, method):
+        """urlopen that records rate-limit headers and backs off on 429/503 responses"""
+        attempt = 0
+        while True:
+            try:
+                response = urllib.request.urlopen(
+                    urllib.request.Request(url, headers=headers, method=method), timeout=self.timeout
+                )
+            except urllib.error.HTTPError as e:
+                self._note_rate_limit(registry, e.headers, e.code)
+                if e.code not in (429, 503) or attempt >= self.max_retries:
+                    raise
+                delay = parse_retry_after(e.headers.get('Retry-After'))
+                if delay is None:
+                    delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                if delay > self.max_wait:
+                    raise
+                self.logger.warning(f"Registry {registry} answered {e.code}, retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._note_rate_limit(registry, response.headers)
+            return response
+
+    def _request(self, method, registry, repository, path, headers=None):
+        """Perform a registry request, answering a bearer-token challenge once if needed"""
+        url = f"{self._base_url(registry)}/v2/{repository}/{path}"
+        headers = dict(headers or {})
+
+        with self._lock:
+            token = self._tokens.get((registry, repository))
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+
+        try:
+            return self._open(registry, url, headers, method)
+        except urllib.error.HTTPError as e:
+            challenge = e.headers.get('WWW-Authenticate', '')
+            if e.code != 401 or not challenge.startswith('Bearer '):
+                raise
+
+        token = self._fetch_token(registry, challenge)
+        if not token:
+            raise PermissionError(f"Registry {registry} refused authentication for {repository}")
+        with self._lock:
+            self._tokens[(registry, repository)] = token
+        headers['Authorization'] = f"Bearer {token}"
+        return self._open(registry, url, headers, method)
+
+    @contextmanager
+    def shared_lookups(self):
+        """Resolve each tag at most once inside the block, whether or not the manifest cache is enabled
+
+        Covers the worker threads started through bounded_map, so a fleet
+        pre-pass answers the hosts' own lookups. Failed lookups are not kept.
+        """
+        if _shared_digests.get() is not None:
+            yield
+            return
+        token = _shared_digests.set({})
+        try:
+            yield
+        finally:
+            _shared_digests.reset(token)
+
+    @METRICS.span('registry')
+    def get_remote_digest(self, image):
+        """Return the manifest digest the registry currently serves for an image tag"""
+        registry, repository, reference = parse_image_reference(image)
+        if reference.startswith('sha256:'):
+            # Digest-pinned references can never move
+            return reference
+
+        cache_key = f"{registry}/{repository}:{reference}"
+        shared = _shared_digests.get()
+        if shared is not None and cache_key in shared:
+            return shared[cache_key]
+        digest = self._lookup_digest(image, registry, repository, reference, cache_key)
+        if shared is not None and digest:
+            shared[cache_key] = digest
+        return digest
+
+    def _lookup_digest(self, image, registry, repository, reference, cache_key):
+        """The tag's digest from the manifest cache or the registry, None if it cannot be resolved"""
+        cached = self.cache.get(cache_key) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            return cached['digest']
+
+        headers = {'Accept': MANIFEST_ACCEPT}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+
+        try:
+            started = time.monotonic()
+            try:
+                with self._request('HEAD', registry, repository, f"manifests/{reference}", headers) as response:
+                    digest = response.headers.get('Docker-Content-Digest')
+                    etag = response.headers.get('ETag')
+            except urllib.error.HTTPError as e:
+                if e.code != 304 or not cached:
+                    raise
+                # Unchanged since the cached lookup, just extend its lifetime
+                self.cache.touch(cache_key)
+                return cached['digest']
+
+            if not digest:
+                # Some registries omit the digest header on HEAD, hash the manifest instead
+                with self._request('GET', registry, repository, f"manifests/{reference}",
+                                   {'Accept': MANIFEST_ACCEPT}) as response:
+                    digest = response.headers.get('Docker-Content-Digest') or \
+                        f"sha256:{hashlib.sha256(response.read()).hexdigest()}"
+                    etag = etag or response.headers.get('ETag')
+
+            if self.cache:
+                self.cache.put(cache_key, digest, etag)
+            self.logger.debug(f"Resolved {image} to {digest} in {time.monotonic() - started:.2f}s")
+            return digest
+        except Exception as e:
+            self.logger.error(f"Error resolving remote digest for {image}: {e}")
+            return None
+
+    def get_manifest(self, image, digest):
+        """Fetch the image manifest for digest, resolving a multi-platform index to this host's platform"""
+        registry, repository, _ = parse_image_reference(image)
+        with self._lock:
+            if digest in self._manifests:
+                return self._manifests[digest]
+
+        with self._request('GET', registry, repository, f"manifests/{digest}", {'Accept': MANIFEST_ACCEPT}) as response:
+            manifest = json.loads(response.read().decode('utf-8'))
+
+        if manifest.get('mediaType') in INDEX_MEDIA_TYPES or 'manifests' in manifest:
+            architecture = ARCHITECTURES.get(platform.machine().lower(), platform.machine().lower())
+            candidates = [m for m in manifest.get('manifests', [])
+                          if (m.get('platform') or {}).get('os', 'linux') == 'linux']
+            chosen = next((m for m in candidates if (m.get('platform') or {}).get('architecture') == architecture),
+                          candidates[0] if candidates else None)
+            manifest = self.get_manifest(image, chosen['digest']) if chosen else {}
+
+        # Manifests addressed by digest never change, so they are kept for the process lifetime
+        with self._lock:
+            self._manifests[digest] = manifest
+        return manifest
+
+    def get_image_config(self, image, manifest):
+        """Fetch the image config blob a manifest points to (rootfs diff IDs, history)"""
+        registry, repository, _ = parse_image_reference(image)
+        digest = (manifest.get('config') or {}).get('digest')
+        if not digest:
+            return {}
+        with self._lock:
+            if digest in self._configs:
+                return self._configs[digest]
+
+        with self._request('GET', registry, repository, f"blobs/{digest}") as response:
+            config = json.loads(response.read().decode('utf-8'))
+        # Content addressed like manifests, so kept for the process lifetime
+        with self._lock:
+            self._configs[digest] = config
+        return config
+
+    def get_download_size(self, image, digest, local_layers=None):
+        """Compressed bytes (config plus layers) a pull of the image behind digest transfers, or None if unknown
+
+        local_layers, a set of layer diff IDs already in local storage, leaves
+        out the layers that would not be downloaded again. Without it (or when
+        the image config cannot be read) every layer is counted.
+        """
+        try:
+            manifest = self.get_manifest(image, digest)
+            layers = manifest.get('layers') or []
+            config_size = (manifest.get('config') or {}).get('size', 0)
+            if local_layers:
+                try:
+                    diff_ids = ((self.get_image_config(image, manifest) or {}).get('rootfs') or {}).get('diff_ids') or []
+                except Exception as e:
+                    self.logger.debug(f"Could not read the image config of {image}@{digest}: {e}")
+                    diff_ids = []
+                # diff_ids lists the uncompressed digest of each layer, in manifest order
+                if len(diff_ids) == len(layers):
+                    layers = [layer for layer, diff_id in zip(layers, diff_ids) if diff_id not in local_layers]
+            return sum(layer.get('size', 0) for layer in layers) + config_size
+        except Exception as e:
+            self.logger.warning(f"Could not determine download size of {image}@{digest}: {e}")
+            return None
+
+    def save_cache(self):
+        """Persist cached lookups so later runs can reuse them"""
+        if self.cache:
+            self.cache.save()
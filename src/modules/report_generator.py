@@ -1,39 +1,193 @@
+import csv
+import io
 import logging
 import json
 from datetime import datetime
 import os
-import pandas as pd
-from fpdf import FPDF
+import threading
+from modules.metrics import METRICS
+from modules.report_store import ReportStore
+
+# fpdf is imported inside the PDF method: it costs startup time and memory
+# and only on-demand PDF reports need it
+
+# Table columns shown per PDF section; other sections show every column
+PDF_COLUMNS = {
+    'snapshot': ['id', 'captured_at'],
+    'containers': ['host', 'name', 'id', 'image', 'state', 'status', 'excluded'],
+    'updates': ['host', 'container_name', 'current_image', 'new_digest', 'download_bytes']
+}
+STREAM_CHUNK_BYTES = 64 * 1024
+REPORT_FORMATS = {'json': 'application/json', 'csv': 'text/csv', 'pdf': 'application/pdf'}
 
 class ReportGenerator:
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger('autopatch')
+        autopatch_config = config.get('autopatch', {})
+        state_dir = autopatch_config.get('logging', {}).get('state_dir', os.path.join('logs', 'state'))
+        self.artifact_dir = os.path.join(state_dir, 'report_artifacts')
+        self.artifact_cache_size = autopatch_config.get('reports', {}).get('artifact_cache_size', 8)
+        self.store = None
+        if config.get('autopatch', {}).get('reports', {}).get('store', True):
+            try:
+                self.store = ReportStore(config)
+            except Exception as e:
+                self.logger.error(f"Error opening report history store: {e}")
 
     def generate_on_demand_report(self, data, report_format):
+        """Render a whole report as (bytes, content type)"""
+        chunks, content_type = self.stream_on_demand_report(data, report_format)
+        return b''.join(chunks), content_type
+
+    def stream_on_demand_report(self, data, report_format):
+        """Render a report as (iterator of byte chunks, content type)
+
+        JSON and CSV are written one row at a time so memory does not grow
+        with the number of containers or history rows. FPDF builds the whole
+        PDF document in memory, so a PDF is only sent in chunks once rendered.
+        """
         if report_format == 'json':
-            return self._generate_json_report(data)
+            return self._batched(self._generate_json_report(data)), REPORT_FORMATS['json']
         elif report_format == 'csv':
-            return self._generate_csv_report(data)
+            return self._batched(self._generate_csv_report(data)), REPORT_FORMATS['csv']
         elif report_format == 'pdf':
-            return self._generate_pdf_report(data)
+            return self._generate_pdf_report(data), REPORT_FORMATS['pdf']
         else:
             raise ValueError(f"Unsupported report format: {report_format}")
 
+    def cached_on_demand_report(self, snapshot_id, data, report_format):
+        """Like stream_on_demand_report, reusing the artifact rendered earlier for this snapshot
+
+        Artifacts are kept on disk per (snapshot id, format), so repeated
+        downloads are served straight from the file.
+        """
+        path = os.path.join(self.artifact_dir, f"{os.path.basename(snapshot_id)}.{report_format}")
+        if os.path.exists(path):
+            return self._read_artifact(path), REPORT_FORMATS[report_format]
+
+        chunks, content_type = self.stream_on_demand_report(data, report_format)
+        return self._write_artifact(chunks, path), content_type
+
+    @staticmethod
+    def _read_artifact(path):
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _write_artifact(self, chunks, path):
+        """Pass chunks through while saving them; the artifact only appears once complete"""
+        try:
+            os.makedirs(self.artifact_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            f = open(tmp_path, 'wb')
+        except OSError as e:
+            self.logger.error(f"Error caching report artifact {path}: {e}")
+            yield from chunks
+            return
+
+        try:
+            with f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+            self._prune_artifacts()
+        finally:
+            # Abandoned downloads or render errors leave no partial artifact behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _prune_artifacts(self):
+        try:
+            artifacts = [os.path.join(self.artifact_dir, name) for name in os.listdir(self.artifact_dir)
+                         if not name.endswith('.tmp')]
+            artifacts.sort(key=os.path.getmtime, reverse=True)
+            for path in artifacts[self.artifact_cache_size:]:
+                os.remove(path)
+        except OSError as e:
+            self.logger.warning(f"Error pruning report artifacts: {e}")
+
+    @staticmethod
+    def _batched(chunks):
+        """Coalesce small row chunks into writes of about STREAM_CHUNK_BYTES"""
+        pending, size = [], 0
+        for chunk in chunks:
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_BYTES:
+                yield b''.join(pending)
+                pending, size = [], 0
+        if pending:
+            yield b''.join(pending)
+
     def _generate_json_report(self, data):
-        report = {
-            'timestamp': datetime.now().isoformat(),
-            'data': data
-        }
-        return json.dumps(report, indent=2).encode('utf-8'), 'application/json'
+        yield f'{{\n  "timestamp": {json.dumps(datetime.now().isoformat())},\n  "data": {{'.encode('utf-8')
+        for index, (section, rows) in enumerate(data.items()):
+            prefix = ',' if index else ''
+            if not isinstance(rows, (list, tuple)):
+                yield f'{prefix}\n    {json.dumps(section)}: {json.dumps(rows, default=str)}'.encode('utf-8')
+                continue
+            yield f'{prefix}\n    {json.dumps(section)}: ['.encode('utf-8')
+            for row_index, row in enumerate(rows):
+                yield f"{',' if row_index else ''}\n      {json.dumps(row, default=str)}".encode('utf-8')
+            yield ('\n    ]' if rows else ']').encode('utf-8')
+        yield b'\n  }\n}\n'
+
+    @staticmethod
+    def _sections(data):
+        """(section name, list of row dicts) pairs of report data"""
+        for section, rows in data.items():
+            if isinstance(rows, dict):
+                rows = [rows]
+            elif not isinstance(rows, (list, tuple)):
+                rows = [{'value': rows}]
+            if not all(isinstance(row, dict) for row in rows):
+                rows = [row if isinstance(row, dict) else {'value': row} for row in rows]
+            yield section, rows
+
+    @staticmethod
+    def _columns(rows):
+        columns = {}
+        for row in rows:
+            columns.update(dict.fromkeys(row))
+        return list(columns)
+
+    @staticmethod
+    def _cell_text(value):
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value, default=str)
+        return '' if value is None else str(value)
 
     def _generate_csv_report(self, data):
-        df = pd.DataFrame(data)
-        csv_data = df.to_csv(index=False).encode('utf-8')
-        return csv_data, 'text/csv'
+        """One CSV block per section, each row prefixed with its section name"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def drain():
+            chunk = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        for index, (section, rows) in enumerate(self._sections(data)):
+            if index:
+                writer.writerow([])
+            columns = self._columns(rows)
+            writer.writerow(['section'] + columns)
+            yield drain()
+            for row in rows:
+                writer.writerow([section] + [self._cell_text(row.get(column)) for column in columns])
+                yield drain()
 
     def _generate_pdf_report(self, data):
-        pdf = FPDF()
+        """Render each section as a table (PDF_COLUMNS picks the columns), then yield the document in chunks"""
+        from fpdf import FPDF
+        pdf = FPDF(orientation='L')
+        pdf.set_auto_page_break(True, margin=15)
         pdf.add_page()
         pdf.set_font('Arial', 'B', 16)
         pdf.cell(0, 10, 'AutoPatch Report', 0, 1, 'C')
@@ -41,55 +195,93 @@ class ReportGenerator:
         pdf.cell(0, 10, f"Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", 0, 1, 'C')
         pdf.ln(10)
 
-        for section_title, section_data in data.items():
+        page_width = pdf.w - pdf.l_margin - pdf.r_margin
+        for section_title, rows in self._sections(data):
             pdf.set_font('Arial', 'B', 14)
             pdf.cell(0, 10, section_title.capitalize(), 0, 1)
-            pdf.ln(5)
+            pdf.ln(2)
 
-            if not section_data:
+            if not rows:
                 pdf.set_font('Arial', '', 12)
                 pdf.cell(0, 10, "No data available.", 0, 1)
                 pdf.ln(5)
                 continue
 
-            for item in section_data:
-                for key, value in item.items():
-                    pdf.set_font('Arial', 'B', 10)
-                    pdf.cell(40, 10, f"{key}:")
-                    pdf.set_font('Arial', '', 10)
-                    pdf.multi_cell(0, 10, str(value))
-                pdf.ln(5)
+            columns = PDF_COLUMNS.get(section_title) or self._columns(rows)
+            width = page_width / len(columns)
+            pdf.set_font('Arial', 'B', 9)
+            for column in columns:
+                pdf.cell(width, 7, self._fit(pdf, column, width), 1)
+            pdf.ln()
+
+            pdf.set_font('Arial', '', 8)
+            for row in rows:
+                for column in columns:
+                    pdf.cell(width, 6, self._fit(pdf, self._cell_text(row.get(column)), width), 1)
+                pdf.ln()
+            pdf.ln(5)
+
+        output = pdf.output(dest='S')
+        output = output.encode('latin-1') if isinstance(output, str) else bytes(output)
+        for start in range(0, len(output), STREAM_CHUNK_BYTES):
+            yield output[start:start + STREAM_CHUNK_BYTES]
 
-        return pdf.output(dest='S').encode('latin-1'), 'application/pdf'
+    @staticmethod
+    def _fit(pdf, text, width):
+        """Truncate text to one table cell; the core PDF fonts only cover latin-1"""
+        text = text.encode('latin-1', 'replace').decode('latin-1')
+        text_width = pdf.get_string_width(text)
+        if text_width <= width - 2:
+            return text
+        # Cut close to the right length first so long values stay cheap to fit
+        text = text[:int(len(text) * (width - 2) / text_width) + 1]
+        while text and pdf.get_string_width(text + '...') > width - 2:
+            text = text[:-1]
+        return text + '...'
     
-    def generate_report(self, update_results):
-        """Generate update report"""
+    @METRICS.span('report')
+    def generate_report(self, update_results, extra=None):
+        """Generate update report (extra fields are merged into the top level)"""
         report = {
             'timestamp': datetime.now().isoformat(),
             'summary': {
                 'total_checked': len(update_results),
                 'updated': len([r for r in update_results if r['status'] == 'success']),
-                'failed': len([r for r in update_results if r['status'] == 'failed'])
+                'failed': len([r for r in update_results if r['status'] == 'failed']),
+                'downtime_seconds': round(sum(r.get('downtime_seconds', 0) for r in update_results), 3)
             },
             'details': update_results
         }
+        report.update(extra or {})
         
-        # Save to file
-        self.save_report_to_file(report)
+        # Save to file and index it in the history store
+        filepath = self.save_report_to_file(report)
+        if self.store:
+            try:
+                self.store.add_report(report, source=filepath and os.path.abspath(filepath))
+            except Exception as e:
+                self.logger.error(f"Error storing report history: {e}")
         return report
     
     def save_report_to_file(self, report):
-        """Save report to JSON file"""
+        """Save report to JSON file and return its path (None on failure)"""
         try:
             report_dir = self.config['autopatch']['logging']['report_dir']
             os.makedirs(report_dir, exist_ok=True)
             
-            filename = f"autopatch_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            filepath = os.path.join(report_dir, filename)
+            filename = f"autopatch_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            filepath = os.path.join(report_dir, f"{filename}.json")
+            # Two cycles finishing within a second must not overwrite each other
+            suffix = 1
+            while os.path.exists(filepath):
+                filepath = os.path.join(report_dir, f"{filename}_{suffix}.json")
+                suffix += 1
             
             with open(filepath, 'w') as f:
                 json.dump(report, f, indent=2)
             
             self.logger.info(f"Report saved to {filepath}")
+            return filepath
         except Exception as e:
-            self.logger.error(f"Error saving report: {e}")
\ No newline at end of file
+            self.logger.error(f"Error saving report: {e}")
+            return None
\ No newline at end of file
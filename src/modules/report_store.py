@@ -0,0 +1,207 @@
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cycles (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    plan_id TEXT,
+    total INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    downtime_seconds REAL,
+    source TEXT UNIQUE,
+    report TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    cycle_id INTEGER NOT NULL REFERENCES cycles(id) ON DELETE CASCADE,
+    timestamp TEXT NOT NULL,
+    host TEXT,
+    container_name TEXT NOT NULL,
+    old_image TEXT,
+    new_image TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    strategy TEXT,
+    duration_seconds REAL,
+    downtime_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS cycles_timestamp ON cycles(timestamp);
+CREATE INDEX IF NOT EXISTS results_timestamp ON results(timestamp);
+CREATE INDEX IF NOT EXISTS results_container ON results(container_name, timestamp);
+CREATE INDEX IF NOT EXISTS results_status ON results(status, timestamp);
+CREATE INDEX IF NOT EXISTS results_cycle ON results(cycle_id);
+"""
+
+# Indexes on columns that databases created by earlier versions gain in _migrate
+INDEXES = """
+CREATE INDEX IF NOT EXISTS results_host ON results(host, container_name, timestamp);
+"""
+
+CYCLE_COLUMNS = 'id, timestamp, plan_id, total, updated, failed, downtime_seconds'
+RESULT_COLUMNS = ('id, cycle_id, timestamp, host, container_name, old_image, new_image, status, error, '
+                  'strategy, duration_seconds, downtime_seconds')
+
+
+class ReportStore:
+    """SQLite history of update cycles and their per-container results
+
+    Replaces scanning the JSON report directory: cycles and results are
+    indexed by time, container and status, and the JSON reports written by
+    earlier versions are imported the first time the database is created.
+    """
+
+    def __init__(self, config):
+        logging_config = config['autopatch'].get('logging', {})
+        state_dir = logging_config.get('state_dir', os.path.join('logs', 'state'))
+        self.path = config['autopatch'].get('reports', {}).get('database') or os.path.join(state_dir, 'reports.db')
+        self.logger = logging.getLogger('autopatch')
+        self._lock = threading.Lock()
+
+        created = not os.path.exists(self.path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA foreign_keys=ON')
+            self._db.executescript(SCHEMA)
+            self._migrate()
+            self._db.executescript(INDEXES)
+
+        if created and logging_config.get('report_dir'):
+            self.import_json_reports(logging_config['report_dir'])
+
+    def _migrate(self):
+        """Add the columns later versions introduced to an existing database"""
+        columns = {row['name'] for row in self._db.execute('PRAGMA table_info(results)')}
+        if 'host' not in columns:
+            # Results stored before fleets have no host
+            self._db.execute('ALTER TABLE results ADD COLUMN host TEXT')
+
+    def add_report(self, report, source=None):
+        """Store a cycle report; returns its id, or None if source was already imported"""
+        summary = report.get('summary', {})
+        details = report.get('details', [])
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO cycles (timestamp, plan_id, total, updated, failed, downtime_seconds, source, report) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (report['timestamp'], report.get('plan_id'),
+                 summary.get('total_checked', len(details)),
+                 summary.get('updated', len([r for r in details if r.get('status') == 'success'])),
+                 summary.get('failed', len([r for r in details if r.get('status') == 'failed'])),
+                 summary.get('downtime_seconds'), source, json.dumps(report))
+            )
+            if not cursor.rowcount:
+                return None
+
+            cycle_id = cursor.lastrowid
+            self._db.executemany(
+                'INSERT INTO results (cycle_id, timestamp, host, container_name, old_image, new_image, status, error, '
+                'strategy, duration_seconds, downtime_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(cycle_id, result.get('timestamp') or report['timestamp'], result.get('host'),
+                  result.get('container_name', ''),
+                  result.get('old_image'), result.get('new_image'), result.get('status', 'unknown'),
+                  result.get('error'), result.get('strategy'), result.get('duration_seconds'),
+                  result.get('downtime_seconds')) for result in details]
+            )
+        return cycle_id
+
+    def import_json_reports(self, report_dir):
+        """Import the JSON report files in report_dir; files already imported are skipped"""
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(report_dir, 'autopatch_report_*.json'))):
+            try:
+                with open(path, 'r') as f:
+                    report = json.load(f)
+                if self.add_report(report, source=os.path.abspath(path)) is not None:
+                    imported += 1
+            except Exception as e:
+                self.logger.error(f"Error importing report {path}: {e}")
+        if imported:
+            self.logger.info(f"Imported {imported} JSON reports from {report_dir}")
+        return imported
+
+    @staticmethod
+    def _filters(since=None, until=None, **equals):
+        clauses, params = [], []
+        if since:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('timestamp < ?')
+            params.append(until)
+        for column, value in equals.items():
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def _page(self, table, columns, where, params, limit, offset):
+        with self._lock:
+            total = self._db.execute(f'SELECT COUNT(*) FROM {table}{where}', params).fetchone()[0]
+            rows = self._db.execute(
+                f'SELECT {columns} FROM {table}{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+                params + [limit, offset]
+            ).fetchall()
+        return {'items': [dict(row) for row in rows], 'total': total, 'limit': limit, 'offset': offset}
+
+    def list_cycles(self, limit=50, offset=0, since=None, until=None):
+        """Cycle summaries, newest first"""
+        where, params = self._filters(since, until)
+        return self._page('cycles', CYCLE_COLUMNS, where, params, limit, offset)
+
+    def get_cycle(self, cycle_id):
+        """The full stored report of one cycle, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT id, report FROM cycles WHERE id = ?', (cycle_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row['report']), id=row['id'])
+
+    def list_results(self, limit=50, offset=0, container=None, status=None, since=None, until=None, host=None):
+        """Per-container results, newest first"""
+        where, params = self._filters(since, until, host=host, container_name=container, status=status)
+        return self._page('results', RESULT_COLUMNS, where, params, limit, offset)
+
+    def container_stats(self, since=None, until=None, host=None):
+        """Update count, failure rate and mean duration/downtime per container (per host and name)"""
+        where, params = self._filters(since, until, host=host)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT host, container_name, COUNT(*) AS updates, "
+                "SUM(status = 'failed') AS failures, "
+                "ROUND(AVG(status = 'failed'), 4) AS failure_rate, "
+                "AVG(duration_seconds) AS mean_duration_seconds, "
+                "AVG(downtime_seconds) AS mean_downtime_seconds, "
+                "MAX(timestamp) AS last_update "
+                f"FROM results{where} GROUP BY host, container_name ORDER BY failure_rate DESC, updates DESC",
+                params
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self, since=None, until=None, host=None):
+        """Totals across all stored cycles (with host, across that host's results and the cycles that had any)"""
+        where, params = self._filters(since, until)
+        results_where, results_params = self._filters(since, until, host=host)
+        with self._lock:
+            if host is None:
+                cycles = self._db.execute(f'SELECT COUNT(*) FROM cycles{where}', params).fetchone()[0]
+            else:
+                cycles = self._db.execute(
+                    f'SELECT COUNT(DISTINCT cycle_id) FROM results{results_where}', results_params
+                ).fetchone()[0]
+            row = self._db.execute(
+                "SELECT COUNT(*) AS updates, SUM(status = 'failed') AS failures, "
+                "ROUND(AVG(status = 'failed'), 4) AS failure_rate, "
+                "AVG(duration_seconds) AS mean_duration_seconds, "
+                "SUM(downtime_seconds) AS total_downtime_seconds "
+                f"FROM results{results_where}", results_params
+            ).fetchone()
+        return dict(row, cycles=cycles)
@@ -0,0 +1,212 @@
+import logging
+import os
+import random
+import signal
+import threading
+from datetime import datetime, timedelta
+
+# (minimum, maximum) of each cron field
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 6))
+MONTH_NAMES = {name: number for number, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+WEEKDAY_NAMES = {name: number for number, name in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *'
+}
+
+
+class CronSchedule:
+    """A standard five-field cron expression (minute hour day month weekday)"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron schedule needs 5 fields, got {expression!r}")
+
+        names = (None, None, None, MONTH_NAMES, WEEKDAY_NAMES)
+        parsed = [self._parse_field(text, low, high, aliases)
+                  for text, (_, low, high), aliases in zip(fields, CRON_FIELDS, names)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        # Sunday may be written as 7
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+
+        # Like cron, a restricted day and weekday match when either one does
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(text, low, high, aliases=None):
+        values = set()
+        for part in text.lower().split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step < 1:
+                    raise ValueError(f"Invalid cron step in {text!r}")
+
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start_text, end_text = part.split('-', 1)
+                start, end = CronSchedule._value(start_text, aliases), CronSchedule._value(end_text, aliases)
+            else:
+                start = CronSchedule._value(part, aliases)
+                # "5/15" means every 15 starting at 5
+                end = high if step > 1 else start
+
+            # Weekday ranges may end at 7 (Sunday)
+            upper = 7 if high == 6 else high
+            if not (low <= start <= upper and low <= end <= upper and start <= end):
+                raise ValueError(f"Cron value out of range in {text!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    @staticmethod
+    def _value(text, aliases):
+        if aliases and text in aliases:
+            return aliases[text]
+        return int(text)
+
+    def _day_matches(self, moment):
+        weekday = (moment.weekday() + 1) % 7
+        day_ok = moment.day in self.days
+        weekday_ok = weekday in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """Return the first matching minute strictly after moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = (candidate.year + 1, 1) if candidate.month == 12 else (candidate.year, candidate.month + 1)
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron schedule {self.expression!r} never matches")
+
+
+class Scheduler:
+    """Runs named tasks in-process on cron schedules, plus on demand
+
+    Each scheduled run starts a random 0..jitter_seconds after its cron time
+    so a fleet of hosts sharing one schedule does not hit the registry at
+    once. On-demand runs start immediately: call trigger(name), send the
+    mapped signal (e.g. SIGUSR1), or create trigger_file containing the task
+    name. Tasks run one at a time on the scheduler thread.
+    """
+
+    def __init__(self, jitter_seconds=0, trigger_file=None, poll_interval=5):
+        self.jitter_seconds = jitter_seconds
+        self.trigger_file = trigger_file
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger('autopatch')
+
+        self._tasks = {}
+        self._next_runs = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def add_task(self, name, schedule, func):
+        """Register func() under name; schedule is a cron expression or None for on-demand only"""
+        self._tasks[name] = (CronSchedule(schedule) if schedule else None, func)
+
+    def trigger(self, name):
+        """Run a task as soon as the current one finishes"""
+        if name not in self._tasks:
+            self.logger.warning(f"Ignoring trigger for unknown task {name!r}")
+            return
+        with self._lock:
+            if name not in self._pending:
+                self._pending.append(name)
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def install_signal_handlers(self, triggers):
+        """Map signal names (e.g. {'SIGUSR1': 'update'}) to triggers; SIGTERM/SIGINT stop the loop"""
+        for signal_name, task in triggers.items():
+            signum = getattr(signal, signal_name, None)
+            if signum is not None:
+                signal.signal(signum, lambda *_, task=task: self.trigger(task))
+        for signal_name in ('SIGTERM', 'SIGINT'):
+            signal.signal(getattr(signal, signal_name), lambda *_: self.stop())
+
+    def _schedule_next(self, name, after):
+        schedule = self._tasks[name][0]
+        if schedule is None:
+            return
+        run_at = schedule.next_after(after)
+        self._next_runs[name] = (run_at, run_at + timedelta(seconds=random.uniform(0, self.jitter_seconds)))
+        self.logger.info(f"Next {name} run at {self._next_runs[name][1].isoformat(timespec='seconds')}")
+
+    def _check_trigger_file(self):
+        if not self.trigger_file or not os.path.exists(self.trigger_file):
+            return
+        try:
+            with open(self.trigger_file, 'r') as f:
+                name = f.read().strip()
+            os.remove(self.trigger_file)
+        except OSError as e:
+            self.logger.error(f"Error reading trigger file {self.trigger_file}: {e}")
+            return
+        self.trigger(name or next(iter(self._tasks)))
+
+    def _run_task(self, name):
+        self.logger.info(f"Running scheduled task {name}")
+        try:
+            self._tasks[name][1]()
+        except Exception as e:
+            self.logger.error(f"Scheduled task {name} failed: {e}")
+
+    def run(self):
+        """Block running tasks until stop() is called"""
+        now = datetime.now()
+        for name in self._tasks:
+            self._schedule_next(name, now)
+
+        while not self._stopped.is_set():
+            self._check_trigger_file()
+            with self._lock:
+                name = self._pending.pop(0) if self._pending else None
+            if name:
+                self._run_task(name)
+                continue
+
+            now = datetime.now()
+            due = [(run_at, task) for task, (_, run_at) in self._next_runs.items() if run_at <= now]
+            if due:
+                _, name = min(due)
+                self._run_task(name)
+                # A run that overran later cron times skips them rather than running back to back
+                self._schedule_next(name, datetime.now())
+                continue
+
+            wait = self.poll_interval if self.trigger_file else 3600
+            if self._next_runs:
+                earliest = min(run_at for _, run_at in self._next_runs.values())
+                wait = min(wait, max(0.0, (earliest - now).total_seconds()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+        self.logger.info("Scheduler stopped")
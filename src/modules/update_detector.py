@@ -1,23 +1,35 @@
-import subprocess
 import json
 import logging
+from modules.container_runtime import ContainerRuntimeError, create_runtime
+from modules.registry_client import RegistryClient, parse_image_reference
+from modules.concurrency import bounded_map
+from modules.metrics import METRICS
+from modules.pull_scheduler import PRIORITY_CHECK, PullScheduler
 
 class UpdateDetector:
-    def __init__(self, runtime='podman'):
-        self.runtime = runtime
+    def __init__(self, runtime='podman', config=None, registry_client=None, pull_scheduler=None):
+        self.runtime = create_runtime(runtime, config)
         self.logger = logging.getLogger('autopatch')
-    
+
+        detection_config = (config or {}).get('autopatch', {}).get('update_detection', {})
+        self.mode = detection_config.get('mode', 'digest')
+
+        concurrency_config = (config or {}).get('autopatch', {}).get('concurrency', {})
+        self.max_workers = concurrency_config.get('max_workers', 8)
+        self.per_registry = concurrency_config.get('per_registry', 4)
+        self.registry_limits = concurrency_config.get('registry_limits') or {}
+        # Hosts of a fleet share one client and its manifest cache
+        self.registry_client = registry_client or RegistryClient(config)
+        self.pull_scheduler = pull_scheduler or PullScheduler(config, self.registry_client)
+
+    @METRICS.span('list')
     def get_running_containers(self):
         """Get list of all running containers"""
         try:
-            result = subprocess.run(
-                ['podman', 'ps', '--format', 'json'],
-                capture_output=True, text=True, check=True
-            )
-            containers = json.loads(result.stdout)
+            containers = self.runtime.list_containers()
             self.logger.info(f"Found {len(containers)} running containers")
             return containers
-        except subprocess.CalledProcessError as e:
+        except ContainerRuntimeError as e:
             self.logger.error(f"Error getting containers: {e}")
             return []
         except json.JSONDecodeError as e:
@@ -26,44 +38,160 @@ class UpdateDetector:
         except Exception as e:
             self.logger.error(f"Unexpected error: {e}")
             return []
-    
+
+    def inspect_image(self, image):
+        """Return local image metadata (Id, Digest, RepoDigests) or None if not present"""
+        return self.runtime.inspect_image(image)
+
+    def get_local_digests(self, image):
+        """Return every manifest digest recorded for a local image"""
+        info = self.inspect_image(image) or {}
+        digests = {repo_digest.split('@', 1)[1] for repo_digest in info.get('RepoDigests') or [] if '@' in repo_digest}
+        if info.get('Digest'):
+            digests.add(info['Digest'])
+        return digests
+
+    def get_local_layers(self):
+        """Diff IDs of every layer in local image storage (empty if storage cannot be listed)"""
+        try:
+            images = self.runtime.list_images()
+        except Exception as e:
+            self.logger.warning(f"Could not list local images, sizing updates without them: {e}")
+            return set()
+        return {layer for image in images for layer in (image.get('RootFS') or {}).get('Layers') or []}
+
+    @METRICS.span('pull')
+    def pull_image(self, image, priority=PRIORITY_CHECK, size=None, errors=None):
+        """Pull an image through the pull throttles, returning True on success
+
+        size (compressed bytes, when known) is charged to the bandwidth budget.
+        If errors is given, a failure's message is stored in it under image.
+        """
+        try:
+            self.pull_scheduler.pull(image, lambda: self.runtime.pull_image(image), priority, size)
+            return True
+        except ContainerRuntimeError as e:
+            self.logger.error(f"Failed to pull {image}: {e}")
+            if errors is not None:
+                errors[image] = str(e)
+            return False
+
+    def check_image(self, image, image_ids, pull=True):
+        """Resolve one image reference once
+
+        Returns (set of image_ids it supersedes, digest of the newest image).
+        With pull=False digest mode only looks at the registry and leaves
+        downloading to whoever applies the update.
+        """
+        if self.mode == 'pull':
+            # Pull latest image and compare it with the images containers run
+            if not self.pull_image(image):
+                self.logger.warning(f"Could not check {image} for updates: the image could not be pulled")
+                return set(), None
+            pulled = self.inspect_image(image) or {}
+            if not pulled.get('Id'):
+                return set(), None
+            new_digest = pulled.get('Digest') or next(iter(self.get_local_digests(image)), None)
+            return {image_id for image_id in image_ids
+                    if (self.inspect_image(image_id) or {}).get('Id') != pulled['Id']}, new_digest
+
+        # Compare the registry's manifest digest with the running images, pull only on change
+        remote_digest = self.registry_client.get_remote_digest(image)
+        if remote_digest is None:
+            self.logger.warning(f"Could not resolve remote digest for {image}")
+            return set(), None
+
+        outdated_ids = {image_id for image_id in image_ids
+                        if remote_digest not in self.get_local_digests(image_id)}
+        if outdated_ids and pull:
+            size = self.registry_client.get_download_size(image, remote_digest) if self.pull_scheduler.bandwidth else None
+            if not self.pull_image(image, PRIORITY_CHECK, size):
+                self.logger.warning(f"Update of {image} to {remote_digest} deferred: the new image could not be pulled")
+                return set(), remote_digest
+        return outdated_ids, remote_digest
+
     def check_image_updates(self, container):
         """Check if newer image is available"""
         try:
             container_name = container['Names'][0] if container['Names'] else container['Id'][:12]
             current_image = container['Image']
-            
+            current_image_id = container.get('ImageID') or current_image
+
             self.logger.info(f"Checking updates for {container_name}")
-            
-            # Pull latest image
-            pull_result = subprocess.run(
-                ['podman', 'pull', current_image],
-                capture_output=True, text=True
-            )
-            
-            if pull_result.returncode == 0:
+
+            has_update = bool(self.check_image(current_image, {current_image_id})[0])
+            self.registry_client.save_cache()
+
+            if has_update:
                 self.logger.info(f"Update available for {container_name}")
-                return True, current_image
             else:
-                self.logger.warning(f"No update for {container_name}")
-                return False, current_image
-                
+                self.logger.info(f"No update for {container_name}")
+            return has_update, current_image
+
         except Exception as e:
             self.logger.error(f"Error checking updates: {e}")
             return False, None
-    
-    def get_outdated_containers(self):
-        """Get containers with available updates"""
+
+    def _registry_limit(self, registry):
+        """Maximum number of concurrent checks against one registry"""
+        return self.registry_limits.get(registry, self.per_registry)
+
+    @METRICS.span('check')
+    def _check_image_group(self, group, pull=True):
+        """Check one unique image reference on behalf of every container using it"""
+        image, containers = group
+        try:
+            self.logger.info(f"Checking updates for {image} ({len(containers)} containers)")
+            return self.check_image(image, {c.get('ImageID') or c['Image'] for c in containers}, pull)
+        except Exception as e:
+            self.logger.error(f"Error checking updates for {image}: {e}")
+            return set(), None
+
+    def get_outdated_containers(self, containers=None, progress=None, pull=True):
+        """Get containers with available updates (from the given listing, or a fresh one)
+
+        progress(container_name, stage) is called for each container as its image is checked.
+        With pull=False new images are only resolved, not downloaded (digest mode).
+        """
         outdated = []
-        containers = self.get_running_containers()
-        
+        if containers is None:
+            containers = self.get_running_containers()
+
+        # Resolve each unique image reference once, however many replicas run it
+        groups = {}
         for container in containers:
-            has_update, new_image = self.check_image_updates(container)
-            if has_update:
+            groups.setdefault(parse_image_reference(container['Image']), (container['Image'], []))[1].append(container)
+
+        def report_group(group, result):
+            outdated_image_ids = result[0]
+            for container in group[1]:
+                container_name = container['Names'][0] if container['Names'] else container['Id'][:12]
+                image_id = container.get('ImageID') or container['Image']
+                progress(container_name, 'update_available' if image_id in outdated_image_ids else 'up_to_date')
+
+        # Check concurrently, bounded globally and per registry
+        results = bounded_map(
+            lambda group: self._check_image_group(group, pull), groups.values(),
+            key=lambda group: parse_image_reference(group[0])[0],
+            max_workers=self.max_workers,
+            key_limit=self._registry_limit,
+            on_result=report_group if progress else None
+        )
+        outdated_ids = dict(zip(groups, results))
+        self.registry_client.save_cache()
+
+        # Fan the shared results back out, keeping podman ps order
+        for container in containers:
+            container_name = container['Names'][0] if container['Names'] else container['Id'][:12]
+            reference = parse_image_reference(container['Image'])
+            image_ids, new_digest = outdated_ids[reference]
+            if (container.get('ImageID') or container['Image']) in image_ids:
+                self.logger.info(f"Update available for {container_name}")
                 outdated.append({
                     'container': container,
-                    'new_image': new_image,
-                    'container_name': container['Names'][0] if container['Names'] else container['Id'][:12]
+                    'new_image': container['Image'],
+                    'new_digest': new_digest,
+                    'container_name': container_name
                 })
-        
-        return outdated
\ No newline at end of file
+
+        return outdated
@@ -0,0 +1,231 @@
+import fnmatch
+import logging
+import time
+import uuid
+from datetime import datetime
+from modules.container_inventory import ContainerInventory
+from modules.fleet import Fleet
+from modules.log_pipeline import log_context, log_fields
+from modules.metrics import METRICS
+from modules.report_generator import ReportGenerator
+from modules.update_planner import StalePlanError
+
+
+class UpdateEngine:
+    """The update pipeline shared by the CLI and the API server
+
+    Owns the fleet (runtime clients, registry cache, pull throttles), the
+    report generator and, for long-running processes, a live container
+    inventory per host. Listing honours containers.exclude, and every cycle
+    plans, pulls, inspects and redeploys the same way whichever entry point
+    drives it, so warm state lives as long as the engine does.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        autopatch_config = config['autopatch']
+        self.exclude = autopatch_config.get('containers', {}).get('exclude') or []
+        self.resync_interval = autopatch_config.get('inventory', {}).get('resync_interval', 300)
+        self.logger = logging.getLogger('autopatch')
+
+        # Every managed host (just the local runtime unless `hosts` is configured)
+        self.fleet = Fleet(config)
+        self.runtime = self.fleet.hosts[0].runtime
+        self.report_generator = ReportGenerator(config)
+        self.inventories = {}
+
+    def start_inventories(self):
+        """Track each host's containers from its event stream instead of listing them per call"""
+        for host in self.fleet.hosts:
+            if host.name not in self.inventories:
+                self.inventories[host.name] = ContainerInventory(host.runtime, resync_interval=self.resync_interval)
+                self.inventories[host.name].start()
+
+    def stop_inventories(self):
+        for inventory in self.inventories.values():
+            inventory.stop()
+
+    def host(self, name=None):
+        """A fleet host by name (the first host when no name is given), or None"""
+        return self.fleet.host(name) if name else self.fleet.hosts[0]
+
+    @staticmethod
+    def container_name(container):
+        return container['Names'][0] if container.get('Names') else container['Id'][:12]
+
+    def is_excluded(self, container):
+        """Whether containers.exclude names the container (or its image); entries may be glob patterns"""
+        name = self.container_name(container)
+        return any(fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(container.get('Image', ''), pattern)
+                   for pattern in self.exclude)
+
+    def list_containers(self, host, include_excluded=False):
+        """Running containers of one host that AutoPatch may update (or all of them)"""
+        inventory = self.inventories.get(host.name)
+        if inventory is not None:
+            if inventory.last_sync is None:
+                inventory.refresh()
+            containers = inventory.containers()
+        else:
+            containers = host.update_detector.get_running_containers()
+        return [container for container in containers if include_excluded or not self.is_excluded(container)]
+
+    def containers_by_host(self, include_excluded=False):
+        """Updatable (or all) running containers of every host, listed concurrently"""
+        return self.fleet.run_per_host(lambda host: self.list_containers(host, include_excluded))
+
+    def plan_updates(self, progress=None):
+        """Detect updates on every host and save them as a plan without changing anything"""
+        plan = self.fleet.create_plan(self.containers_by_host(), progress)
+        self.logger.info(
+            f"Plan {plan['id']}: {len(plan['containers'])} containers to update on {len(plan['hosts'])} hosts, "
+            f"{plan['download_bytes']} bytes to download"
+        )
+        for name, error in plan['errors'].items():
+            self.logger.error(f"Could not plan updates on host {name}: {error}")
+        return plan
+
+    def get_plan(self, plan_id):
+        return self.fleet.get_plan(plan_id)
+
+    def prefetch(self, plan):
+        """Download a plan's images on every host; returns one summary for the fleet"""
+        host_summaries = self.fleet.run_per_host(
+            lambda host: host.planner.prefetch(plan['hosts'][host.name]),
+            [host for host in self.fleet.hosts if host.name in plan['hosts']]
+        )
+        summary = {'plan_id': plan['id'], 'pulled': [], 'failed': [], 'already_local': 0, 'downloaded_bytes': 0}
+        for name, host_summary in host_summaries.items():
+            if isinstance(host_summary, Exception):
+                summary['failed'].append(f"{name}: {host_summary}")
+                continue
+            prefix = f"{name}/" if self.fleet.multi_host else ''
+            summary['pulled'] += [prefix + image for image in host_summary['pulled']]
+            summary['failed'] += [prefix + image for image in host_summary['failed']]
+            summary['already_local'] += host_summary['already_local']
+            summary['downloaded_bytes'] += host_summary['downloaded_bytes']
+        return summary
+
+    def update_container(self, item, container_config, host, progress=None):
+        """Redeploy one outdated container on a host and describe the outcome"""
+        result = {
+            'host': host.name,
+            'container_name': item['container_name'],
+            'old_image': item['container']['Image'],
+            'new_image': item['new_image'],
+            'timestamp': datetime.now().isoformat(),
+            'status': 'pending'
+        }
+        if progress:
+            progress(item['container_name'], 'redeploying')
+
+        try:
+            if item.get('error'):
+                # The new image never arrived, so the running container is left alone
+                result['status'] = 'failed'
+                result['error'] = item['error']
+            # Configuration was inspected in bulk for the whole cycle
+            elif not container_config:
+                result['status'] = 'failed'
+                result['error'] = 'Could not get container configuration'
+            else:
+                stats = {}
+                started = time.monotonic()
+                with log_context(container=item['container_name']):
+                    success = host.deployment_manager.redeploy_container(container_config, item['new_image'], stats)
+                result['duration_seconds'] = round(time.monotonic() - started, 3)
+                result.update(stats)
+                result['status'] = 'success' if success else 'failed'
+                if not success:
+                    result['error'] = 'Redeployment failed'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+
+        if progress:
+            progress(item['container_name'], result['status'], result.get('error'))
+        return result
+
+    def _apply_host(self, host, items, progress):
+        """Redeploy one host's part of a plan, then prune the images it superseded"""
+        progress = self.fleet.host_progress(host, progress)
+        # Inspect every candidate in one runtime call
+        container_configs = host.deployment_manager.get_container_configs([item['container'] for item in items])
+        # Redeploy them in dependency order, independent containers in parallel
+        results = host.deployment_manager.schedule_redeploys(
+            items,
+            lambda item: self.update_container(item, container_configs.get(item['container']['Id']), host, progress),
+            progress
+        )
+        return results, host.deployment_manager.prune_superseded_images(results)
+
+    def apply_plan(self, plan, progress=None, timings=None):
+        """Redeploy the containers of a plan without re-running detection; returns the cycle report
+
+        Raises StalePlanError (and counts a stale cycle) if the plan is out of date.
+        """
+        self.logger.info(f"Applying update plan {plan['id']}")
+
+        with METRICS.recording(timings) as timings:
+            try:
+                # Live inventories answer for free; otherwise only the hosts in the plan are listed
+                containers_by_host = self.containers_by_host() if self.inventories else None
+                prepared = self.fleet.prepare_apply(plan, containers_by_host, progress)
+            except StalePlanError as e:
+                self.logger.error(f"Refusing to apply stale plan {plan['id']}: {e}")
+                METRICS.record_cycle([], 'stale')
+                raise
+
+            # Hosts are redeployed concurrently, each within its own caps
+            host_results = self.fleet.run_per_host(
+                lambda host: self._apply_host(host, prepared[host.name], progress),
+                [host for host in self.fleet.hosts if host.name in prepared]
+            )
+            update_results = []
+            image_gc = {'removed_images': 0, 'reclaimed_bytes': 0}
+            hosts = {name: {'error': error} for name, error in plan.get('errors', {}).items()}
+            for name, host_result in host_results.items():
+                if isinstance(host_result, Exception):
+                    hosts[name] = {'error': str(host_result)}
+                    continue
+                results, pruned = host_result
+                update_results += results
+                image_gc['removed_images'] += len(pruned['removed'])
+                image_gc['reclaimed_bytes'] += pruned['reclaimed_bytes']
+                hosts[name] = {
+                    'updated': len([r for r in results if r['status'] == 'success']),
+                    'failed': len([r for r in results if r['status'] == 'failed']),
+                    'reclaimed_bytes': pruned['reclaimed_bytes']
+                }
+            METRICS.record_cycle(update_results)
+
+            # One report for the whole fleet, including where the cycle's time went
+            return self.report_generator.generate_report(update_results, {
+                'cycle_id': log_fields().get('cycle_id'),
+                'plan_id': plan['id'],
+                'download_bytes': plan.get('download_bytes'),
+                'image_gc': image_gc,
+                'hosts': hosts,
+                'timings': timings.summary()
+            })
+
+    def run_cycle(self, progress=None, plan=None):
+        """Plan (unless a saved plan is given) and apply it as one timed cycle; returns the report
+
+        The report's cycle_id matches the cycle_id field of the cycle's log records.
+        Raises StalePlanError for an outdated plan.
+        """
+        try:
+            # Every record logged during the cycle, from any thread, carries its id
+            with log_context(cycle_id=uuid.uuid4().hex[:12]), METRICS.recording() as timings, METRICS.span('cycle'):
+                plan = plan or self.plan_updates(progress)
+                self.logger.info(f"Found {len(plan['containers'])} containers with updates")
+                return self.apply_plan(plan, progress, timings)
+        except StalePlanError:
+            raise
+        except Exception:
+            METRICS.record_cycle([], 'failed')
+            raise
+
+    def save_cache(self):
+        self.fleet.save_cache()
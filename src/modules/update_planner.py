@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from modules.concurrency import bounded_map
+from modules.metrics import METRICS
+from modules.pull_scheduler import PRIORITY_APPLY, PRIORITY_PREFETCH
+from modules.registry_client import parse_image_reference
+
+
+class StalePlanError(Exception):
+    """Raised when a plan no longer matches the containers or the registry"""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problems))
+        self.problems = problems
+
+
+class UpdatePlanner:
+    """Splits an update cycle into a reusable plan and a later apply
+
+    A plan records which containers are outdated, the image digests they run
+    and will move to, the expected download size and the redeploy order. It
+    is cached in memory and written to the state directory so it can be
+    applied by id without running detection again.
+    """
+
+    def __init__(self, update_detector, deployment_manager, config=None):
+        autopatch_config = (config or {}).get('autopatch', {})
+        plans_config = autopatch_config.get('plans', {})
+        prefetch_config = autopatch_config.get('prefetch', {})
+        state_dir = autopatch_config.get('logging', {}).get('state_dir', os.path.join('logs', 'state'))
+
+        self.update_detector = update_detector
+        self.deployment_manager = deployment_manager
+        self.max_age = plans_config.get('max_age_seconds', 900)
+        self.keep = plans_config.get('keep', 20)
+        self.prefetch_parallel = prefetch_config.get('max_parallel', 2)
+        self.plan_dir = os.path.join(state_dir, 'plans')
+        self.logger = logging.getLogger('autopatch')
+
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    @METRICS.span('plan')
+    def create_plan(self, containers=None, progress=None, store=True):
+        """Run detection once (without downloading) and record the result as a plan
+
+        With store=False the plan is only returned, e.g. to be embedded in a fleet plan.
+        """
+        outdated = self.update_detector.get_outdated_containers(containers, progress, pull=False)
+        registry = self.update_detector.registry_client
+
+        sizes = {}
+        old_digests = {}
+        entries = []
+        # Layers already stored locally are not downloaded again
+        local_layers = self.update_detector.get_local_layers() if outdated else set()
+        for item in outdated:
+            container = item['container']
+            digest = item.get('new_digest')
+            if digest and digest not in sizes:
+                sizes[digest] = registry.get_download_size(item['new_image'], digest, local_layers)
+            old_image = container.get('ImageID') or container['Image']
+            if old_image not in old_digests:
+                old_digests[old_image] = sorted(self.update_detector.get_local_digests(old_image))
+            entries.append({
+                'container_id': container['Id'],
+                'container_name': item['container_name'],
+                'service': self.deployment_manager.service_name(item),
+                'image': item['new_image'],
+                'old_image_id': container.get('ImageID'),
+                'old_digests': old_digests[old_image],
+                'new_digest': digest,
+                'download_bytes': sizes.get(digest)
+            })
+
+        created_at = time.time()
+        plan = {
+            'id': uuid.uuid4().hex[:12],
+            'created_at': created_at,
+            'expires_at': created_at + self.max_age,
+            'containers': entries,
+            'order': [[item['container_name'] for item in level]
+                      for level in self.deployment_manager.plan_redeploy_order(outdated)],
+            'download_bytes': sum(size for size in sizes.values() if size)
+        }
+        if store:
+            self.store_plan(plan)
+        self.logger.info(f"Created update plan {plan['id']} for {len(entries)} containers")
+        return plan
+
+    def store_plan(self, plan):
+        """Keep a plan in memory and in the state directory, each holding the newest `keep` plans"""
+        with self._lock:
+            self._plans[plan['id']] = plan
+            while len(self._plans) > self.keep:
+                self._plans.popitem(last=False)
+        try:
+            os.makedirs(self.plan_dir, exist_ok=True)
+            with open(os.path.join(self.plan_dir, f"{plan['id']}.json"), 'w') as f:
+                json.dump(plan, f)
+            self._prune_plan_files()
+        except Exception as e:
+            self.logger.error(f"Error saving plan {plan['id']}: {e}")
+
+    def _prune_plan_files(self):
+        """Delete saved plans beyond the newest `keep` (other processes may have written some)"""
+        paths = [entry.path for entry in os.scandir(self.plan_dir) if entry.name.endswith('.json')]
+        if len(paths) <= self.keep:
+            return
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.keep:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Pruned concurrently by another planner
+                pass
+
+    def get_plan(self, plan_id):
+        """Return a plan from memory or the state directory, or None"""
+        with self._lock:
+            if plan_id in self._plans:
+                return self._plans[plan_id]
+
+        path = os.path.join(self.plan_dir, f"{os.path.basename(plan_id)}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def validate_plan(self, plan, containers):
+        """Return the reasons a plan can no longer be applied (empty when it is still current)"""
+        problems = []
+        if time.time() > plan['expires_at']:
+            problems.append(f"plan {plan['id']} expired {int(time.time() - plan['expires_at'])}s ago")
+
+        running = {container['Id']: container for container in containers}
+        for entry in plan['containers']:
+            container = running.get(entry['container_id'])
+            if container is None:
+                problems.append(f"{entry['container_name']} is no longer running")
+            elif entry['old_image_id'] and container.get('ImageID') != entry['old_image_id']:
+                problems.append(f"{entry['container_name']} changed image since planning")
+
+        if self.update_detector.mode == 'pull':
+            return problems
+
+        # Registry lookups are served from the manifest cache, so this stays cheap
+        for image, digest in {(e['image'], e['new_digest']) for e in plan['containers'] if e['new_digest']}:
+            current = self.update_detector.registry_client.get_remote_digest(image)
+            if current and current != digest:
+                problems.append(f"{image} moved to {current} since planning")
+        return problems
+
+    @METRICS.span('prepare')
+    def prepare_apply(self, plan, containers, progress=None):
+        """Check a plan is still current and download its images
+
+        Returns outdated-container items ready for the redeploy scheduler, in
+        plan order. Items whose image could not be pulled carry an `error` and
+        are reported as failed rather than redeployed. Raises StalePlanError
+        instead of applying an outdated plan.
+        """
+        problems = self.validate_plan(plan, containers)
+        if problems:
+            raise StalePlanError(problems)
+
+        sizes = self._download_sizes(plan)
+        pull_errors = {}
+        for image, digest in self._missing_images(plan):
+            if progress:
+                progress(None, 'pulling', image)
+            if not self.update_detector.pull_image(image, PRIORITY_APPLY, sizes.get(digest), pull_errors):
+                # A registry or network failure, not a stale plan: only this image's containers fail
+                pull_errors.setdefault(image, 'pull failed')
+                continue
+            if digest and self.update_detector.mode != 'pull' and digest not in self.update_detector.get_local_digests(image):
+                raise StalePlanError([f"{image} no longer resolves to the planned digest {digest}"])
+
+        running = {container['Id']: container for container in containers}
+        items = []
+        for entry in plan['containers']:
+            item = {
+                'container': running[entry['container_id']],
+                'container_name': entry['container_name'],
+                'new_image': entry['image'],
+                'new_digest': entry['new_digest']
+            }
+            if entry['image'] in pull_errors:
+                item['error'] = f"Could not pull {entry['image']}: {pull_errors[entry['image']]}"
+            items.append(item)
+        return items
+
+    @staticmethod
+    def _download_sizes(plan):
+        """Compressed bytes per new digest, as recorded when the plan was made"""
+        return {e['new_digest']: e['download_bytes'] for e in plan['containers'] if e['new_digest']}
+
+    def _missing_images(self, plan):
+        """(image, digest) pairs of a plan that are not yet in local storage"""
+        missing = []
+        for image, digest in sorted({(e['image'], e['new_digest'] or '') for e in plan['containers']}):
+            if digest and digest in self.update_detector.get_local_digests(image):
+                continue
+            missing.append((image, digest or None))
+        return missing
+
+    @METRICS.span('prefetch')
+    def prefetch(self, plan, progress=None):
+        """Pull a plan's images ahead of time so applying it only swaps containers
+
+        Images already stored locally are skipped. Pulls run a few at a time so
+        prefetching leaves bandwidth for the workloads still running.
+        """
+        missing = self._missing_images(plan)
+        sizes = self._download_sizes(plan)
+        summary = {'plan_id': plan['id'], 'pulled': [], 'failed': [], 'already_local': 0, 'downloaded_bytes': 0}
+        summary['already_local'] = len({e['image'] for e in plan['containers']}) - len(missing)
+
+        def pull(entry):
+            image, digest = entry
+            if progress:
+                progress(None, 'pulling', image)
+            if not self.update_detector.pull_image(image, PRIORITY_PREFETCH, sizes.get(digest)):
+                return False
+            # The tag may have moved since planning; the apply re-checks it anyway
+            return not digest or self.update_detector.mode == 'pull' or \
+                digest in self.update_detector.get_local_digests(image)
+
+        results = bounded_map(pull, missing,
+                              key=lambda entry: parse_image_reference(entry[0])[0],
+                              max_workers=self.prefetch_parallel)
+        for (image, digest), pulled in zip(missing, results):
+            if pulled:
+                summary['pulled'].append(image)
+                summary['downloaded_bytes'] += sizes.get(digest) or 0
+            else:
+                summary['failed'].append(image)
+
+        self.logger.info(
+            f"Prefetched {len(summary['pulled'])} images for plan {plan['id']} "
+            f"({summary['already_local']} already local, {len(summary['failed'])} failed)"
+        )
+        return summary